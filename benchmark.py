@@ -0,0 +1,375 @@
+'''
+Benchmarks of the simulation engine and the input and output paths, swept
+    over simulation counts, network sizes, location counts and patient ages.
+    Results are written as JSON so runs before and after a change can be
+    compared with --compare.
+'''
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import data_io
+import main
+import synthetic_inputs
+from stroke import (ais_outcomes, cohort, constants, network, patient,
+                    results, stroke_model as sm)
+
+DATA_DIR = Path(__file__).parent / 'data'
+DEMO_HOSPITALS = DATA_DIR / 'hospitals' / 'Demo.csv'
+DEMO_TIMES = DATA_DIR / 'travel_times' / 'Demo_n=100.csv'
+
+# Parameters swept by each benchmark, and smaller ones for a quick check
+SWEEPS = {
+    'full': {
+        'simulations': [100, 1000, 10000],
+        'hospitals': [(4, 2), (20, 6), (60, 20)],
+        'locations': [10, 50, 100],
+        'ages': [40, 65, 85],
+        'times_locations': [1000, 10000],
+        'hospital_counts': [20, 200],
+        'result_locations': [100, 1000],
+    },
+    'quick': {
+        'simulations': [100, 1000],
+        'hospitals': [(4, 2), (20, 6)],
+        'locations': [10],
+        'ages': [65],
+        'times_locations': [200],
+        'hospital_counts': [20],
+        'result_locations': [100],
+    },
+}
+
+
+def measure(function, scenarios=1, repeat=3):
+    '''
+    Time a function of no arguments, returning the best wall time of repeat
+        calls, scenarios run per second at that time and the peak memory
+        traced by tracemalloc, which numpy reports its arrays to. Memory is
+        traced in one extra call, so tracing doesn't slow the timed calls.
+        scenarios -- units of work done by a call: scenarios for the model,
+                     locations read or written for input and output
+    '''
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'scenarios': scenarios,
+            'scenarios_per_second': scenarios / seconds,
+            'peak_memory_bytes': peak}
+
+
+def demo_hospitals(hospital_file):
+    '''
+    Copy data/hospitals/Demo.csv to hospital_file with the column names
+        data_io.get_hospitals reads
+    '''
+    df = pd.read_csv(DEMO_HOSPITALS).rename(columns={
+        'CenterID': 'HOSP_KEY', 'destinationID': 'destination_KEY'})
+    df.to_csv(hospital_file, index=False)
+    return hospital_file
+
+
+def bench_run(sweep, work_dir, repeat):
+    '''StrokeModel.run by simulation count, network size and age'''
+    for (primaries, comprehensives), age in itertools.product(
+            sweep['hospitals'], sweep['ages']):
+        hospitals = _synthetic_hospitals(work_dir, primaries, comprehensives)
+        model = sm.StrokeModel(_patient(age), hospitals)
+        model.set_times({hospital.center_id: _travel_time(i)
+                         for i, hospital in enumerate(hospitals)})
+        for n in sweep['simulations']:
+            _, markov, _ = model.run(n)
+            yield ({'simulations': n, 'hospitals': len(hospitals),
+                    'strategies': len(markov.strategies), 'age': age},
+                   measure(lambda: model.run(n), repeat=repeat))
+
+
+def bench_results(sweep, work_dir, repeat):
+    '''results.Results from an analyzed Population'''
+    for primaries, comprehensives in sweep['hospitals']:
+        hospitals = _synthetic_hospitals(work_dir, primaries, comprehensives)
+        model = sm.StrokeModel(_patient(65), hospitals)
+        model.set_times({hospital.center_id: _travel_time(i)
+                         for i, hospital in enumerate(hospitals)})
+        for n in sweep['simulations']:
+            _, markov, ais_times = model.run(n)
+
+            def tabulate():
+                # ties are broken by sampled travel times, as in the model
+                mean_times = [np.mean(ais_times.travel_time(s.center))
+                              for s in markov.strategies]
+                ranks = results.strategy_ranks(markov.strategies, mean_times)
+                results.Results(markov, ranks=ranks)
+            yield ({'simulations': n, 'strategies': len(markov.strategies)},
+                   measure(tabulate, repeat=repeat))
+
+
+def bench_analyze(sweep, work_dir, repeat):
+    '''cohort.Population.analyze by method, simulation count and age'''
+    primaries, comprehensives = sweep['hospitals'][-1]
+    hospitals = _synthetic_hospitals(work_dir, primaries, comprehensives)
+    for age, n in itertools.product(sweep['ages'], sweep['simulations']):
+        this_patient = _patient(age)
+        model = sm.StrokeModel(this_patient, hospitals)
+        model.set_times({hospital.center_id: _travel_time(i)
+                         for i, hospital in enumerate(hospitals)})
+        _, markov, ais_times = model.run(n)
+        outcomes = ais_outcomes.IschemicModel(
+            ais_times).run_all_strategies()
+        for method in ['affine', 'streaming']:
+            yield ({'method': method, 'simulations': n,
+                    'strategies': len(markov.strategies), 'age': age},
+                   measure(lambda: cohort.Population(
+                       this_patient, outcomes).analyze(method=method),
+                           repeat=repeat))
+
+
+def bench_locations(sweep, work_dir, repeat):
+    '''Scenarios at the locations of Demo_n=100.csv, as main runs them'''
+    hospitals = data_io.get_hospitals(
+        demo_hospitals(Path(work_dir) / 'demo_hospitals.csv'))
+    times = data_io.get_times(_copy(DEMO_TIMES, work_dir))
+    hospital_network = network.HospitalNetwork(hospitals)
+    points = list(times)
+    for locations, n in itertools.product(sweep['locations'],
+                                          sweep['simulations']):
+        def run_locations():
+            for point in points[:locations]:
+                main.run_one_scenario(_patient(65), point, times[point],
+                                      hospital_network, False, n, False)
+        yield ({'locations': locations, 'simulations': n,
+                'hospitals': len(hospitals)},
+               measure(run_locations, scenarios=locations, repeat=repeat))
+
+
+def bench_get_times(sweep, work_dir, repeat):
+    '''data_io.get_times parsing a file, and loading it from the cache'''
+    files = [(DEMO_TIMES.stem, _copy(DEMO_TIMES, work_dir))]
+    region = synthetic_inputs.SyntheticRegion(50)
+    for locations in sweep['times_locations']:
+        times_file = Path(work_dir) / f'times_{locations}.csv'
+        synthetic_inputs.write_times(times_file, region, locations,
+                                     pair_share=0.5)
+        files.append((times_file.stem, times_file))
+    for name, times_file in files:
+        locations = len(pd.read_csv(times_file, usecols=[0]))
+        for cache in ['cold', 'warm']:
+            def get_times():
+                if cache == 'cold':
+                    _remove_caches(times_file)
+                data_io.get_times(times_file)
+            get_times() # so a warm load finds the cache
+            yield ({'file': name, 'locations': locations, 'cache': cache},
+                   measure(get_times, scenarios=locations, repeat=repeat))
+
+
+def bench_get_hospitals(sweep, work_dir, repeat):
+    '''data_io.get_hospitals for Demo.csv and larger synthetic files, with
+        and without hospital performance data'''
+    files = [(DEMO_HOSPITALS.stem,
+              demo_hospitals(Path(work_dir) / 'demo_hospitals.csv'), None)]
+    for count in sweep['hospital_counts']:
+        region = synthetic_inputs.SyntheticRegion(count)
+        hospital_file = Path(work_dir) / f'hospitals_{count}.csv'
+        dtn_file = Path(work_dir) / f'dtn_{count}.csv'
+        region.hospital_table().to_csv(hospital_file, index=False)
+        region.performance_table().to_csv(dtn_file, index=False)
+        files += [(hospital_file.stem, hospital_file, None),
+                  (hospital_file.stem, hospital_file, dtn_file)]
+    for name, hospital_file, dtn_file in files:
+        count = len(pd.read_csv(hospital_file))
+        yield ({'file': name, 'hospitals': count,
+                'performance_data': dtn_file is not None},
+               measure(lambda: data_io.get_hospitals(hospital_file,
+                                                     dtn_file),
+                       repeat=repeat))
+
+
+def bench_save_patient(sweep, work_dir, repeat):
+    '''data_io.save_patient writing a patient's rows in each layout'''
+    hospitals = [f'H{i} (PSC)' for i in range(20)]
+    rng = np.random.default_rng(0)
+    for locations, layout in itertools.product(sweep['result_locations'],
+                                               ['wide', 'long']):
+        rows = []
+        for i in range(locations):
+            counts = rng.multinomial(1000, np.full(len(hospitals),
+                                                   1 / len(hospitals)))
+            row = {'Location': f'L{i}', 'Patient': 0, 'Use Real DTN': False,
+                   'Varying Hospitals': True, 'PSC Count': len(hospitals),
+                   'CSC Count': 0, 'Sex': 'male', 'Age': 65,
+                   'Symptoms': 60, 'RACE': 5, 'NIHSS': 10,
+                   'Simulations': 1000}
+            row.update(zip(hospitals, counts.tolist()))
+            rows.append(row)
+        outfile = Path(work_dir) / f'results_{layout}.csv'
+
+        def save():
+            if outfile.is_file():
+                os.remove(outfile)
+            data_io.save_patient(outfile, rows, hospitals, layout)
+        yield ({'locations': locations, 'layout': layout},
+               measure(save, scenarios=locations, repeat=repeat))
+
+
+BENCHMARKS = {
+    'run': bench_run,
+    'results': bench_results,
+    'analyze': bench_analyze,
+    'locations': bench_locations,
+    'get_times': bench_get_times,
+    'get_hospitals': bench_get_hospitals,
+    'save_patient': bench_save_patient,
+}
+
+
+def run_benchmarks(names=None, sweep='full', repeat=3):
+    '''
+    Run the named benchmarks, all by default, in a temporary directory.
+        sweep -- 'full' or 'quick', or a dictionary like SWEEPS['full']
+    Returns a dictionary with the environment and a list of records, one
+        per benchmark and set of parameters.
+    '''
+    if isinstance(sweep, str):
+        sweep = SWEEPS[sweep]
+    records = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in names or list(BENCHMARKS):
+            for params, measured in BENCHMARKS[name](sweep, work_dir,
+                                                     repeat):
+                records.append(dict(benchmark=name, params=params,
+                                    **measured))
+    return {'environment': environment(), 'results': records}
+
+
+def environment():
+    '''Versions and machine details to tell benchmark runs apart'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__,
+            'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def compare(baseline, current, tolerance=1.25):
+    '''
+    Compare benchmark records with a baseline run, matching them by
+        benchmark and parameters. Returns a list of (benchmark, params,
+        time ratio, memory ratio), and the ones whose wall time grew by
+        more than tolerance times.
+    '''
+    old = {_record_key(record): record for record in baseline['results']}
+    ratios = []
+    regressions = []
+    for record in current['results']:
+        before = old.get(_record_key(record))
+        if before is None:
+            continue
+        ratio = (record['benchmark'], record['params'],
+                 record['seconds'] / before['seconds'],
+                 record['peak_memory_bytes'] /
+                 max(before['peak_memory_bytes'], 1))
+        ratios.append(ratio)
+        if ratio[2] > tolerance:
+            regressions.append(ratio)
+    return ratios, regressions
+
+
+def _record_key(record):
+    return record['benchmark'], json.dumps(record['params'], sort_keys=True)
+
+
+def _patient(age):
+    return patient.Patient.with_RACE(constants.Sex.MALE, age, 60, 5)
+
+
+def _travel_time(i):
+    '''Travel time bounds of the ith hospital, every hospital in reach'''
+    time = 10 + 7 * (i % 13)
+    return [time, time * 1.2]
+
+
+def _synthetic_hospitals(work_dir, primaries, comprehensives):
+    hospital_file = Path(work_dir) / f'hospitals_{primaries}_' \
+        f'{comprehensives}.csv'
+    if not hospital_file.is_file():
+        count = primaries + comprehensives
+        region = synthetic_inputs.SyntheticRegion(count,
+                                                  comprehensives / count)
+        region.hospital_table().to_csv(hospital_file, index=False)
+    return data_io.get_hospitals(hospital_file)
+
+
+def _copy(path, work_dir):
+    '''Copy an input file, so its caches are written in work_dir'''
+    return Path(shutil.copy(path, Path(work_dir) / Path(path).name))
+
+
+def _remove_caches(times_file):
+    times_file = Path(times_file)
+    for cache in times_file.parent.glob(times_file.name + '.*'):
+        os.remove(cache)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'benchmarks', nargs='*',
+        help=f'benchmarks to run, of {", ".join(BENCHMARKS)} (default all)')
+    parser.add_argument(
+        '--quick', action='store_true',
+        help='sweep fewer and smaller parameters')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='timed calls of each case, the best is kept (default 3)')
+    parser.add_argument(
+        '-o', '--output', help='file to write the JSON results to')
+    parser.add_argument(
+        '--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument(
+        '--tolerance', type=float, default=1.25,
+        help='time ratio to a --compare run counted as a regression')
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks {", ".join(sorted(unknown))}')
+
+    report = run_benchmarks(args.benchmarks,
+                            'quick' if args.quick else 'full', args.repeat)
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            ratios, regressions = compare(json.load(f), report,
+                                          args.tolerance)
+        for name, params, time_ratio, memory_ratio in ratios:
+            print(f'{name} {json.dumps(params, sort_keys=True)}: '
+                  f'time x{time_ratio:.2f}, memory x{memory_ratio:.2f}')
+        if regressions:
+            raise SystemExit(f'{len(regressions)} benchmarks slower than '
+                             f'x{args.tolerance} of the baseline')
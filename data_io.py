@@ -5,14 +5,14 @@ import csv
 import os
 import warnings
 
-from regex import P
 import stroke.stroke_center as sc
 import pandas as pd
 import gc
 if os.name == 'nt': import xlwings as xw
 from pathlib import Path
 import paths
-from stroke import constants
+import travel_times
+from stroke import constants, timing
 import numpy as np
 
 def get_hospitals(hospital_file, dtn_file=None):
@@ -120,24 +120,10 @@ def get_times(times_file):
         file. Outer keys are location IDs, inner dictionaries have hospital IDs
         as keys and travel times as values. The input file is assumed to be
         formatted like `data/travel_times/Demo.csv`.
+    Travel times are parsed with travel_times.load_travel_times, which
+        caches them next to the file. Use it directly to get them as arrays.
     '''
-    def _parse_time(time_val):
-        if ',' in time_val: # two travel times
-            time_arr = [float(t.strip()) for t in time_val.split(',')]
-            if len(time_arr) != 2:
-                err_msg = 'Time value needs to be in format of'
-                err_msg += 'no_traffic_time, traffic_time or just one number'
-                raise ValueError(err_msg)
-            return [np.min(time_arr),np.max(time_arr)]
-        else:
-            val = float(time_val)
-            return [val,val]
-    
-    # Read in travel times file
-    times = pd.read_csv(times_file,dtype=str,low_memory=False).set_index('LOC_ID')
-    times = times.astype(str)
-    times = times.applymap(_parse_time)
-    return times.to_dict('index') # returns a dictionary
+    return travel_times.load_travel_times(times_file).to_dict()
 
 def get_next_patient_number(results_file):
     '''
@@ -159,8 +145,11 @@ def get_next_patient_number(results_file):
         return 0
 
 
-def write_detailed_markov_outcomes(markov, fileprefix, point, times=None,
-                                   optimal_strategy = None, write=False):
+SUMMARY_STATISTICS = ['count', 'mean', 'std', 'min', '25%', '50%', '75%',
+                      'max']
+
+
+def _outcome_path(fileprefix, point, suffix):
     filedir = Path(fileprefix)
     fileparent_dir = filedir.parent
     filename_prefix = filedir.stem + f'_loc={point}'
@@ -170,16 +159,15 @@ def write_detailed_markov_outcomes(markov, fileprefix, point, times=None,
     param_list[-2] = param_list[-1]
     param_list[-1] = tmp_version
     filename_prefix = '_'.join(param_list)
+    return fileparent_dir / (filename_prefix + suffix)
+
 
+def write_detailed_markov_outcomes(markov, fileprefix, point, times=None,
+                                   optimal_strategy = None, write=False):
     # List of all strategies
     strategies = [str(strategy) for strategy in markov.strategies]
-    print('k233', strategies.index('Comprehensive to K233 (CSC)'))
-    print('k199', strategies.index('Comprehensive to K199 (CSC)'))
 
     qalys_df = pd.DataFrame(markov.qalys, columns=strategies)
-    print(qalys_df)
-
-
     costs_df = pd.DataFrame(markov.costs, columns=strategies)
     lys_df = pd.DataFrame(markov.lys, columns=strategies)
 
@@ -192,9 +180,9 @@ def write_detailed_markov_outcomes(markov, fileprefix, point, times=None,
     df.index.name = 'Simulation'
     if times is not None:
         times_df = get_times_df(times)
-        df = df.append(times_df)
+        df = pd.concat([df, times_df], axis=0)
     out_cols = ['Variable'] + strategies
-    outpath = fileparent_dir / (filename_prefix + '_detailed_outcome.csv')
+    outpath = _outcome_path(fileprefix, point, '_detailed_outcome.csv')
     df_out = df[out_cols]
     if optimal_strategy:
         df_out.columns = [c + ' - most C/E' if c == optimal_strategy else c
@@ -203,25 +191,196 @@ def write_detailed_markov_outcomes(markov, fileprefix, point, times=None,
     return df_out, outpath
 
 def write_aggregated_markov_outcomes(markov, fileprefix, point, times=None, optimal_strategy = None
-    , write = True):
-    df, outpath =  write_detailed_markov_outcomes(markov, fileprefix, point, times)
-    agg_df = df.groupby('Variable').describe()
-    if optimal_strategy:
-        # label which strategy is optimal in agg_df
-        # reconstruct column multi index
-        c_l = []
-        for c in agg_df.columns:
-            new_c = list(c)
-            if new_c[0] == optimal_strategy:
-                new_c[0] = optimal_strategy + ' - most C/E'
-            c_l.append(tuple(new_c))
-        agg_df.columns = pd.MultiIndex.from_tuples(c_l)
-    agg_df.columns.names=['Strategy','statistic']
-    agg_outpath = outpath.parent/(outpath.stem.replace('detailed','aggregated')+outpath.suffix)
-    if write: agg_df.to_csv(agg_outpath)
+    , write = True, per_location_file=False):
+    '''Summarize the outcomes of each strategy across simulations, as
+        groupby('Variable').describe() would on the detailed outcomes, but
+        computed directly from the simulation arrays. Summaries are appended
+        to the outcome store next to fileprefix (see write_outcomes), or to
+        a CSV for this location if per_location_file is set.'''
+    names, strategies, stats = aggregate_outcomes(markov, times)
+    columns = [
+        optimal_strategy + ' - most C/E' if s == optimal_strategy else s
+        for s in strategies
+    ]
+    agg_df = pd.DataFrame(
+        stats.reshape(len(names), -1),
+        index=pd.Index(names, name='Variable'),
+        columns=pd.MultiIndex.from_product(
+            [columns, SUMMARY_STATISTICS], names=['Strategy', 'statistic']))
+    if write and not per_location_file:
+        store = outcome_store_path(fileprefix)
+        profile, variant = outcome_partition(fileprefix)
+        rows = outcome_rows(point, names, strategies, stats,
+                            optimal_strategy)
+        agg_outpath = write_outcomes(store, profile, variant, rows)
+        return agg_df, agg_outpath
+    agg_outpath = _outcome_path(fileprefix, point, '_aggregated_outcome.csv')
+    if write:
+        with timing.stage('write outcomes'):
+            agg_df.to_csv(agg_outpath)
+        if timing.enabled():
+            timing.count('bytes written', _written_size(agg_outpath))
     return agg_df, agg_outpath
 
 
+def aggregate_outcomes(markov, times=None):
+    '''Variable names, strategy names and summary statistics shaped
+        (variables, strategies, statistics)'''
+    with timing.stage('aggregate outcomes'):
+        strategies, variables = _outcome_variables(markov, times)
+        names = sorted(variables)
+        stats = np.stack([summary_statistics(variables[name])
+                          for name in names])
+    return names, strategies, stats
+
+
+def _outcome_variables(markov, times=None):
+    '''Strategy names and a dictionary of (simulations x strategies) arrays
+        by variable name'''
+    strategies = [str(strategy) for strategy in markov.strategies]
+    variables = {
+        'Cost': markov.costs,
+        'LY': markov.lys,
+        'QALY': markov.qalys,
+        'pgood': markov.ais_outcomes.p_good,
+    }
+    if times is not None:
+        variables['onset_to_treatment_time'] = _onset_times(times, strategies)
+    return strategies, variables
+
+
+class OutcomeSummary:
+    '''
+    Summary statistics of outcomes added chunk by chunk, as from
+        StrokeModel.run_chunked, without keeping every model run. Counts,
+        means, standard deviations, minima and maxima are exact. Quartiles
+        come from a sample of about sample_size model runs taken evenly from
+        every chunk, so they're exact when all n runs fit in the sample.
+    '''
+
+    def __init__(self, n, sample_size=10000):
+        '''n -- total number of model runs to be added'''
+        self.n = n
+        self.sample_size = sample_size
+        self.strategies = None
+        self._moments = {}
+        self._samples = {}
+
+    def add(self, markov, times=None):
+        '''Add the outcomes of a chunk of model runs'''
+        with timing.stage('aggregate outcomes'):
+            self._add(markov, times)
+
+    def _add(self, markov, times):
+        strategies, variables = _outcome_variables(markov, times)
+        if self.strategies is None:
+            self.strategies = strategies
+        elif strategies != self.strategies:
+            raise ValueError('Chunks have different strategies')
+        for name, values in variables.items():
+            values = np.asarray(values, dtype=float)
+            moments = _moments(values)
+            if name in self._moments:
+                moments = _merge_moments(self._moments[name], moments)
+            self._moments[name] = moments
+            keep = int(np.ceil(self.sample_size * len(values) / self.n))
+            self._samples.setdefault(name, []).append(values[:keep])
+
+    def aggregate(self):
+        '''Variable names, strategy names and summary statistics shaped
+            (variables, strategies, statistics), like aggregate_outcomes'''
+        names = sorted(self._moments)
+        stats = np.stack([self._statistics(name) for name in names])
+        return names, self.strategies, stats
+
+    def _statistics(self, name):
+        count, mean, m2, low, high = self._moments[name]
+        stats = summary_statistics(np.concatenate(self._samples[name]))
+        stats[:, 0] = count
+        has_values = count > 0
+        stats[has_values, 1] = mean[has_values]
+        stats[has_values, 3] = low[has_values]
+        stats[has_values, 7] = high[has_values]
+        has_spread = count > 1
+        stats[has_spread, 2] = np.sqrt(m2[has_spread] /
+                                       (count[has_spread] - 1))
+        return stats
+
+
+def _moments(values):
+    '''Count, mean, sum of squared deviations, min and max of each column,
+        ignoring NaN'''
+    count = np.sum(~np.isnan(values), axis=0)
+    has_values = count > 0
+    mean = np.zeros(values.shape[1])
+    m2 = np.zeros(values.shape[1])
+    low = np.full(values.shape[1], np.inf)
+    high = np.full(values.shape[1], -np.inf)
+    if has_values.any():
+        values = values[:, has_values]
+        mean[has_values] = np.nanmean(values, axis=0)
+        m2[has_values] = np.nansum((values - mean[has_values])**2, axis=0)
+        low[has_values] = np.nanmin(values, axis=0)
+        high[has_values] = np.nanmax(values, axis=0)
+    return count, mean, m2, low, high
+
+
+def _merge_moments(first, second):
+    '''Moments of two sets of model runs together, with the pairwise update
+        of Chan et al.'''
+    count_a, mean_a, m2_a, low_a, high_a = first
+    count_b, mean_b, m2_b, low_b, high_b = second
+    count = count_a + count_b
+    share_b = np.divide(count_b, count, out=np.zeros(len(count)),
+                        where=count > 0)
+    delta = mean_b - mean_a
+    mean = mean_a + delta * share_b
+    m2 = m2_a + m2_b + delta**2 * count_a * share_b
+    return (count, mean, m2, np.minimum(low_a, low_b),
+            np.maximum(high_a, high_b))
+
+
+def summary_statistics(values):
+    '''Count, mean, standard deviation, min, quartiles and max of each
+        column of a (simulations x strategies) array, ignoring NaN like
+        DataFrame.describe. Returns an array shaped (strategies, 8).'''
+    values = np.asarray(values, dtype=float)
+    stats = np.full((values.shape[1], len(SUMMARY_STATISTICS)), np.NaN)
+    count = np.sum(~np.isnan(values), axis=0)
+    stats[:, 0] = count
+    has_values = count > 0
+    if has_values.any():
+        values = values[:, has_values]
+        quartiles = np.nanpercentile(values, [25, 50, 75], axis=0)
+        stats[has_values, 1] = np.nanmean(values, axis=0)
+        stats[has_values, 3] = np.nanmin(values, axis=0)
+        stats[has_values, 4:7] = quartiles.T
+        stats[has_values, 7] = np.nanmax(values, axis=0)
+    has_spread = count > 1
+    if has_spread.any():
+        stats[has_spread, 2] = np.nanstd(values[:, has_spread[has_values]],
+                                         axis=0, ddof=1)
+    return stats
+
+
+def _onset_times(times, strategies):
+    '''Onset to treatment times as a (simulations x strategies) array, NaN
+        for strategies without a time'''
+    columns = {}
+    for kind, kind_times in [
+        (constants.StrategyKind.PRIMARY, times.onset_needle_primary),
+        (constants.StrategyKind.DRIP_AND_SHIP, times.onset_evt_ship),
+        (constants.StrategyKind.COMPREHENSIVE,
+         times.onset_needle_comprehensive),
+    ]:
+        kind_times = np.asarray(kind_times, dtype=float)
+        for i, strategy in enumerate(times.get_strategies(kind)):
+            columns[str(strategy)] = kind_times[:, i]
+    n = len(next(iter(columns.values()))) if columns else 0
+    missing = np.full(n, np.NaN)
+    return np.stack([columns.get(s, missing) for s in strategies], axis=1)
+
+
 def write_out_times(times, fileprefix, point):
     filedir = Path(fileprefix)
     fileparent_dir = filedir.parent
@@ -281,44 +440,321 @@ def get_times_df(times):
     return df
 
 
-def save_patient(outfile, patient_results, hospitals):
+OUTCOME_STORE = 'outcomes'
+OUTCOME_KEYS = ['Location', 'Variable', 'Strategy']
+OUTCOME_COLUMNS = OUTCOME_KEYS + ['Most C/E'] + SUMMARY_STATISTICS
+
+
+def outcome_store_path(fileprefix):
+    '''Outcome store for result files named like fileprefix'''
+    return Path(fileprefix).parent / OUTCOME_STORE
+
+
+def outcome_partition(fileprefix):
+    '''
+    Split a result file name into its patient profile and AHA variant,
+        e.g. 'times=..._age=75_nsim=2000_beAHA.csv' gives
+        ('times=..._age=75_nsim=2000', 'beAHA')
+    '''
+    stem = Path(fileprefix).stem
+    profile, _, variant = stem.rpartition('_')
+    if not profile:
+        return stem, ''
+    return profile, variant
+
+
+def outcome_rows(point, names, strategies, stats, optimal_strategy=None):
+    '''
+    Outcome summaries for one location as rows for write_outcomes, one per
+        variable and strategy.
+        stats -- shaped (variables, strategies, statistics), as from
+                 aggregate_outcomes
+    '''
+    keys = pd.MultiIndex.from_product([[str(point)], names, strategies],
+                                      names=OUTCOME_KEYS)
+    df = pd.DataFrame(np.reshape(stats, (-1, len(SUMMARY_STATISTICS))),
+                      index=keys, columns=SUMMARY_STATISTICS)
+    df.insert(0, 'Most C/E',
+              df.index.get_level_values('Strategy') == optimal_strategy)
+    return df.reset_index()
+
+
+def write_outcomes(store, profile, variant, rows):
+    '''
+    Append outcome rows to the store. The store is a directory with a
+        subdirectory per patient profile and AHA variant. Each process
+        appends to its own part file in a partition, with all rows of a call
+        written at once, so workers can share the store and write a batch
+        of locations together.
+        rows -- DataFrame from outcome_rows, or a list of them
+    Returns the part file written to.
+    '''
+    if isinstance(rows, list):
+        rows = pd.concat(rows, ignore_index=True)
+    partition = Path(store) / profile / (variant or '_')
+    partition.mkdir(parents=True, exist_ok=True)
+    outpath = partition / f'part-{os.getpid()}.csv'
+    new_file = not outpath.is_file()
+    with timing.stage('write outcomes'):
+        text = rows[OUTCOME_COLUMNS].to_csv(header=new_file,
+                                            index=False).encode()
+        fd = os.open(outpath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, text)
+        finally:
+            os.close(fd)
+    timing.count('bytes written', len(text))
+    return outpath
+
+
+def read_outcomes(store, profile=None, variant=None, locations=None):
+    '''
+    Read outcome summaries from the store, optionally only for a patient
+        profile, AHA variant or list of locations. Returns a DataFrame
+        indexed by profile, variant, location, variable and strategy.
+        Summaries written more than once keep the most recent.
+    '''
+    store = Path(store)
+    profiles = [profile] if profile is not None else sorted(
+        p.name for p in store.iterdir() if p.is_dir())
+    if locations is not None:
+        locations = set(str(location) for location in locations)
+    frames = []
+    for this_profile in profiles:
+        variant_dirs = [store / this_profile / (variant or '_')] \
+            if variant is not None else sorted(
+                p for p in (store / this_profile).iterdir() if p.is_dir())
+        for variant_dir in variant_dirs:
+            for part in sorted(variant_dir.glob('part-*.csv')):
+                df = pd.read_csv(part, dtype={'Location': str})
+                if locations is not None:
+                    df = df[df['Location'].isin(locations)]
+                df['Profile'] = this_profile
+                df['Variant'] = '' if variant_dir.name == '_' \
+                    else variant_dir.name
+                frames.append(df)
+    index = ['Profile', 'Variant'] + OUTCOME_KEYS
+    if not frames:
+        return pd.DataFrame(columns=index + OUTCOME_COLUMNS[3:]).set_index(
+            index)
+    df = pd.concat(frames, ignore_index=True)
+    df = df.drop_duplicates(subset=index, keep='last')
+    return df.set_index(index)[OUTCOME_COLUMNS[3:]]
+
+
+def compact_outcomes(store):
+    '''
+    Merge the part files of each partition of the store into one, keeping
+        the most recent summary of each location, variable and strategy
+    '''
+    for partition in sorted(Path(store).glob('*/*')):
+        parts = sorted(partition.glob('part-*.csv'))
+        if len(parts) < 2:
+            continue
+        df = pd.concat([pd.read_csv(part, dtype={'Location': str})
+                        for part in parts], ignore_index=True)
+        df = df.drop_duplicates(subset=OUTCOME_KEYS, keep='last')
+        tmp_file = partition / 'compacted.tmp'
+        df[OUTCOME_COLUMNS].to_csv(tmp_file, index=False)
+        for part in parts:
+            os.remove(part)
+        os.replace(tmp_file, partition / 'part-0.csv')
+
+
+RESULT_KEYS = ['Location', 'Patient', 'Use Real DTN', 'Varying Hospitals',
+               'Sex', 'Age', 'RACE', 'NIHSS', 'Symptoms']
+RESULT_COUNT_COLS = ['PSC Count', 'CSC Count', 'Simulations']
+LONG_RESULT_COLUMNS = RESULT_KEYS + RESULT_COUNT_COLS + ['Hospital', 'Count']
+
+
+def save_patient(outfile, patient_results, hospitals, layout='wide'):
     '''
     Write the results from a single patient at many locations to the given
         file. Results should be a list of dictionaries, one for each row
         of the output where keys are column names.
-    Will append to an existing result file if one exists
+    Rows are appended to the result file, creating it if needed, so each
+        save only costs time for the new rows. Rows for a scenario that was
+        already saved are kept until compact_results is run.
+    layout -- 'wide' for one count column per hospital (the original CSV
+              format), or 'long' for one row per reachable hospital. Files
+              ending in .parquet are always long, written as a directory of
+              part files (needs pyarrow).
     '''
-    # If not result file currentl exists, create a blank one
+    size = _written_size(outfile) if timing.enabled() else 0
+    with timing.stage('save patient'):
+        if str(outfile).endswith('.parquet'):
+            _append_parquet_results(outfile, patient_results)
+        elif layout == 'long':
+            _append_long_results(outfile, patient_results)
+        elif layout == 'wide':
+            _append_wide_results(outfile, patient_results, hospitals)
+        else:
+            raise ValueError(f'Unrecognized result layout {layout}')
+    if timing.enabled():
+        timing.count('bytes written', _written_size(outfile) - size)
+
+
+def _written_size(path):
+    '''Size in bytes of a file, or of the files in a directory, 0 if none'''
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path)
+                   if entry.is_file())
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return 0
+
+
+def _append_wide_results(outfile, patient_results, hospitals):
+    # If no result file currently exists, create a blank one
     if not os.path.isfile(outfile):
         fieldnames = [
             'Location', 'Patient', 'Use Real DTN', 'Varying Hospitals',
             'PSC Count', 'CSC Count', 'Sex', 'Age', 'Symptoms', 'RACE','NIHSS',
+            'Simulations',
         ]
         fieldnames += [str(hospital) for hospital in hospitals]
-        with open(outfile, 'w') as f:
+        with open(outfile, 'w', newline='') as f:
             writer = csv.DictWriter(f, fieldnames=fieldnames)
             writer.writeheader()
+    else:
+        with open(outfile, 'r', newline='') as f:
+            fieldnames = next(csv.reader(f))
+        if 'Simulations' not in fieldnames: # written before it was recorded
+            patient_results = [
+                {k: v for k, v in result.items() if k != 'Simulations'}
+                for result in patient_results
+            ]
+
+    with open(outfile, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writerows({key: _csv_value(value)
+                          for key, value in result.items()}
+                         for result in patient_results)
+
+
+def _long_results(patient_results):
+    '''
+    One row per scenario and reachable hospital. Hospitals that can't be
+        reached (NaN counts) are left out.
+    '''
+    rows = []
+    for result in patient_results:
+        scenario = [result.get(key, np.nan) for key in RESULT_KEYS]
+        scenario += [result.get(col, np.nan) for col in RESULT_COUNT_COLS]
+        for hospital, count in result.items():
+            if (hospital in RESULT_KEYS or hospital in RESULT_COUNT_COLS or
+                    pd.isna(count)):
+                continue
+            rows.append(scenario + [hospital, count])
+    return rows
+
+
+def _append_long_results(outfile, patient_results):
+    new_file = not os.path.isfile(outfile)
+    rows = _long_results(patient_results)
+    if not new_file:
+        # files written before a column was added keep their own columns
+        with open(outfile, 'r', newline='') as f:
+            header = next(csv.reader(f))
+        if header != LONG_RESULT_COLUMNS:
+            positions = [LONG_RESULT_COLUMNS.index(col) for col in header]
+            rows = [[row[i] for i in positions] for row in rows]
+    with open(outfile, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(LONG_RESULT_COLUMNS)
+        writer.writerows([_csv_value(value) for value in row]
+                         for row in rows)
+
+
+def _csv_value(value):
+    '''Write missing values as empty cells, as DataFrame.to_csv does'''
+    if isinstance(value, float) and np.isnan(value):
+        return ''
+    return value
 
-    # Read in existing result file
-    keys = ['Location', 'Patient', 'Use Real DTN', 'Varying Hospitals',
-            'Sex', 'Age', 'RACE','NIHSS','Symptoms']
-    df = pd.read_csv(outfile)
-    df[keys] = df[keys].fillna('')
-    df = df.set_index(keys)
-
-    # Turn current patient results into a DataFrame
-    patient_results_df = pd.DataFrame.from_records(patient_results)
-    if 'NIHSS' not in patient_results_df.columns:
-        patient_results_df = patient_results_df.assign(NIHSS='')
-    elif 'RACE' not in patient_results_df.columns:
-        patient_results_df = patient_results_df.assign(RACE='')
-    patient_results_df = patient_results_df.set_index(keys)
-
-    # Update result file with new patient results
-    df.update(patient_results_df,overwrite=True)
-    # Add in new patient_results that did not exist in result file
-    df = df.append(patient_results_df[~patient_results_df.index.isin(df.index)],
-                   sort=False)
-
-    # Save result file
-    df.to_csv(outfile)
+
+def _append_parquet_results(outdir, patient_results):
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    part = len([f for f in os.listdir(outdir) if f.endswith('.parquet')])
+    df = pd.DataFrame(_long_results(patient_results),
+                      columns=LONG_RESULT_COLUMNS)
+    df.to_parquet(os.path.join(outdir, f'part-{part:05d}.parquet'),
+                  index=False)
+
+
+def read_results(result_file, hospitals=None):
+    '''
+    Read a result file written by save_patient in any layout as a wide
+        DataFrame with one count column per hospital. Later rows for the
+        same scenario replace earlier ones. Long layouts only record
+        reachable hospitals, so pass hospitals to get a column for every
+        hospital.
+    '''
+    if str(result_file).endswith('.parquet'):
+        long_df = pd.read_parquet(result_file)
+    else:
+        header = pd.read_csv(result_file, nrows=0).columns
+        if 'Hospital' not in header:
+            df = pd.read_csv(result_file)
+            return df.drop_duplicates(
+                subset=RESULT_KEYS, keep='last').reset_index(drop=True)
+        long_df = pd.read_csv(result_file)
+
+    count_cols = _count_columns(long_df.columns)
+    index = RESULT_KEYS + count_cols
+    long_df[RESULT_KEYS] = long_df[RESULT_KEYS].fillna('')
+    long_df = long_df.drop_duplicates(subset=RESULT_KEYS + ['Hospital'],
+                                      keep='last')
+    # PSC/CSC counts are the same for every hospital in a scenario
+    counts = long_df.groupby(RESULT_KEYS, sort=False)[count_cols].last()
+    wide = long_df.set_index(RESULT_KEYS + ['Hospital'])['Count'].unstack()
+    wide.columns.name = None
+    if hospitals is not None:
+        wide = wide.reindex(columns=[str(hospital) for hospital in hospitals])
+    wide = counts.join(wide).reset_index()
+    return wide[index + [c for c in wide.columns if c not in index]]
+
+
+def _count_columns(columns):
+    '''Scenario count columns in a result file, which may predate some'''
+    return [col for col in RESULT_COUNT_COLS if col in columns]
+
+
+def compact_results(result_file, outfile=None, hospitals=None):
+    '''
+    Remove duplicate scenarios appended by save_patient, keeping the most
+        recently saved rows, the same as the update semantics of the
+        original in-place writer. Writes a wide CSV to outfile, or replaces
+        result_file in its own layout if outfile is not given.
+    '''
+    df = read_results(result_file, hospitals)
+    id_vars = RESULT_KEYS + _count_columns(df.columns)
+    if outfile is not None:
+        df.to_csv(outfile, index=False)
+        return df
+
+    if str(result_file).endswith('.parquet'):
+        tmp_file = os.path.join(result_file, 'compacted.tmp')
+        long_df = df.melt(id_vars=id_vars, var_name='Hospital',
+                          value_name='Count')
+        long_df = long_df[long_df['Count'].notna()]
+        long_df.to_parquet(tmp_file, index=False)
+        for f in os.listdir(result_file):
+            if f.endswith('.parquet'):
+                os.remove(os.path.join(result_file, f))
+        os.replace(tmp_file, os.path.join(result_file, 'part-00000.parquet'))
+        return df
+
+    tmp_file = str(result_file) + '.tmp'
+    header = pd.read_csv(result_file, nrows=0).columns
+    if 'Hospital' in header:
+        long_df = df.melt(id_vars=id_vars, var_name='Hospital',
+                          value_name='Count')
+        long_df = long_df[long_df['Count'].notna()]
+        long_df[header].to_csv(tmp_file, index=False)
+    else:
+        df[header].to_csv(tmp_file, index=False)
+    os.replace(tmp_file, result_file)
+    return df
@@ -4,10 +4,16 @@ Run analysis on a set of map points given times to nearby hospitals
 import os
 import argparse
 import collections
+import functools
 import multiprocessing as mp
 import data_io
+import travel_times
 from stroke.patient import Patient
-from stroke import severity,constants,stroke_model as sm
+from stroke import severity,constants,stroke_model as sm,stroke_center as sc
+from stroke import streams, timing
+from stroke.network import HospitalNetwork
+from stroke.times import HospitalDraws
+from manifest import open_manifest
 # import stroke.stroke_model as sm
 import numpy as np
 from tqdm import tqdm
@@ -16,11 +22,58 @@ from pathlib import Path
 
 NON_COUNT_COLS = [
     'Location', 'Patient', 'Varying Hospitals', 'PSC Count', 'CSC Count',
-    'Sex', 'Age', 'Symptoms', 'RACE'
+    'Sex', 'Age', 'Symptoms', 'RACE', 'Simulations'
 ]
 
 NUM_CORES = 2
 
+# Inputs published to pool workers by _init_shared_inputs
+_SHARED_INPUTS = {}
+
+class AdaptiveCount:
+    '''
+    Simulation count for runs where every scenario starts with a pilot
+        batch, and more batches are only run while the share of the
+        leading destination is still uncertain, so each location uses as
+        many simulations as it needs. Pass in place of a number of
+        simulations; 'auto' uses the defaults. See
+        StrokeModel.run_sequential for the arguments.
+    '''
+
+    def __init__(self, pilot=200, batch_size=1000, max_n=50000,
+                 tolerance=0.01, confidence=0.95):
+        self.pilot = pilot
+        self.batch_size = batch_size
+        self.max_n = max_n
+        self.tolerance = tolerance
+        self.confidence = confidence
+
+    def __str__(self):
+        return (f'auto(pilot={self.pilot},batch={self.batch_size},'
+                f'max={self.max_n},tolerance={self.tolerance},'
+                f'confidence={self.confidence})')
+
+    def run(self, model, **kwargs):
+        '''Run a StrokeModel until its leading destination converges'''
+        return model.run_sequential(self.batch_size, self.max_n,
+                                    self.tolerance, self.confidence,
+                                    pilot=self.pilot, **kwargs)
+
+def _adaptive_count(simulation_count):
+    '''Get the AdaptiveCount for an adaptive simulation count, or None if
+        the count is fixed'''
+    if isinstance(simulation_count, AdaptiveCount):
+        return simulation_count
+    if str(simulation_count) == 'auto':
+        return AdaptiveCount()
+    return None
+
+def simulation_count_arg(value):
+    '''Parse a --simulations argument, a number of model runs or auto'''
+    if value == 'auto':
+        return AdaptiveCount()
+    return int(value)
+
 def results_name(base_dir, times_file, hospitals_file, fix_performance,
                  simulation_count, sex):
     """Get the name for the file storing results for the given arguments."""
@@ -37,7 +90,7 @@ def results_name(base_dir, times_file, hospitals_file, fix_performance,
     out_file = os.path.join(out_dir, out_name)
     return out_file
 
-def _instanstiate_patients(patient_count,**kwargs):
+def _instanstiate_patients(patient_count,rng=None,**kwargs):
     patient_characteristics = list(locals().keys())
     have_pc_and_race = np.isin(['age','sex','time_since_symptoms','race'],
                       patient_characteristics).all()
@@ -48,7 +101,10 @@ def _instanstiate_patients(patient_count,**kwargs):
     elif have_pc_and_nihss: # not used
         patients = [Patient.with_NIHSS(**kwargs)]
     else: # each patient generated with this function
-        patients = [Patient.random(**kwargs) for _ in range(patient_count)]
+        rng = streams.generator(rng)
+        # numbered so the manifest tells patients with one profile apart
+        patients = [Patient.random(pid=i, rng=rng, **kwargs)
+                    for i in range(patient_count)]
     return patients # returns a list of one patient of the Patient class
 
 # Run base version of the model: no hospital performance data
@@ -62,6 +118,16 @@ def run_model_defaul_dtn(
         base_dir='',  # default: current working directory
         locations=None,  # default: run for all location in times_file
         res_name=None,
+        patients=None,
+        batch_patients=False,
+        location_block_size=None,
+        common_hospital_draws=False,
+        seed=None,
+        shared_inputs=False,
+        manifest=None,
+        prune=False,
+        dtype=np.float64,
+        memory_budget=None,
         **kwargs):
     '''Run the model on the given map points for the given hospitals. The
         times file should be in data/travel_times and contain travel times to
@@ -69,6 +135,7 @@ def run_model_defaul_dtn(
         and contain transfer destinations and times for all primary hospitals.
         kwargs -- passed through to inputs.Inputs.random to hold parameters
                     constant
+        See _run_model for the other arguments.
         This method use travel_time file generated from hospital list Kori gave
         but instead of using DTN times from AHA, we use default_times generated
         from a uniform distribution
@@ -79,51 +146,20 @@ def run_model_defaul_dtn(
         (False, hospitals)
     ]  # false means use same DTN distribution for all hospitals
 
-    patients = _instanstiate_patients(patient_count,**kwargs) # list of one patient and their characteristics
+    if patients is None:
+        patients = _instanstiate_patients( # list of one patient and their characteristics
+            patient_count, streams.seed_sequence(seed, 'patients'), **kwargs)
     sex = patients[0].sex
 
-    times = data_io.get_times(times_file) # dictionary: main key = location, inner key = hospital, value = travel time
-    if locations:
-        # Create dictionary times, key = location, value = hospital for all locations specified in run_here.py
-        times = {loc: time for loc, time in times.items() if loc in locations} # dictionary list comprehension
-
     if not res_name: # not used and specified in run_here.py, defines output file name
         res_name = results_name(base_dir, times_file, hospitals_file,
                                 fix_performance, simulation_count, sex)
 
-    if cores is False: # no multiprocessing
-        pool = False
-    else: # multiprocessing
-        pool = mp.Pool(NUM_CORES)
-
-    # Runs for one patient: pat_num = 0 and patient = Patient class    
-    for pat_num, patient in enumerate(tqdm(patients, desc='Patients')):
-        patient_results = []
-        # points = locations, these_times = dictionary of hospital keys with values as travel times
-        for point, these_times in tqdm( 
-                times.items(), desc='Map Points', leave=False):
-            # uses_hospital_performance = False, hospital_list = list of hospitals
-            for uses_hospital_performance, hospital_list in hospital_lists:
-                if pool: # multiprocessing
-                    results = pool.apply_async(
-                        run_one_scenario,
-                        (patient, point, these_times, hospital_list,
-                         uses_hospital_performance, simulation_count,
-                         fix_performance, res_name))
-                else: # no multiprocessing
-                    results = run_one_scenario(
-                        patient, point, these_times, hospital_list,
-                        uses_hospital_performance, simulation_count,
-                        fix_performance, res_name)
-                patient_results.append(results)
-        if pool:
-            to_fetch = tqdm(patient_results, desc='Map Points', leave=False)
-            patient_results = [job.get() for job in to_fetch]
-        # Save after each patient in case we cancel or crash
-        data_io.save_patient(res_name, patient_results, hospitals)
-    if pool:
-        pool.close()
-    return
+    _run_model(times_file, hospitals_file, hospital_lists, patients,
+               simulation_count, fix_performance, res_name, cores,
+               locations, batch_patients, location_block_size,
+               common_hospital_draws, seed, shared_inputs, manifest, prune,
+               dtype, memory_budget)
 
 # Runs enhanced version of the model: including hospital performance data
 # **kwargs = keyword arguments, allows any number of keyword arguments
@@ -140,6 +176,15 @@ def run_model_real_data(
         res_name=None,
         locations=None,  # default: run for all location in times_file
         patients=None,
+        batch_patients=False,
+        location_block_size=None,
+        common_hospital_draws=False,
+        seed=None,
+        shared_inputs=False,
+        manifest=None,
+        prune=False,
+        dtype=np.float64,
+        memory_budget=None,
         **kwargs): 
     '''Run the model on the given map points for the given hospitals. The
         times file should be in data/travel_times and contain travel times to
@@ -147,6 +192,7 @@ def run_model_real_data(
         and contain transfer destinations and times for all primary hospitals.
         kwargs -- passed through to inputs.Inputs.random to hold parameters
                     constant
+        See _run_model for the other arguments.
         Also need dtn_file here to use real hospital performance data
     '''
     hospitals = data_io.get_hospitals(hospitals_file, dtn_file) # Returns list of each center with its attributes
@@ -154,93 +200,581 @@ def run_model_real_data(
 
     # Generates list of Patient class (contains 1 patient)
     # Attributes: pid, sex, age, symptom_time, severity
-    patients = _instanstiate_patients(patient_count,**kwargs)
-
-    sex = patients[0].sex
-    # Times is a dictionary of dictionary
-    # Main key = location id (L#), inner key = hopsital key (K#), value = [min_time,  max_time]
-    times = data_io.get_times(times_file)
-    
-    if locations:  # Not none, run a subset of locations
-        # Subset times dictionary to just locations we are running
-        times = {loc: time for loc, time in times.items() if loc in locations}
+    if patients is None:
+        patients = _instanstiate_patients(
+            patient_count, streams.seed_sequence(seed, 'patients'), **kwargs)
 
     # if not res_name: # doesn't run
     #     res_name = results_name(base_dir, times_file, hospitals_file,
     #                             fix_performance, simulation_count, sex)
 
+    _run_model(times_file, hospitals_file, hospital_lists, patients,
+               simulation_count, fix_performance, res_name, cores,
+               locations, batch_patients, location_block_size,
+               common_hospital_draws, seed, shared_inputs, manifest, prune,
+               dtype, memory_budget)
+
+def _run_model(times_file, hospitals_file, hospital_lists, patients,
+               simulation_count, fix_performance, res_name, cores=None,
+               locations=None, batch_patients=False, location_block_size=None,
+               common_hospital_draws=False, seed=None, shared_inputs=False,
+               manifest=None, prune=False, dtype=np.float64,
+               memory_budget=None):
+    '''Run the patients at the map points of the times file for each
+        (uses hospital performance, hospital list) pair in hospital_lists,
+        in whichever way the options ask for. Shared by run_model_real_data
+        and run_model_defaul_dtn.
+        cores -- False to run in this process, otherwise use a pool
+        locations -- run only these locations of the times file
+        patients -- list of Patients to run
+        batch_patients -- run all patients at a location in one model call,
+                          sharing hospital time draws between them
+        location_block_size -- if given, evaluate this many map points in
+                               each model call instead of one task per point
+        common_hospital_draws -- draw door to needle and door to puncture
+                                 times once per hospital and reuse them at
+                                 every map point and for every patient
+        seed -- seed for the run. Random patients, common hospital draws
+                and every patient at every location draw from their own
+                streams derived from it, so results don't depend on the
+                number of cores or on location_block_size.
+        shared_inputs -- send the hospital network and travel times to each
+                         worker once, with tasks referring to locations by
+                         index and returning optimal counts as arrays
+        manifest -- file recording completed scenarios. Scenarios already
+                    recorded are skipped, so an interrupted run can resume.
+        prune -- leave out strategies that can never be optimal at a
+                 location, and skip the simulation where only one can be.
+                 Their hospitals still get zero counts, but outcome
+                 summaries only cover the strategies simulated.
+        dtype -- floating point type to simulate in. np.float32 halves the
+                 memory of each model run; see
+                 stroke_model.compare_precision to check its counts.
+        memory_budget -- if given, run each scenario in chunks of model
+                         runs that fit in this many bytes, keeping only
+                         counts and outcome summaries between chunks. Only
+                         for one task per scenario or shared_inputs, with
+                         a fixed number of simulations.
+    '''
+    hospitals = hospital_lists[0][1]
+    # one network per variant, shared by every task rather than rebuilt
+    hospital_networks = [
+        (uses_hospital_performance, HospitalNetwork(hospital_list))
+        for uses_hospital_performance, hospital_list in hospital_lists
+    ]
+    # Times is a memory-mapped TravelTimes, read like a dictionary of dictionary
+    # Main key = location id (L#), inner key = hopsital key (K#), value = [min_time,  max_time]
+    times = travel_times.open_travel_times(times_file)
+    if locations:  # Not none, run a subset of locations
+        # Read only the locations we are running
+        times = _subset_locations(times, locations)
+
+    draws = _hospital_draws(hospital_networks, simulation_count,
+                            fix_performance, common_hospital_draws, seed)
+    manifest = open_manifest(manifest)
+    variants = [
+        _hospital_variant(hospitals_file, uses_hospital_performance,
+                          fix_performance)
+        for uses_hospital_performance, _ in hospital_lists
+    ]
+    run_options = (manifest, variants, seed, prune, dtype)
+    if sum(map(bool, [batch_patients, location_block_size,
+                      shared_inputs])) > 1:
+        raise ValueError('Only one of batch_patients, location_block_size '
+                         'and shared_inputs can be used')
+    if ((batch_patients or location_block_size) and
+            _adaptive_count(simulation_count) is not None):
+        raise ValueError('batch_patients and location_block_size need a '
+                         'fixed number of simulations')
+    _check_memory_budget(memory_budget, simulation_count, batch_patients,
+                         location_block_size)
+    if shared_inputs:
+        _run_shared_inputs(patients, times, hospital_networks, simulation_count,
+                           fix_performance, res_name, hospitals, cores, draws,
+                           *run_options, memory_budget=memory_budget)
+        return
+
     # Determines multiprocessing run or not
     if cores is False: # run on a single core, no multiprocessing
         pool = False
     else:
         pool = mp.Pool(NUM_CORES)
 
-    # Runs for one patient: patients is list of one patient
-    # Enumerate: (0, patient0)
-    # Desc = description of progress bar
+    if batch_patients:
+        _run_patient_batches(patients, times, hospital_networks, simulation_count,
+                             fix_performance, res_name, hospitals, pool,
+                             draws, *run_options)
+    elif location_block_size:
+        _run_location_blocks(patients, times, hospital_networks, simulation_count,
+                             fix_performance, res_name, hospitals, pool,
+                             location_block_size, draws, *run_options)
+    else:
+        _run_scenarios(patients, times, hospital_networks, simulation_count,
+                       fix_performance, res_name, hospitals, pool, draws,
+                       *run_options, memory_budget=memory_budget)
+    if pool:
+        pool.close()
+
+def _subset_locations(times, locations):
+    '''Travel times for the given locations that are in the times file,
+        in file order'''
+    locations = set(locations)
+    return times.subset([loc for loc in times.locations if loc in locations])
+
+def _hospital_variant(hospitals_file, uses_hospital_performance,
+                      fix_performance):
+    '''Name the hospital list and how it is run, for the manifest'''
+    variant = os.path.basename(str(hospitals_file))
+    variant += '_realDTN' if uses_hospital_performance else '_defaultDTN'
+    variant += '_fixed' if fix_performance else '_random'
+    return variant
+
+def _pending_points(patient, points, manifest, variants, simulation_count,
+                    seed):
+    '''Points where the patient has a scenario not in the manifest'''
+    if manifest is None:
+        return list(points)
+    return [
+        point for point in points if not all(
+            manifest.is_complete(manifest.scenario(
+                patient, point, variant, simulation_count, seed))
+            for variant in variants)
+    ]
+
+def _record(manifest, patients, points, variants, simulation_count, seed):
+    '''Record every combination of patients, points and variants'''
+    if manifest is not None:
+        manifest.record([
+            manifest.scenario(patient, point, variant, simulation_count, seed)
+            for patient in patients for point in points
+            for variant in variants
+        ])
+
+def _run_scenarios(patients, times, hospital_networks, simulation_count,
+                   fix_performance, res_name, hospitals, pool, draws,
+                   manifest=None, variants=None, seed=None, prune=False,
+                   dtype=np.float64, memory_budget=None):
+    '''Run each patient at each location with one task per scenario. With
+        a manifest, completed scenarios are skipped and each result is saved
+        and recorded as soon as it is available.'''
+    root = streams.seed_sequence(seed)
+    # Runs for one patient: pat_num = 0 and patient = Patient class
     for pat_num, patient in enumerate(tqdm(patients, desc='Patients')):
         patient_results = []
-        for point, these_times in tqdm( # point = location, these_times = hospital: [min_time, max_time]
+        scenarios = []
+        # points = locations, these_times = dictionary of hospital keys with values as travel times
+        for point, these_times in tqdm(
                 times.items(), desc='Map Points', leave=False):
             # uses_hospital_performance = TRUE/FALSE
-            # hospital_list = list of hospital classes
-            for uses_hospital_performance, hospital_list in hospital_lists:
-                if pool: # multiprocessing
-                    results = pool.apply_async(
-                        run_one_scenario,
-                        (patient, point, these_times, hospital_list,
-                         uses_hospital_performance, simulation_count,
-                         fix_performance, res_name))
-                else: # no multiprocessing
-                    results = run_one_scenario(
-                        patient, point, these_times, hospital_list,
-                        uses_hospital_performance, simulation_count,
-                        fix_performance, res_name)
+            # hospital_network = HospitalNetwork of the hospitals
+            for (uses_hospital_performance, hospital_network), hospital_draws, \
+                    variant in zip(hospital_networks, draws, variants):
+                if manifest is not None:
+                    scenario = manifest.scenario(patient, point, variant,
+                                                 simulation_count, seed)
+                    if manifest.is_complete(scenario):
+                        continue
+                    scenarios.append(scenario)
+                rng = streams.seed_sequence(root, pat_num, point)
+                # a pool job if multiprocessing, otherwise run now
+                results = _apply(
+                    pool, run_one_scenario,
+                    (patient, point, these_times, hospital_network,
+                     uses_hospital_performance, simulation_count,
+                     fix_performance, res_name, hospital_draws, prune, rng,
+                     dtype, memory_budget))
                 patient_results.append(results)
-        
+
+        if manifest is not None:
+            # Save each scenario as it finishes so none are lost on a crash
+            to_fetch = tqdm(patient_results, desc='Map Points', leave=False)
+            for results, scenario in zip(to_fetch, scenarios):
+                results = _get(results, pool)
+                data_io.save_patient(res_name, [results], hospitals)
+                manifest.record([scenario])
+            continue
+
         if pool: # aggregate multiprocessing results
             to_fetch = tqdm(patient_results, desc='Map Points', leave=False)
-            patient_results = [job.get() for job in to_fetch]
-        
+            patient_results = [_get(job, pool) for job in to_fetch]
         # Save after each patient in case we cancel or crash
         data_io.save_patient(res_name, patient_results, hospitals)
-    
-    if pool:
-        pool.close()
-    return
+
+def _apply(pool, function, args):
+    '''Start function on args as a pool job, or run it now if pool is
+        False. While timings are recorded each job records its own, sent
+        back with its result for _get to merge.'''
+    if not pool:
+        return function(*args)
+    if timing.enabled():
+        return pool.apply_async(timing.timed, (function,) + tuple(args))
+    return pool.apply_async(function, args)
+
+def _get(job, pool):
+    '''Result of a job from _apply, merging any timings it recorded'''
+    if not pool:
+        return job
+    result = job.get()
+    if timing.enabled():
+        result, job_timings = result
+        timing.merge(job_timings)
+    return result
+
+def _hospital_draws(hospital_networks, simulation_count, fix_performance,
+                    common_hospital_draws, seed=None):
+    '''Get common hospital draws for each hospital network, or None for each
+        if every scenario should draw its own.'''
+    if not common_hospital_draws:
+        return [None for _ in hospital_networks]
+    try:
+        simulation_count = int(simulation_count)
+    except ValueError:
+        raise Exception("Num of simulation is not an integer!")
+    return [
+        HospitalDraws(hospital_network, simulation_count,
+                      fix_performance=fix_performance,
+                      seed=streams.seed_sequence(seed, 'hospital draws', i))
+        for i, (_, hospital_network) in enumerate(hospital_networks)
+    ]
+
+def _init_shared_inputs(hospital_network, points, times, hospital_draws,
+                        dtype=np.float64, memory_budget=None):
+    '''Pool initializer publishing the hospital network, location ids,
+        travel times and any common hospital draws to a worker once, so
+        tasks only need a location index. Memory-mapped travel times are
+        sent as a path and mapped by each worker.'''
+    _SHARED_INPUTS['network'] = hospital_network
+    _SHARED_INPUTS['points'] = points
+    _SHARED_INPUTS['times'] = times
+    # network row of each hospital column in the times file, -1 if none
+    columns = times.columns(hospital_network.center_ids)
+    column_rows = np.full(len(times.hospitals), -1, dtype=np.intp)
+    column_rows[columns[columns >= 0]] = np.flatnonzero(columns >= 0)
+    _SHARED_INPUTS['column_rows'] = column_rows
+    _SHARED_INPUTS['hospital_draws'] = hospital_draws
+    _SHARED_INPUTS['dtype'] = dtype
+    _SHARED_INPUTS['memory_budget'] = memory_budget
+
+def _run_shared_inputs(patients, times, hospital_networks, simulation_count,
+                       fix_performance, res_name, hospitals, cores, draws,
+                       manifest=None, variants=None, seed=None,
+                       prune=False, dtype=np.float64, memory_budget=None):
+    '''Run every patient at every location with inputs shared through a
+        pool initializer, collecting optimal counts into a preallocated
+        (locations x hospitals) matrix before saving each patient. With a
+        manifest, completed locations are skipped and each location is saved
+        and recorded as it finishes.'''
+    points = list(times)
+    root = streams.seed_sequence(seed)
+    for (uses_hospital_performance, hospital_network), hospital_draws, \
+            variant in zip(hospital_networks, draws, variants):
+        initargs = (hospital_network, points, times, hospital_draws, dtype,
+                    memory_budget)
+        if cores is False:
+            _init_shared_inputs(*initargs)
+            pool = False
+        else:
+            pool = mp.Pool(NUM_CORES, initializer=_init_shared_inputs,
+                           initargs=initargs)
+        for pat_num, patient in enumerate(tqdm(patients, desc='Patients')):
+            pending = set(_pending_points(patient, points, manifest,
+                                          [variant], simulation_count, seed))
+            indices = [i for i, point in enumerate(points) if point in pending]
+            counts = np.empty((len(points), len(hospital_network)),
+                              dtype=np.int64)
+            jobs = []
+            for location_index in indices:
+                args = (patient, location_index, simulation_count,
+                        fix_performance, res_name, prune,
+                        streams.seed_sequence(root, pat_num,
+                                              points[location_index]))
+                jobs.append(_apply(pool, run_indexed_scenario, args))
+            for location_index, job in zip(
+                    indices, tqdm(jobs, desc='Map Points', leave=False)):
+                counts[location_index] = _get(job, pool)
+                if manifest is not None:
+                    point = points[location_index]
+                    data_io.save_patient(
+                        res_name,
+                        _count_results(patient, [point],
+                                       counts[[location_index]],
+                                       hospital_network,
+                                       uses_hospital_performance,
+                                       fix_performance), hospitals)
+                    _record(manifest, [patient], [point], [variant],
+                            simulation_count, seed)
+            if manifest is not None:
+                continue
+            patient_results = _count_results(patient, points, counts,
+                                             hospital_network,
+                                             uses_hospital_performance,
+                                             fix_performance)
+            data_io.save_patient(res_name, patient_results, hospitals)
+        if pool:
+            pool.close()
+
+def run_indexed_scenario(patient,
+                         location_index,
+                         simulation_count,
+                         fix_performance,
+                         res_name=None,
+                         prune=False,
+                         rng=None):
+    '''Run one patient at the location with the given index into the
+        inputs published by _init_shared_inputs. Returns optimal counts by
+        hospital in network order, -1 for hospitals that can't be
+        reached.'''
+    hospital_network = _SHARED_INPUTS['network']
+    model = sm.StrokeModel(patient, hospital_network,
+                           dtype=_SHARED_INPUTS['dtype'])
+    point = _SHARED_INPUTS['points'][location_index]
+    columns, bounds = _SHARED_INPUTS['times'].reachable(point)
+    rows = _SHARED_INPUTS['column_rows'][columns]
+    order = np.argsort(rows)
+    order = order[rows[order] >= 0]
+    model.set_reachable_times(rows[order], bounds[order])
+    hospital_draws = _SHARED_INPUTS['hospital_draws']
+    adaptive = _adaptive_count(simulation_count)
+    if adaptive is not None:
+        if hospital_draws is not None:
+            raise ValueError('Common hospital draws need a fixed number of '
+                             'simulations')
+        these_results, markov_results, ais_times = adaptive.run(
+            model, fix_performance=fix_performance, prune=prune, rng=rng)
+    else:
+        try:
+            simulation_count = int(simulation_count)
+        except ValueError:
+            raise Exception("Num of simulation is not an integer!")
+        memory_budget = _SHARED_INPUTS['memory_budget']
+        if memory_budget is not None:
+            these_results = _run_chunked(model, point, simulation_count,
+                                         memory_budget, res_name,
+                                         fix_performance=fix_performance,
+                                         hospital_draws=hospital_draws,
+                                         prune=prune, rng=rng)
+            markov_results = None
+        else:
+            these_results, markov_results, ais_times = model.run(
+                n=simulation_count, fix_performance=fix_performance,
+                hospital_draws=hospital_draws, prune=prune, rng=rng)
+    if res_name and markov_results is not None:
+        data_io.write_aggregated_markov_outcomes(
+            markov_results, res_name, point, times=ais_times,
+            optimal_strategy=str(these_results.optimal_strategy),
+            write=True)
+    counts = np.full(len(hospital_network), -1, dtype=np.int64)
+    for center, count in these_results.counts_by_center.items():
+        counts[hospital_network.row(center)] = count
+    return counts
+
+def _run_patient_batches(patients, times, hospital_networks, simulation_count,
+                         fix_performance, res_name, hospitals, pool,
+                         draws, manifest=None, variants=None, seed=None,
+                         prune=False, dtype=np.float64):
+    '''Run every patient at each location with one model call per location,
+        saving and recording each location's patients as soon as they are
+        done. Patients already in the manifest at a location are left out
+        of its batch.'''
+    root = streams.seed_sequence(seed)
+    jobs = []
+    for point in tqdm(times, desc='Map Points', leave=False):
+        these_times = times[point]
+        for (uses_hospital_performance, hospital_network), hospital_draws, \
+                variant in zip(hospital_networks, draws, variants):
+            batch = [
+                patient for patient in patients
+                if point in _pending_points(patient, [point], manifest,
+                                            [variant], simulation_count, seed)
+            ]
+            if not batch:
+                continue
+            # shared draws from the location's stream, each patient's from
+            #   its own, so they don't depend on who else is in the batch
+            rng = streams.seed_sequence(root, 'patients', point)
+            args = (batch, point, these_times, hospital_network,
+                    uses_hospital_performance, simulation_count,
+                    fix_performance, res_name, hospital_draws, prune, rng,
+                    dtype, [streams.seed_sequence(rng, patient.pid)
+                            for patient in batch])
+            rows = _apply(pool, run_batch_scenario, args)
+            if pool:
+                jobs.append((batch, point, variant, rows))
+                continue
+            # save each location as soon as it's run
+            data_io.save_patient(res_name, rows, hospitals)
+            _record(manifest, batch, [point], [variant], simulation_count,
+                    seed)
+    for batch, point, variant, job in tqdm(jobs, desc='Map Points',
+                                           leave=False):
+        data_io.save_patient(res_name, _get(job, pool), hospitals)
+        _record(manifest, batch, [point], [variant], simulation_count, seed)
+
+def _run_location_blocks(patients, times, hospital_networks, simulation_count,
+                         fix_performance, res_name, hospitals, pool,
+                         block_size, draws, manifest=None, variants=None,
+                         seed=None, prune=False, dtype=np.float64):
+    '''Run each patient on blocks of map points, one model call per block,
+        saving after each patient. Points in the manifest are skipped.'''
+    root = streams.seed_sequence(seed)
+    for pat_num, patient in enumerate(tqdm(patients, desc='Patients')):
+        points = _pending_points(patient, times, manifest, variants,
+                                 simulation_count, seed)
+        blocks = [points[i:i + block_size]
+                  for i in range(0, len(points), block_size)]
+        block_results = []
+        for block in tqdm(blocks, desc='Map Blocks', leave=False):
+            times_list = [times[point] for point in block]
+            for (uses_hospital_performance, hospital_network), hospital_draws in zip(
+                    hospital_networks, draws):
+                rngs = [streams.seed_sequence(root, pat_num, point)
+                        for point in block]
+                args = (patient, block, times_list, hospital_network,
+                        uses_hospital_performance, simulation_count,
+                        fix_performance, res_name, hospital_draws, prune,
+                        rngs, dtype)
+                block_results.append(_apply(pool, run_location_block, args))
+        if pool:
+            to_fetch = tqdm(block_results, desc='Map Blocks', leave=False)
+            block_results = [_get(job, pool) for job in to_fetch]
+        patient_results = [row for rows in block_results for row in rows]
+        data_io.save_patient(res_name, patient_results, hospitals)
+        _record(manifest, [patient], points, variants, simulation_count, seed)
+
+def run_location_block(patient,
+                       points,
+                       times_list,
+                       hospital_network,
+                       uses_hospital_performance,
+                       simulation_count,
+                       fix_performance,
+                       res_name=None,
+                       hospital_draws=None,
+                       prune=False,
+                       rngs=None,
+                       dtype=np.float64):
+    '''Run one patient at a block of locations in a single model call.
+        Returns a list of result rows, one per location.'''
+    model = sm.StrokeModel(patient, hospital_network, dtype=dtype)
+    try:
+        simulation_count = int(simulation_count)
+    except ValueError:
+        raise Exception("Num of simulation is not an integer!")
+    all_results, all_markov, all_times = model.run_locations(
+        times_list, n=simulation_count, fix_performance=fix_performance,
+        hospital_draws=hospital_draws, prune=prune, rngs=rngs)
+
+    rows = []
+    outcomes = []
+    for point, these_results, markov_results, ais_times in zip(
+            points, all_results, all_markov, all_times):
+        if res_name and markov_results is not None:
+            outcomes.append(data_io.outcome_rows(
+                point,
+                *data_io.aggregate_outcomes(markov_results, ais_times),
+                optimal_strategy=str(these_results.optimal_strategy)))
+        rows.append(_scenario_results(patient, point, these_results,
+                                      hospital_network,
+                                      uses_hospital_performance,
+                                      fix_performance))
+    if outcomes: # write the block's outcome summaries together
+        data_io.write_outcomes(data_io.outcome_store_path(res_name),
+                               *data_io.outcome_partition(res_name), outcomes)
+    return rows
+
+def run_batch_scenario(patients,
+                       point,
+                       these_times,
+                       hospital_network,
+                       uses_hospital_performance,
+                       simulation_count,
+                       fix_performance,
+                       res_name=None,
+                       hospital_draws=None,
+                       prune=False,
+                       rng=None,
+                       dtype=np.float64,
+                       patient_rngs=None):
+    '''Run a table of patients at one location, sharing hospital time draws
+        between them. Returns a list of result rows, one per patient.'''
+    model = sm.StrokeModel(patients[0], hospital_network, dtype=dtype)
+    model.set_times(these_times)
+    try:
+        simulation_count = int(simulation_count)
+    except ValueError:
+        raise Exception("Num of simulation is not an integer!")
+    all_results, all_markov, all_times = model.run_patients(
+        patients, n=simulation_count, fix_performance=fix_performance,
+        hospital_draws=hospital_draws, prune=prune, rng=rng,
+        patient_rngs=patient_rngs)
+
+    rows = []
+    for patient, these_results, markov_results, ais_times in zip(
+            patients, all_results, all_markov, all_times):
+        if res_name and markov_results is not None:
+            data_io.write_aggregated_markov_outcomes(
+                markov_results, res_name, point, times=ais_times,
+                optimal_strategy=str(these_results.optimal_strategy),
+                write=True)
+        rows.append(_scenario_results(patient, point, these_results,
+                                      hospital_network,
+                                      uses_hospital_performance,
+                                      fix_performance))
+    return rows
 
 def run_one_scenario(patient,
                      point,
                      these_times,
-                     hospital_list,
+                     hospital_network,
                      uses_hospital_performance,
                      simulation_count,
                      fix_performance,
-                     res_name=None):
+                     res_name=None,
+                     hospital_draws=None,
+                     prune=False,
+                     rng=None,
+                     dtype=np.float64,
+                     memory_budget=None):
     '''Called in run_model_real_data() and run_model_defaul_dtn()'''
     # model attributes: patient, hospitals, threshold_ICER
-    # hospital_list = list of hospital classes
-    model = sm.StrokeModel(patient, hospital_list) # create instance of StrokeModel class
+    # hospital_network = HospitalNetwork built once for every scenario
+    model = sm.StrokeModel(patient, hospital_network, dtype=dtype) # create instance of StrokeModel class
     # these_times = dictionary of each hospital key with values [min_time, max_time]
     model.set_times(these_times) # sets attributes no_traffic and traffic
     
-    if str(simulation_count) == 'auto': # automatic mode, uses convergence to get number of simulations (not used)
-        model_run = model.run_new
+    adaptive = _adaptive_count(simulation_count)
+    if adaptive is not None: # adaptive mode, adds simulations until the leading destination's share converges
+        model_run = functools.partial(adaptive.run, model, prune=prune)
+        if hospital_draws is not None:
+            raise ValueError('Common hospital draws need a fixed number of '
+                             'simulations')
+    elif memory_budget is not None: # chunks of runs, outcomes summarized as they finish
+        these_results = _run_chunked(model, point, int(simulation_count),
+                                     memory_budget, res_name,
+                                     fix_performance=fix_performance,
+                                     hospital_draws=hospital_draws,
+                                     prune=prune, rng=rng)
+        return _scenario_results(patient, point, these_results,
+                                 hospital_network, uses_hospital_performance,
+                                 fix_performance)
     else: # we specify number of simulations with a parameter (simulation_count)
         try:
             simulation_count = int(simulation_count)
             # model.run returns: results.Results(markov), markov, ais_times
-            model_run = model.run # runs StrokeModel instance
+            model_run = functools.partial(model.run, n=simulation_count,
+                                          prune=prune)
         except ValueError:
             raise Exception("Num of simulation is not an integer!")
 
     # these_results = Results class, tabulated version of markov model
     # markov_results = Population class
     # ais_times = IschemicModel class
+    if hospital_draws is not None:
+        model_run = functools.partial(model_run, hospital_draws=hospital_draws)
     these_results, markov_results, ais_times = model_run( # separate into the 3 results
-        n=simulation_count, fix_performance=fix_performance)
+        fix_performance=fix_performance, rng=rng)
 
-    if res_name:
+    if res_name and markov_results is not None:
         # output details of each simulation: Cost and QALY
         #dimension: simulation# -> row index,hospital-> columns
         # data_io.write_detailed_markov_outcomes(
@@ -253,13 +787,97 @@ def run_one_scenario(patient,
             markov_results, res_name, point, times=ais_times,
             optimal_strategy= str(these_results.optimal_strategy), write = True)
 
+    return _scenario_results(patient, point, these_results, hospital_network,
+                             uses_hospital_performance, fix_performance)
+
+
+def _run_chunked(model, point, simulation_count, memory_budget, res_name,
+                 **kwargs):
+    '''Run a model in chunks within memory_budget bytes, writing a summary
+        of the outcomes accumulated over the chunks if res_name is given.
+        kwargs -- passed to StrokeModel.run_chunked
+        Returns the Results.'''
+    summary = data_io.OutcomeSummary(simulation_count) if res_name else None
+    these_results = model.run_chunked(
+        simulation_count, memory_budget,
+        accumulate=summary.add if summary is not None else None, **kwargs)
+    if summary is not None and summary.strategies is not None:
+        rows = data_io.outcome_rows(
+            point, *summary.aggregate(),
+            optimal_strategy=str(these_results.optimal_strategy))
+        data_io.write_outcomes(data_io.outcome_store_path(res_name),
+                               *data_io.outcome_partition(res_name), rows)
+    return these_results
+
+def _check_memory_budget(memory_budget, simulation_count, batch_patients,
+                         location_block_size):
+    '''Raise a ValueError if a memory budget is combined with options that
+        can't run in chunks'''
+    if memory_budget is None:
+        return
+    if batch_patients or location_block_size:
+        raise ValueError('memory_budget can only be used with one task per '
+                         'scenario or shared_inputs')
+    if _adaptive_count(simulation_count) is not None:
+        raise ValueError('memory_budget needs a fixed number of simulations')
+
+def _scenario_results(patient, point, these_results, hospital_network,
+                      uses_hospital_performance, fix_performance):
+    '''Build the output row for one patient at one location. Every
+        reachable hospital has a count, including those left out of the
+        simulation because they can never be optimal.'''
+    cbc = these_results.counts_by_center
+    n_primaries = sum(center.center_type is sc.CenterType.PRIMARY
+                      for center in cbc)
+    results = _patient_columns(patient, point, uses_hospital_performance,
+                               fix_performance, n_primaries,
+                               len(cbc) - n_primaries, sum(cbc.values()))
+    cbc = {str(center): count for center, count in cbc.items()}
+    results.update(cbc)
+    # add nan for hospital that are never optimal
+    zero_c = {
+        str(hospital): float('nan')
+        for hospital in hospital_network.centers
+        if str(hospital) not in results.keys()
+    }
+    results.update(zero_c)
+    return results
+
+
+def _count_results(patient, points, counts, hospital_network,
+                   uses_hospital_performance, fix_performance):
+    '''Build output rows for one patient from a (locations x hospitals)
+        matrix of optimal counts, where -1 marks hospitals that can't be
+        reached'''
+    columns = [str(hospital) for hospital in hospital_network.centers]
+    is_primary = hospital_network.center_types == sc.CenterType.PRIMARY
+    rows = []
+    for point, these_counts in zip(points, counts):
+        reachable = these_counts >= 0
+        results = _patient_columns(patient, point, uses_hospital_performance,
+                                   fix_performance,
+                                   int((reachable & is_primary).sum()),
+                                   int((reachable & ~is_primary).sum()),
+                                   int(these_counts[reachable].sum()))
+        results.update(
+            (column, int(count) if count >= 0 else float('nan'))
+            for column, count in zip(columns, these_counts))
+        rows.append(results)
+    return rows
+
+
+def _patient_columns(patient, point, uses_hospital_performance,
+                     fix_performance, psc_count, csc_count, simulations):
+    '''Columns describing the scenario, before the hospital counts.
+        simulations is the number of model runs counted, which varies by
+        location with an AdaptiveCount.'''
     results = collections.OrderedDict()
     results['Location'] = point
     results['Patient'] = patient.pid
     results['Use Real DTN'] = uses_hospital_performance
     results['Varying Hospitals'] = not fix_performance
-    results['PSC Count'] = len(model.primaries)
-    results['CSC Count'] = len(model.comprehensives)
+    results['PSC Count'] = psc_count
+    results['CSC Count'] = csc_count
     results['Sex'] = 'male' if patient.sex == constants.Sex.MALE else 'female'
     results['Age'] = patient.age
     results['Symptoms'] = patient.symptom_time
@@ -267,15 +885,7 @@ def run_one_scenario(patient,
         results['NIHSS'] = patient.severity.score
     else:
         results['RACE'] = patient.severity.score
-    cbc = these_results.counts_by_center
-    cbc = {str(center): count for center, count in cbc.items()}
-    results.update(cbc)
-    # add nan for hospital that are never optimal
-    zero_c = {
-        str(hospital): float('nan')
-        for hospital in hospital_list if str(hospital) not in results.keys()
-    }
-    results.update(zero_c)
+    results['Simulations'] = simulations
     return results
 
 
@@ -316,23 +926,44 @@ def main(args):
         res_name = args.res_name
     else:
         res_name = None
+    if hasattr(args, 'manifest'):
+        manifest = args.manifest
+    else:
+        manifest = None
+    prune = getattr(args, 'prune', False)
+    seed = getattr(args, 'seed', None)
+    dtype = np.float32 if getattr(args, 'float32', False) else np.float64
+    memory_budget = getattr(args, 'memory_budget', None)
+    if memory_budget is not None:
+        memory_budget = int(memory_budget * 2**20)
 
     if args.multicore:
         cores = None
     else:
         cores = False
 
-    run_model_real_data(
-        times_file,
-        hospitals_file,
-        patient_count=patient_count,
-        fix_performance=False,
-        simulation_count=simulation_count,
-        cores=cores,
-        base_dir=base_dir,
-        locations=locations,
-        res_name=res_name,
-        **kwargs)
+    timings_file = getattr(args, 'timings', None)
+    if timings_file:
+        timing.enable()
+    with timing.stage('run'):
+        run_model_real_data(
+            times_file,
+            hospitals_file,
+            patient_count=patient_count,
+            fix_performance=False,
+            simulation_count=simulation_count,
+            cores=cores,
+            base_dir=base_dir,
+            locations=locations,
+            res_name=res_name,
+            manifest=manifest,
+            prune=prune,
+            seed=seed,
+            dtype=dtype,
+            memory_budget=memory_budget,
+            **kwargs)
+    if timings_file:
+        timing.write_summary(timing.disable(), timings_file)
 
 
 def main_default_dtn(args):
@@ -357,23 +988,44 @@ def main_default_dtn(args):
         res_name = args.res_name
     else:
         res_name = None
+    if hasattr(args, 'manifest'):
+        manifest = args.manifest
+    else:
+        manifest = None
+    prune = getattr(args, 'prune', False)
+    seed = getattr(args, 'seed', None)
+    dtype = np.float32 if getattr(args, 'float32', False) else np.float64
+    memory_budget = getattr(args, 'memory_budget', None)
+    if memory_budget is not None:
+        memory_budget = int(memory_budget * 2**20)
 
     if args.multicore:
         cores = None
     else:
         cores = False
 
-    run_model_defaul_dtn(
-        times_file,
-        hospitals_file,
-        patient_count=patient_count,
-        fix_performance=False,
-        simulation_count=simulation_count,
-        cores=cores,
-        base_dir=base_dir,
-        locations=locations,
-        res_name=res_name,
-        **kwargs)
+    timings_file = getattr(args, 'timings', None)
+    if timings_file:
+        timing.enable()
+    with timing.stage('run'):
+        run_model_defaul_dtn(
+            times_file,
+            hospitals_file,
+            patient_count=patient_count,
+            fix_performance=False,
+            simulation_count=simulation_count,
+            cores=cores,
+            base_dir=base_dir,
+            locations=locations,
+            res_name=res_name,
+            manifest=manifest,
+            prune=prune,
+            seed=seed,
+            dtype=dtype,
+            memory_budget=memory_budget,
+            **kwargs)
+    if timings_file:
+        timing.write_summary(timing.disable(), timings_file)
 
 
 if __name__ == '__main__':
@@ -389,13 +1041,36 @@ if __name__ == '__main__':
     p_help += f' (default {p_default})'
     parser.add_argument(
         '-p', '--patients', type=int, default=p_default, help=p_help)
-    s_help = f'number of model runs for each scenario (default {s_default})'
+    s_help = f'number of model runs for each scenario (default {s_default}),'
+    s_help += ' or auto to run each location until its results converge'
     parser.add_argument(
-        '-s', '--simulations', type=int, default=1000, help=s_help)
+        '-s', '--simulations', type=simulation_count_arg, default=s_default,
+        help=s_help)
     parser.add_argument(
         '-m',
         '--multicore',
         action='store_true',
         help='Use all available CPU cores')
+    parser.add_argument(
+        '--manifest',
+        help='file recording completed scenarios, skipped when rerun')
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        help='skip strategies that can never be optimal at a location')
+    parser.add_argument(
+        '--seed', type=int,
+        help='seed for the run, so it can be repeated exactly')
+    parser.add_argument(
+        '--float32',
+        action='store_true',
+        help='simulate in single precision to halve memory use')
+    parser.add_argument(
+        '--memory-budget', type=float,
+        help='run each scenario in chunks within this many MB per worker')
+    parser.add_argument(
+        '--timings', nargs='?', const='-', metavar='FILE',
+        help='time each stage of the run and write a JSON summary to FILE, '
+        'or print it if no file is given')
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,100 @@
+"""
+Record completed scenarios so an interrupted run can resume without
+    repeating or skipping work
+"""
+import json
+import os
+from stroke import constants
+
+
+class RunManifest:
+    '''
+    Append-only record of completed scenarios, one JSON object per line.
+        A scenario is a patient, by id and profile, at one location for one
+        hospital variant, simulation count and seed.
+    '''
+
+    def __init__(self, manifest_file):
+        '''
+        Open the manifest, loading any scenarios already recorded. A line
+            left incomplete by a crash is ignored.
+        '''
+        self.manifest_file = str(manifest_file)
+        self._completed = set()
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, 'r') as f:
+                for line in f:
+                    try:
+                        scenario = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._completed.add(_key(scenario))
+
+    def __len__(self):
+        return len(self._completed)
+
+    @staticmethod
+    def scenario(patient, point, hospital_variant, simulation_count,
+                 seed=None):
+        '''
+        Describe a scenario as a dictionary of JSON values.
+            hospital_variant -- identifies the hospital list and how it was
+                                run, e.g. whether real DTN data was used
+        '''
+        return {
+            'patient': _json_value(patient.pid),
+            'sex': 'male' if patient.sex == constants.Sex.MALE else 'female',
+            'age': _json_value(patient.age),
+            'severity': type(patient.severity).__name__,
+            'score': _json_value(patient.severity.score),
+            'symptoms': _json_value(patient.symptom_time),
+            'location': str(point),
+            'hospitals': hospital_variant,
+            'simulations': str(simulation_count),
+            'seed': seed,
+        }
+
+    def is_complete(self, scenario):
+        '''Check if the scenario has been recorded'''
+        return _key(scenario) in self._completed
+
+    def record(self, scenarios):
+        '''
+        Record completed scenarios. Each is written with a single append
+            and flushed to disk, so a scenario is either fully recorded or
+            ignored on reload. A line left without its newline by a crash is
+            ended first, so it can't run into the next record.
+        '''
+        for scenario in scenarios:
+            line = (json.dumps(scenario, sort_keys=True) + '\n').encode()
+            fd = os.open(self.manifest_file,
+                         os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                size = os.fstat(fd).st_size
+                if size:
+                    os.lseek(fd, size - 1, os.SEEK_SET)
+                    if os.read(fd, 1) != b'\n':
+                        line = b'\n' + line
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._completed.add(_key(scenario))
+
+
+def open_manifest(manifest):
+    '''Get a RunManifest from a file name, or None if not given'''
+    if manifest is None or isinstance(manifest, RunManifest):
+        return manifest
+    return RunManifest(manifest)
+
+
+def _key(scenario):
+    return json.dumps(scenario, sort_keys=True)
+
+
+def _json_value(value):
+    '''Convert numpy scalars to plain numbers for JSON'''
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
@@ -44,6 +44,8 @@ DTN_COLS = ['IVTPA_P25', 'IVTPA_MEDIAN', 'IVTPA_P75','IVTPA_N']
 DTP_COLS = ['IATPA_P25', 'IATPA_MEDIAN', 'IATPA_P75','IATPA_N']
 
 def load_dtn(dtn_file=DTN_FILE):
+    if str(dtn_file).endswith('.csv'): # e.g. from synthetic_inputs.py
+        return pd.read_csv(dtn_file).set_index('HOSP_KEY')
     return pd.read_excel(dtn_file).set_index('HOSP_KEY')
 
 def load_hospital(hospital_file=HOSPITAL_PATH):
@@ -14,7 +14,8 @@ class Outcome:
         arrays with rows for model runs and columns for destination hospitals
         or lower-dimensional representation that can be broadcast to the full
         array (in the case where the value is the same for all hospitals and/or
-        model runs).
+        model runs). A leading patient axis may be added in front of the
+        model runs when a table of patients is evaluated together.
     """
 
     @property
@@ -38,17 +39,50 @@ class Outcome:
         """
         Combine outcomes for multiple sets of strategies
         """
-        p_good = np.concatenate([self.p_good, other.p_good], axis=1)
+        p_good = np.concatenate([self.p_good, other.p_good], axis=-1)
         p_tpa = np.concatenate([self._reshape(self.p_tpa),
-                                other._reshape(other.p_tpa)], axis=1)
+                                other._reshape(other.p_tpa)], axis=-1)
         p_evt = np.concatenate([self._reshape(self.p_evt),
-                                other._reshape(other.p_evt)], axis=1)
+                                other._reshape(other.p_evt)], axis=-1)
         p_transfer = np.concatenate([self._reshape(self.p_transfer),
-                                     other._reshape(other.p_transfer)], axis=1)
+                                     other._reshape(other.p_transfer)],
+                                    axis=-1)
         strategies = self.strategies + other.strategies
         return Outcome(p_good, p_tpa, p_evt, p_transfer, strategies)
 
+    @classmethod
+    def concatenate(cls, outcomes):
+        """
+        Combine outcomes for the same strategies from several sets of model
+            runs, in the order given
+        """
+        arrays = [
+            np.concatenate([outcome._reshape(getattr(outcome, name))
+                            for outcome in outcomes], axis=-2)
+            for name in ('p_good', 'p_tpa', 'p_evt', 'p_transfer')
+        ]
+        return cls(*arrays, outcomes[0].strategies)
+
+    def select(self, index, strategy_mask=None):
+        """
+        Select along the leading axis of the full outcome array, e.g. a
+            single patient from a batch, and optionally only the strategies
+            where strategy_mask is True.
+        """
+        if strategy_mask is None:
+            strategy_mask = np.ones(len(self.strategies), dtype=bool)
+        strategies = [strategy for strategy, keep in
+                      zip(self.strategies, strategy_mask) if keep]
+        return Outcome(self.p_good[index][..., strategy_mask],
+                       self._reshape(self.p_tpa)[index][..., strategy_mask],
+                       self._reshape(self.p_evt)[index][..., strategy_mask],
+                       self._reshape(self.p_transfer)[index][...,
+                                                             strategy_mask],
+                       strategies)
+
     def _reshape(self, array):
+        # scalars take the type of p_good, so float32 outcomes stay float32
+        array = np.asarray(array, dtype=np.result_type(array, self.p_good))
         return np.broadcast_arrays(array, self.p_good)[0]
 
 
@@ -90,7 +124,8 @@ class IschemicModel:
         onset_needle = self.times.onset_needle_comprehensive
         onset_puncture = self.times.onset_evt_noship
         p_good = self._get_p_good(onset_needle, onset_puncture)
-        p_tpa = np.where(onset_needle < constants.time_limit_tpa(), 1, 0)
+        p_tpa = (onset_needle < constants.time_limit_tpa()).astype(
+            onset_needle.dtype)
         p_evt = np.where(onset_puncture < constants.time_limit_evt(),
                          self.times.p_lvo, 0)
         p_transfer = 0
@@ -115,7 +150,7 @@ class IschemicModel:
         p_good = np.where(evt_possible,
                           self._get_p_good(onset_needle, onset_puncture),
                           np.NaN)
-        p_tpa = np.where(tpa_possible, 1, 0)
+        p_tpa = tpa_possible.astype(onset_needle.dtype)
         p_evt = np.where(evt_possible, self.times.p_lvo, 0)
         # We assume transfer happens, since otherwise this is just a repeat of
         #   primary strategy. Ideally we might model an estimated
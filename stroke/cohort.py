@@ -1,10 +1,15 @@
 """
 Long term costs and QALYs via markov model simulation
 """
+import copy
 import numpy as np
 from . import constants, costs
+from .ais_outcomes import Outcome
 from .constants import States
-from .life_tables import LifeTables
+from .life_tables import LifeTables, simpsons_multiplier
+from .patient import Patient, PatientBatch
+
+METRICS = ('qalys', 'lys', 'costs')
 
 
 class Population:
@@ -18,31 +23,103 @@ class Population:
     def __init__(self, patient, ais_outcomes, horizon=None):
         """
         Initialize a cohort for a particular patient with given AIS outcomes
-            for a particular set of strategies.
+            for a particular set of strategies. The patient may be a
+            PatientBatch, in which case outcomes have a leading patient axis.
         """
+        self.patient = patient
         self.start_age = patient.age
         self.sex = patient.sex
         self.severity = patient.severity
         self.strategies = ais_outcomes.strategies
         self.horizon = horizon
         self.ais_outcomes=ais_outcomes
-        self._break_into_states(ais_outcomes) # starting states and costs based on stroke type and treatment
 
-    def analyze(self):
+    def analyze(self, metrics=METRICS, method='affine'):
         """
         Run full Markov analysis on this cohort, generating costs and QALYs
             for each model run and hospital
+            metrics -- which of 'qalys', 'lys' and 'costs' to compute, the
+                       others are set to None
+            method -- 'affine' applies cached per-profile coefficients from
+                      ValueFunction to the AIS outcomes, 'streaming' folds
+                      discounting and Simpson weights into running sums year
+                      by year, 'trace' stores the states for every year before
+                      summing
         """
-        self._run_markov()
-        self._get_qalys_per_year()
-        self._get_lys_per_year()
-        self._get_costs_per_year()
-        self.qalys = simpsons_1_3rd_correction(self._qalys_per_year,
-                                               self.horizon)
-        self.costs = simpsons_1_3rd_correction(self._costs_per_year,
-                                               self.horizon)
-        self.lys = simpsons_1_3rd_correction(self._lys_per_year,
-                                               self.horizon)
+        for metric in metrics:
+            if metric not in METRICS:
+                raise ValueError(f'Unrecognized metric {metric}')
+
+        if method == 'affine':
+            value_function = ValueFunction.for_patient(self.patient,
+                                                       self.horizon)
+            values = {metric: value_function.evaluate(metric,
+                                                      self.ais_outcomes)
+                      for metric in metrics}
+        elif isinstance(self.patient, PatientBatch):
+            raise ValueError('Patient batches require the affine method')
+        elif method == 'streaming':
+            # starting states and costs based on stroke type and treatment
+            self._break_into_states(self.ais_outcomes)
+            values = self._run_markov_streaming(metrics)
+        elif method == 'trace':
+            self._break_into_states(self.ais_outcomes)
+            self._run_markov()
+            self._get_qalys_per_year()
+            self._get_lys_per_year()
+            self._get_costs_per_year()
+            values = {
+                'qalys': self._qalys_per_year,
+                'lys': self._lys_per_year,
+                'costs': self._costs_per_year
+            }
+            values = {metric: simpsons_1_3rd_correction(values[metric],
+                                                        self.horizon)
+                      for metric in metrics}
+        else:
+            raise ValueError(f'Unrecognized Markov method {method}')
+
+        for metric in METRICS:
+            setattr(self, metric, values.get(metric))
+
+    @classmethod
+    def concatenate(cls, populations):
+        """
+        Combine analyzed cohorts for the same patient and strategies from
+            several sets of model runs, in the order given
+        """
+        population = copy.copy(populations[0])
+        population.ais_outcomes = Outcome.concatenate(
+            [p.ais_outcomes for p in populations])
+        for metric in METRICS:
+            values = [getattr(p, metric, None) for p in populations]
+            if values[0] is not None:
+                setattr(population, metric, np.concatenate(values, axis=-2))
+        return population
+
+    def select(self, index, strategy_mask=None):
+        """
+        Select a single patient's cohort from a cohort for a PatientBatch,
+            or a single location from a block of map points, keeping any
+            analysis results. Only strategies where strategy_mask is True
+            are kept, if given.
+        """
+        population = copy.copy(self)
+        if isinstance(self.patient, PatientBatch):
+            population.patient = self.patient[index]
+            population.start_age = population.patient.age
+            population.sex = population.patient.sex
+            population.severity = population.patient.severity
+        population.ais_outcomes = self.ais_outcomes.select(index,
+                                                           strategy_mask)
+        population.strategies = population.ais_outcomes.strategies
+        if strategy_mask is None:
+            strategy_mask = np.ones(len(self.strategies), dtype=bool)
+        for metric in METRICS:
+            value = getattr(self, metric, None)
+            if value is not None:
+                setattr(population, metric, value[index][..., strategy_mask])
+        return population
 
     def _break_into_states(self, ais_outcomes):
         """
@@ -74,11 +151,10 @@ class Population:
         states += hemorrhagic_states
 
         # We assume that mimics are at gen pop (headache, migraine, etc.)
-        states[:, :, States.GEN_POP] += pop_mimic
+        states[..., States.GEN_POP] += pop_mimic
 
         # states matrix size: num of simulations x number of strategies x 8 (number of states)
         self.states = states
-        print(self.states[0,66,:])
 
         # Get first year costs
         first_costs = costs.first_year_costs(hemorrhagic_states, ais_states)
@@ -87,44 +163,72 @@ class Population:
         first_costs += (costs.cost_transfer() * ais_outcomes.p_transfer *
                         pop_ischemic)
 
-        # Store costs as a list of arrays
-        self._costs_per_year = [first_costs]
+        self._first_costs = first_costs
 
     def _run_markov(self):
         """
         Given starting states in self.states, generate a list of states for
             each year from start to END_AGE
         """
+        self._survival_table = LifeTables.survival_table(
+            self.sex, self.start_age, end_age=Population.END_AGE)
         self._states_per_year = [self.states.copy()]
         current_states = self.states
-        current_age = self.start_age
-        while current_age < Population.END_AGE:
-            # We run a range up to death because we don't want to include death
-            # since it only markovs to itself
-            for state in range(States.DEATH):
-                p_dead = LifeTables.adjusted_mortality(
-                    self.sex, current_age, constants.hazard_mort(state)
-                )
-                deaths = current_states[:, :, state] * p_dead
-                current_states[:, :, state] -= deaths
-                current_states[:, :, States.DEATH] += deaths
-
-            current_age += 1
+        for p_dead in self._survival_table.p_dead:
+            _apply_mortality(current_states, p_dead)
             self._states_per_year.append(current_states.copy())
 
+    def _run_markov_streaming(self, metrics):
+        """
+        Run the Markov model from the starting states in self.states,
+            accumulating the requested metrics as it goes instead of storing
+            the states for every year. Returns a dictionary of arrays keyed by
+            metric.
+        """
+        table = LifeTables.survival_table(self.sex, self.start_age,
+                                          horizon=self.horizon,
+                                          end_age=Population.END_AGE)
+        sums = {metric: 0 for metric in metrics}
+        current_states = self.states.copy()
+        for year in range(table.end_index + 1):
+            if year > 0:
+                _apply_mortality(current_states, table.p_dead[year - 1])
+
+            multiplier = table.simpson[year]
+            if 'qalys' in metrics:
+                qaly = 0
+                for state in range(States.DEATH):
+                    qaly += (current_states[..., state] *
+                             constants.utilities_mrs(state))
+                qaly *= table.discount[year]
+                sums['qalys'] += qaly * multiplier
+            if 'lys' in metrics:
+                ly = 0
+                for state in range(States.DEATH):
+                    ly += current_states[..., state]
+                sums['lys'] += ly * multiplier
+            if 'costs' in metrics:
+                if year == 0:
+                    # First year costs are computed in _break_into_states
+                    yearly_costs = self._first_costs
+                else:
+                    yearly_costs = costs.annual_costs(current_states)
+                    yearly_costs *= table.discount[year]
+                sums['costs'] += yearly_costs * multiplier
+        return sums
+
     def _get_qalys_per_year(self):
         """
         Generate a list of discounted quality-adjusted life years at each year
         """
-        continuous_discount = 0.03
-        discrete_discount = np.exp(continuous_discount) - 1
+        discount = self._survival_table.discount
         qalys = []
         for year, states in enumerate(self._states_per_year):
             qaly = 0
             for state in range(constants.States.DEATH):
-                qaly += states[:, :, state] * constants.utilities_mrs(state)
+                qaly += states[..., state] * constants.utilities_mrs(state)
             # Discount
-            qaly /= ((1 + discrete_discount)**year)
+            qaly *= discount[year]
             qalys.append(qaly)
 
         self._qalys_per_year = qalys
@@ -137,7 +241,7 @@ class Population:
         for year, states in enumerate(self._states_per_year):
             ly = 0
             for state in range(constants.States.DEATH):
-                ly += states[:, :, state]
+                ly += states[..., state]
             lys.append(ly)
         self._lys_per_year = lys
 
@@ -145,17 +249,150 @@ class Population:
         """
         Generate a list of discounted costs at each year
         """
-        continuous_discount = 0.03
-        discrete_discount = np.exp(continuous_discount) - 1
+        discount = self._survival_table.discount
+        # First year costs are computed in _break_into_states
+        self._costs_per_year = [self._first_costs]
         for year, states in enumerate(self._states_per_year):
             if year == 0:
-                # First year costs are computed in _break_into_states
                 continue
             yearly_costs = costs.annual_costs(states)
-            yearly_costs /= ((1 + discrete_discount)**year)
+            yearly_costs *= discount[year]
             self._costs_per_year.append(yearly_costs)
 
 
+class ValueFunction:
+    """
+    Discounted QALYs, life years and costs as affine functions of the AIS
+        outcomes. Severity.break_up_ais_patients is affine in p_good, the
+        Markov model is linear in the starting states and first year costs are
+        linear in p_tpa, p_evt and p_transfer, so each metric is
+        a + b * p_good + c * p_tpa + d * p_evt + e * p_transfer with
+        coefficients depending only on the patient profile.
+    """
+
+    TERMS = ('p_good', 'p_tpa', 'p_evt', 'p_transfer')
+
+    # Cache of computed value functions, keyed by patient profile and the
+    #   model constants the coefficients depend on
+    _cache = {}
+
+    @classmethod
+    def for_patient(cls, patient, horizon=None):
+        """
+        Get the value function for a Patient, or for a PatientBatch one with
+            coefficients stacked along a leading patient axis.
+        """
+        if isinstance(patient, PatientBatch):
+            return cls.stack([
+                cls.for_profile(p.sex, p.age, p.severity, horizon)
+                for p in patient.patients
+            ])
+        return cls.for_profile(patient.sex, patient.age, patient.severity,
+                               horizon)
+
+    @classmethod
+    def stack(cls, value_functions):
+        """
+        Combine value functions for several patients into one whose
+            coefficients broadcast against (patients, model runs, strategies)
+            outcome arrays.
+        """
+        stacked = cls.__new__(cls)
+        stacked.coefficients = {
+            metric: np.stack([vf.coefficients[metric]
+                              for vf in value_functions],
+                             axis=-1)[..., np.newaxis, np.newaxis]
+            for metric in METRICS
+        }
+        return stacked
+
+    @classmethod
+    def for_profile(cls, sex, age, severity, horizon=None):
+        """
+        Get the value function for the given patient profile, computing it
+            only the first time the profile is seen in this process.
+        """
+        key = (sex, age, severity.NIHSS, horizon, costs.Costs.YEAR,
+               tuple(constants.HAZARDS_MORTALITY.items()),
+               tuple(constants.UTILITIES.items()))
+        if key not in cls._cache:
+            cls._cache[key] = cls(sex, age, severity, horizon)
+        return cls._cache[key]
+
+    def __init__(self, sex, age, severity, horizon=None):
+        """
+        Compute coefficients from the starting states and first year costs
+            of unit outcomes for each term, valued with the survival table
+            annuities for this profile.
+        """
+        n_terms = len(ValueFunction.TERMS)
+        basis = np.hstack([np.zeros((n_terms, 1)), np.eye(n_terms)])
+        # Shape: 1 x (number of terms + 1), one column per basis outcome
+        basis_outcomes = Outcome(*basis.reshape(n_terms, 1, n_terms + 1),
+                                 strategies=None)
+        patient = Patient(sex, age, None, severity)
+        population = Population(patient, basis_outcomes, horizon)
+        population._break_into_states(basis_outcomes)
+
+        # Value of one member of the cohort starting in each state
+        table = LifeTables.survival_table(sex, age, horizon=horizon,
+                                          end_age=Population.END_AGE)
+        utilities = np.array([constants.utilities_mrs(state)
+                              for state in range(States.DEATH)])
+        annual_costs = np.array([costs.Costs.ANNUAL[state]
+                                 for state in range(States.DEATH)])
+        # First year costs are computed in _break_into_states, so later
+        #   costs are weighted from year 1 on
+        later_weights = table.simpson * table.discount
+        later_weights[0] = 0
+        later_alive = later_weights @ table.survival
+        later_death_cost = costs.Costs.DEATH * later_weights.sum()
+        per_state = {
+            'qalys': np.append(utilities * table.annuity, 0),
+            'lys': np.append(table.life_years, 0),
+            'costs': np.append(
+                annual_costs * later_alive +
+                costs.Costs.DEATH * (later_weights.sum() - later_alive),
+                later_death_cost)
+        }
+
+        self.coefficients = {}
+        for metric in METRICS:
+            values = (population.states @ per_state[metric])[0]
+            if metric == 'costs':
+                values += population._first_costs[0] * table.simpson[0]
+            # constant term first, then the slope for each term
+            self.coefficients[metric] = np.concatenate(
+                [values[:1], values[1:] - values[0]])
+
+    def evaluate(self, metric, ais_outcomes):
+        """
+        Compute the given metric for every model run and strategy in the
+            AIS outcomes.
+        """
+        coefficients = self.coefficients[metric]
+        p_good = np.asarray(ais_outcomes.p_good)
+        if p_good.dtype.kind == 'f':
+            # keep float32 outcomes in float32
+            coefficients = coefficients.astype(p_good.dtype, copy=False)
+        value = coefficients[0]
+        for coefficient, term in zip(coefficients[1:], ValueFunction.TERMS):
+            value = value + coefficient * getattr(ais_outcomes, term)
+        return value
+
+
+def _apply_mortality(states, p_dead):
+    """
+    Move one year of deaths out of each living state into death, in place.
+        p_dead holds the probability of dying for each living state.
+    """
+    # Death is excluded from the living states since it only markovs to
+    #   itself
+    deaths = states[..., :States.DEATH] * p_dead
+    states[..., :States.DEATH] -= deaths
+    states[..., States.DEATH] += deaths.sum(axis=-1)
+
+
 def simpsons_1_3rd_correction(yearly_value, years_horizon=None):
     '''
     Returns the sum of the list of arrays inputted for either
@@ -163,20 +400,11 @@ def simpsons_1_3rd_correction(yearly_value, years_horizon=None):
     can run for the correction for any number of years as long as it is
     specified.
     '''
-    multiplier = 1 / 3
-    sum_ = yearly_value[0] * multiplier
-    start_index = 1
     end_index = len(yearly_value) - 1
     if years_horizon is not None and years_horizon <= end_index:
         end_index = years_horizon
+    sum_ = yearly_value[0] * simpsons_multiplier(0, end_index)
     # Since for in range in [a, b)
-    for i in range(start_index, end_index + 1):
-        if i == end_index:
-            multiplier = 1 / 3
-        else:
-            if i % 2 == 0:
-                multiplier = 2 / 3
-            else:
-                multiplier = 4 / 3
-        sum_ += (yearly_value[i] * multiplier)
+    for i in range(1, end_index + 1):
+        sum_ += (yearly_value[i] * simpsons_multiplier(i, end_index))
     return sum_
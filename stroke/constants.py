@@ -51,6 +51,13 @@ def time_limit_evt():
     return 360
 
 
+def discount_rate():
+    '''
+    Continuous annual discount rate for QALYs and costs
+    '''
+    return 0.03
+
+
 # PLUMBER Study
 def p_call_is_mimic():
     # incude TIA
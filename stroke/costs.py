@@ -135,13 +135,13 @@ def first_year_costs(states_hemorrhagic, states_ischemic):
         # capture all costs for living patients
         hemorrhagic_cost = ((90 / 360) * Costs.DAYS_90_ICH[state] +
                             ((360 - 90) / 360) * Costs.ANNUAL[state])
-        cost += states_hemorrhagic[:, :, state] * hemorrhagic_cost
+        cost += states_hemorrhagic[..., state] * hemorrhagic_cost
         ischemic_cost = ((90 / 360) * Costs.DAYS_90_ISCHEMIC[state] +
                          ((360 - 90) / 360) * Costs.ANNUAL[state])
-        cost += states_ischemic[:, :, state] * ischemic_cost
+        cost += states_ischemic[..., state] * ischemic_cost
 
-    cost += states_hemorrhagic[:, :, States.DEATH] * Costs.DEATH
-    cost += states_ischemic[:, :, States.DEATH] * Costs.DEATH
+    cost += states_hemorrhagic[..., States.DEATH] * Costs.DEATH
+    cost += states_ischemic[..., States.DEATH] * Costs.DEATH
     return cost
 
 
@@ -150,10 +150,10 @@ def annual_costs(states):
     cost = 0
     for state in range(States.DEATH):
         # capture all costs for living patients
-        cost += states[:, :, state] * Costs.ANNUAL[state]
+        cost += states[..., state] * Costs.ANNUAL[state]
 
     # Should death costs be added in every year like this? As I read it
-    #  states[:, :, States.DEATH] is all cumulative deaths, not new deaths
-    cost += states[:, :, States.DEATH] * Costs.DEATH
+    #  states[..., States.DEATH] is all cumulative deaths, not new deaths
+    cost += states[..., States.DEATH] * Costs.DEATH
 
     return cost
@@ -0,0 +1,182 @@
+"""
+Find strategies that can never be optimal from bounds on the sampled times,
+    so they can be left out of a simulation
+"""
+import numpy as np
+from . import cohort, constants, results, stroke_center as sc, strategy
+
+# Margin in minutes for comparisons of time bounds, so sums rounded in a
+#   different order than the simulation never change a decision
+MARGIN = 1e-6
+
+
+class OnsetTimeBounds:
+    """
+    Lowest and highest onset to treatment times that can be sampled for each
+        hospital in a network, from the travel time bounds and the ranges of
+        the intra-hospital time distributions. Arrays are shaped
+        (hospitals, 2) holding (low, high), NaN where a time doesn't apply.
+    """
+
+    def __init__(self, symptom_time, hospital_network, travel_bounds):
+        """
+        Compute bounds for a patient with the given symptom time.
+            travel_bounds -- (no traffic, traffic) bounds shaped
+                             (hospitals, 2) in network order, NaN for
+                             hospitals that can't be reached
+        """
+        self.travel = np.sort(np.asarray(travel_bounds, dtype=float), axis=1)
+        door_to_needle = hospital_network.door_to_needle_bounds()
+        door_to_puncture = hospital_network.door_to_puncture_bounds()
+        self.onset_needle = symptom_time + self.travel + door_to_needle
+        self.onset_puncture = symptom_time + self.travel + door_to_puncture
+
+        # Primary door to needle times cancel out of drip and ship times
+        destinations = hospital_network.transfer_index
+        transfer_time = hospital_network.transfer_time[:, np.newaxis]
+        self.onset_evt_ship = np.where(
+            (destinations >= 0)[:, np.newaxis],
+            symptom_time + self.travel + transfer_time +
+            door_to_puncture[destinations],
+            np.NaN)
+
+
+class Pruning:
+    """
+    Hospitals left to simulate after removing the strategies that can never
+        be optimal for a patient, and the strategies removed
+    """
+
+    def __init__(self, rows, bounds, transfers, strategies, pruned,
+                 certain=None):
+        """
+        rows -- network rows of the hospitals to simulate, in row order
+        bounds -- their (no traffic, traffic) travel time bounds
+        transfers -- boolean mask aligned with rows, False where drip and
+                     ship can never reach EVT in time
+        strategies -- every strategy at the location, pruned or not
+        pruned -- strategies that can never be optimal
+        certain -- the strategy that is optimal in every model run, if only
+                   one can ever be
+        """
+        self.rows = rows
+        self.bounds = bounds
+        self.transfers = transfers
+        self.strategies = strategies
+        self.pruned = pruned
+        self.certain = certain
+
+
+def prune(patient, hospital_network, rows, bounds,
+          threshold_ICER=results.THRESHOLD_ICER):
+    """
+    Find the strategies that can never be optimal for a patient at a
+        location, without sampling any times.
+        rows, bounds -- network rows of the hospitals that can be reached
+                        and their travel time bounds, as given to
+                        StrokeModel.set_reachable_times
+    A strategy is dominated by another of the same kind if its best time is
+        slower than the other's worst time, and both always fall on the same
+        side of the tPA and EVT time limits. Costs of the two then only
+        differ through the probability of a good outcome, so the faster one
+        has at least the net monetary benefit of the slower one in every
+        model run. Travel times must also be strictly ordered so ties go to
+        the faster strategy. Drip and ship is never viable when the best
+        onset to puncture time misses the EVT time limit.
+    Costs.inflate should be called first, as the net benefit of a good
+        outcome depends on the cost year.
+    Returns a Pruning.
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    bounds = np.asarray(bounds, dtype=float)
+    local_network = hospital_network.subnetwork(rows)
+    travel = np.full((len(local_network), 2), np.NaN)
+    travel[:len(rows)] = bounds
+    onset = OnsetTimeBounds(patient.symptom_time, local_network, travel)
+
+    is_primary = (local_network.center_types[:len(rows)] ==
+                  sc.CenterType.PRIMARY)
+    evt_limit = constants.time_limit_evt()
+    ship_low = onset.onset_evt_ship[:len(rows), 0]
+    # NaN compares False, so hospitals without a destination never ship
+    can_ship = is_primary & (ship_low < evt_limit - MARGIN)
+
+    dominated = np.zeros(len(rows), dtype=bool)
+    if _benefit_slope(patient, threshold_ICER) > 0:
+        for primaries, time_arrays in [
+                (True, [onset.onset_needle]),
+                (False, [onset.onset_needle, onset.onset_puncture])]:
+            kind_rows = np.flatnonzero(is_primary == primaries)
+            dominated[kind_rows] = _dominated(
+                onset.travel[kind_rows],
+                [times[kind_rows] for times in time_arrays], primaries)
+
+    # Primary centers are only dropped once drip and ship is also ruled out
+    keep = ~dominated | can_ship
+    centers = local_network.centers
+    strategies = []
+    pruned = []
+    candidates = []
+    for i in range(len(rows)):
+        if is_primary[i]:
+            primary = strategy.Strategy.primary(centers[i])
+            drip_and_ship = strategy.Strategy.drip_and_ship(centers[i])
+            strategies += [primary, drip_and_ship]
+            if not keep[i]:
+                pruned += [primary, drip_and_ship]
+            if not dominated[i]:
+                candidates.append(primary)
+            if can_ship[i]:
+                candidates.append(drip_and_ship)
+        else:
+            comprehensive = strategy.Strategy.comprehensive(centers[i])
+            strategies.append(comprehensive)
+            if keep[i]:
+                candidates.append(comprehensive)
+            else:
+                pruned.append(comprehensive)
+    certain = None
+    if len(candidates) == 1:
+        only = candidates[0]
+        i = local_network.row(only.center)
+        # Drip and ship is only certain if EVT is always possible after
+        #   the transfer, since otherwise some runs have no valid strategy
+        if (only.kind is not constants.StrategyKind.DRIP_AND_SHIP or
+                onset.onset_evt_ship[i, 1] < evt_limit - MARGIN):
+            certain = only
+
+    return Pruning(rows[keep], bounds[keep], can_ship[keep], strategies,
+                   pruned, certain)
+
+
+def _benefit_slope(patient, threshold_ICER):
+    """Net monetary benefit of a unit increase in the probability of a good
+        outcome"""
+    value_function = cohort.ValueFunction.for_patient(patient)
+    qalys = value_function.coefficients['qalys'][1]
+    costs = value_function.coefficients['costs'][1]
+    return threshold_ICER * qalys - costs
+
+
+def _dominated(travel, time_arrays, is_primary):
+    """
+    Check which strategies of one kind are dominated by another.
+        travel -- travel time bounds shaped (strategies, 2)
+        time_arrays -- onset to needle (and for comprehensive centers onset
+                       to puncture) bounds, each shaped (strategies, 2)
+    """
+    # faster[a, b] is True if a is always faster than b
+    faster = travel[:, np.newaxis, 1] < travel[np.newaxis, :, 0] - MARGIN
+    limits = [constants.time_limit_tpa(), constants.time_limit_evt()]
+    for times, limit in zip(time_arrays, limits):
+        low = times[:, 0]
+        high = times[:, 1]
+        faster &= high[:, np.newaxis] < low[np.newaxis, :] - MARGIN
+        if is_primary:
+            # primary centers always give tPA, so only p_good differs
+            continue
+        # both strategies on the same side of the time limit in every run
+        both_within = high[np.newaxis, :] < limit - MARGIN
+        both_past = low[:, np.newaxis] >= limit + MARGIN
+        faster &= both_within | both_past
+    return faster.any(axis=0)
@@ -2,6 +2,7 @@
 CDC 2013 life tables
 '''
 import math
+import numpy as np
 from . import constants
 
 
@@ -51,6 +52,10 @@ class LifeTables(object):
         ]
     }
 
+    # Survival tables built so far in this process, keyed by
+    #   (sex, start age, hazards, discount rate, horizon, end age)
+    _survival_tables = {}
+
     @staticmethod
     def adjusted_mortality(sex, age, adjustment):
         '''
@@ -61,3 +66,75 @@ class LifeTables(object):
         rate_adjusted = rate_unadjusted * adjustment
         prob_adjusted = 1 - math.exp(-rate_adjusted)
         return prob_adjusted
+
+    @staticmethod
+    def survival_table(sex, start_age, hazards=None, discount_rate=None,
+                       horizon=None, end_age=100):
+        '''
+        Get the SurvivalTable for a cohort starting at start_age, building it
+        only the first time it is requested in this process. Hazards default
+        to the mortality hazard of each living state and the discount rate to
+        constants.discount_rate().
+        '''
+        if hazards is None:
+            hazards = [constants.hazard_mort(state)
+                       for state in range(constants.States.DEATH)]
+        if discount_rate is None:
+            discount_rate = constants.discount_rate()
+        key = (sex, start_age, tuple(hazards), discount_rate, horizon,
+               end_age)
+        if key not in LifeTables._survival_tables:
+            LifeTables._survival_tables[key] = SurvivalTable(*key)
+        return LifeTables._survival_tables[key]
+
+
+class SurvivalTable(object):
+    '''
+    Yearly mortality, survival and discounting for a cohort followed from
+    start_age, with one column for each mortality hazard. Rows run from year 0
+    to end_index, the last year included in the Simpson's 1/3rd correction.
+    '''
+
+    def __init__(self, sex, start_age, hazards, discount_rate, horizon,
+                 end_age):
+        end_index = end_age - start_age
+        if horizon is not None and horizon <= end_index:
+            end_index = horizon
+        self.end_index = end_index
+
+        # p_dead[year] is the probability of dying between year and year + 1
+        self.p_dead = np.array([
+            [LifeTables.adjusted_mortality(sex, start_age + year, hazard)
+             for hazard in hazards]
+            for year in range(end_index)
+        ]).reshape(end_index, len(hazards))
+
+        # Fraction of a cohort starting in each state still alive each year
+        survival = np.ones((end_index + 1, len(hazards)))
+        for year in range(end_index):
+            survival[year + 1] = (survival[year] -
+                                  survival[year] * self.p_dead[year])
+        self.survival = survival
+
+        discrete_discount = np.exp(discount_rate) - 1
+        years = np.arange(end_index + 1)
+        self.discount = 1 / (1 + discrete_discount)**years
+        self.simpson = np.array([simpsons_multiplier(year, end_index)
+                                 for year in years])
+
+        # Simpson weighted sums of the survival curves
+        self.life_years = self.simpson @ self.survival
+        self.annuity = (self.simpson * self.discount) @ self.survival
+
+
+def simpsons_multiplier(index, end_index):
+    '''
+    Weight of the value at the given year in the Simpson's 1/3rd correction
+    of a sum running from year 0 to end_index.
+    '''
+    if index == 0 or index == end_index:
+        return 1 / 3
+    elif index % 2 == 0:
+        return 2 / 3
+    else:
+        return 4 / 3
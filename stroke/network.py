@@ -0,0 +1,304 @@
+"""
+Immutable, array-backed description of a set of stroke centers. Scenario
+    state (travel times and sampled intra-hospital times) is kept in separate
+    arrays, so many scenarios can share one network.
+"""
+import numpy as np
+from . import stroke_center as sc, streams
+
+DISTRIBUTION_PARAMETERS = ('first_quartile', 'median', 'third_quartile',
+                           'real_fraction', 'generic_first_quartile',
+                           'generic_third_quartile')
+
+
+class HospitalNetwork:
+    """
+    IDs, center types, transfer destinations, transfer times and time
+        distribution parameters of a set of stroke centers, as read-only
+        arrays with one row per hospital
+    """
+
+    @property
+    def centers(self):
+        """StrokeCenters in row order"""
+        return self._centers
+
+    @property
+    def center_ids(self):
+        """Center IDs in row order"""
+        return self._center_ids
+
+    def __init__(self, hospitals):
+        """
+        Build the network from a list of StrokeCenters, keeping their order.
+            Transfer destinations not in the list are appended, so every
+            transfer destination has a row. Travel time distributions set
+            on the given centers are kept as default travel time bounds.
+        """
+        centers = list(hospitals)
+        seen = set(centers)
+        for hospital in hospitals:
+            td = hospital.transfer_destination
+            if td is not None and td not in seen:
+                centers.append(td)
+                seen.add(td)
+        self._centers = tuple(centers)
+        self._center_ids = tuple(center.center_id for center in centers)
+        self._rows = {center: i for i, center in enumerate(centers)}
+        self._id_rows = {str(center_id): i
+                         for i, center_id in enumerate(self._center_ids)}
+
+        self.center_types = _read_only(
+            [int(center.center_type) for center in centers])
+        self.transfer_index = _read_only([
+            -1 if center.transfer_destination is None else
+            self._rows[center.transfer_destination] for center in centers
+        ])
+        self.transfer_time = _read_only([
+            np.NaN if center.transfer_destination is None else
+            center.transfer_time for center in centers
+        ])
+        self.dtn_parameters = _distribution_parameters(
+            [center.dtn_dist for center in centers])
+        self.dtp_parameters = _distribution_parameters(
+            [center.dtp_dist for center in centers])
+
+        default_travel = np.full((len(centers), 2), np.NaN)
+        for i, center in enumerate(hospitals):
+            if center.time_dist is not None:
+                default_travel[i] = [center.time_dist.no_traffic,
+                                     center.time_dist.traffic]
+        self._default_travel = _read_only(default_travel)
+
+    def __len__(self):
+        return len(self._centers)
+
+    def row(self, hospital):
+        """Row of the given StrokeCenter"""
+        return self._rows[hospital]
+
+    def subnetwork(self, rows, transfers=None):
+        """
+        Network of the hospitals in the given rows, in that order, followed
+            by any of their transfer destinations not already included.
+            Arrays are sliced from this network, so the cost scales with
+            the number of rows rather than the size of this network.
+            transfers -- optional boolean mask aligned with rows, where
+                         False drops the transfer destination of that
+                         hospital, so it has no drip and ship route
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        destinations = self.transfer_index[rows]
+        if transfers is not None:
+            destinations = np.where(transfers, destinations, -1)
+        extra = np.setdiff1d(destinations[destinations >= 0], rows)
+        rows = np.concatenate([rows, extra])
+
+        sub = HospitalNetwork.__new__(HospitalNetwork)
+        sub._centers = tuple(self._centers[row] for row in rows)
+        sub._center_ids = tuple(self._center_ids[row] for row in rows)
+        sub._rows = {center: i for i, center in enumerate(sub._centers)}
+        sub._id_rows = {str(center_id): i
+                        for i, center_id in enumerate(sub._center_ids)}
+        position = np.full(len(self), -1)
+        position[rows] = np.arange(len(rows))
+        transfer_index = self.transfer_index[rows]
+        transfer_index[:len(destinations)] = destinations
+        sub.center_types = _read_only(self.center_types[rows])
+        sub.transfer_index = _read_only(
+            np.where(transfer_index >= 0, position[transfer_index], -1))
+        sub.transfer_time = _read_only(
+            np.where(transfer_index >= 0, self.transfer_time[rows], np.NaN))
+        sub.dtn_parameters = {name: _read_only(values[rows])
+                              for name, values in self.dtn_parameters.items()}
+        sub.dtp_parameters = {name: _read_only(values[rows])
+                              for name, values in self.dtp_parameters.items()}
+        sub._default_travel = _read_only(self._default_travel[rows])
+        return sub
+
+    def reachable_bounds(self, times):
+        """
+        Get the rows of hospitals with a travel time and their (no traffic,
+            traffic) bounds, shaped (reachable hospitals, 2), in row order.
+            Only the given times are visited, so it's cheap when they only
+            list the hospitals that can be reached.
+            times -- travel times by center id, each a list of
+                     [no_traffic_time, traffic_time]
+        """
+        rows = []
+        bounds = []
+        for center_id, center_times in times.items():
+            row = self._id_rows.get(str(center_id))
+            if row is not None and not np.isnan(center_times).any():
+                rows.append(row)
+                bounds.append(center_times)
+        rows = np.array(rows, dtype=np.intp)
+        bounds = np.array(bounds, dtype=float).reshape(-1, 2)
+        order = np.argsort(rows)
+        return rows[order], bounds[order]
+
+    def travel_bounds(self, times=None):
+        """
+        Get (no traffic, traffic) travel time bounds for every hospital as
+            an array shaped (hospitals, 2), NaN for hospitals without a
+            travel time.
+            times -- travel times by center id, each a list of
+                     [no_traffic_time, traffic_time]. Defaults to the travel
+                     time distributions set on the centers.
+        """
+        if times is None:
+            return self._default_travel.copy()
+        bounds = np.full((len(self), 2), np.NaN)
+        for center_id, center_times in times.items():
+            row = self._id_rows.get(str(center_id))
+            if row is not None:
+                bounds[row] = center_times
+        return bounds
+
+    @staticmethod
+    def sample_travel_times(bounds, n, rng=None):
+        """
+        Sample travel times uniformly between the bounds.
+            bounds -- array shaped (..., hospitals, 2), as from travel_bounds
+            rng -- numpy Generator or seed, see streams.generator
+        Returns an array shaped (..., n, hospitals), NaN for hospitals
+            without a travel time.
+        """
+        bounds = np.asarray(bounds, dtype=float)
+        no_traffic = bounds[..., np.newaxis, :, 0]
+        traffic = bounds[..., np.newaxis, :, 1]
+        shape = bounds.shape[:-2] + (n, bounds.shape[-2])
+        uniform = streams.generator(rng).random(shape)
+        return no_traffic + (traffic - no_traffic) * uniform
+
+    def door_to_needle_bounds(self):
+        """
+        Lowest and highest door to needle times that can be sampled for
+            every hospital, as an array shaped (hospitals, 2)
+        """
+        return _time_bounds(self.dtn_parameters)
+
+    def door_to_puncture_bounds(self):
+        """
+        Lowest and highest door to puncture times that can be sampled for
+            every hospital, as an array shaped (hospitals, 2), NaN for
+            primary centers
+        """
+        return _time_bounds(self.dtp_parameters)
+
+    def sample_door_to_needle(self, shape, with_uncertainty=True,
+                              perf_level=None, rng=None):
+        """
+        Sample door to needle times for every hospital, as an array shaped
+            (hospitals,) + shape. See _sample_times.
+        """
+        return _sample_times(self.dtn_parameters, shape, with_uncertainty,
+                             perf_level, rng)
+
+    def sample_door_to_puncture(self, shape, with_uncertainty=True,
+                                perf_level=None, rng=None):
+        """
+        Sample door to puncture times for every hospital, as an array shaped
+            (hospitals,) + shape, NaN for primary centers. See _sample_times.
+        """
+        return _sample_times(self.dtp_parameters, shape, with_uncertainty,
+                             perf_level, rng)
+
+
+def as_network(hospitals):
+    """Get a HospitalNetwork for a list of StrokeCenters or a network"""
+    if isinstance(hospitals, HospitalNetwork):
+        return hospitals
+    return HospitalNetwork(hospitals)
+
+
+def _read_only(values):
+    array = np.array(values)
+    array.flags.writeable = False
+    return array
+
+
+def _distribution_parameters(distributions):
+    """
+    Collect parameters of HospitalTimeDistributions into arrays. Hybrid
+        distributions draw a fraction of samples from the real
+        distribution and the rest from the generic one.
+    """
+    parameters = {name: np.full(len(distributions), np.NaN)
+                  for name in DISTRIBUTION_PARAMETERS}
+    for i, dist in enumerate(distributions):
+        if dist is None:
+            continue
+        parameters['first_quartile'][i] = dist.first_quartile
+        parameters['median'][i] = dist.median
+        parameters['third_quartile'][i] = dist.third_quartile
+        if isinstance(dist, sc.HospitalTimeDistributionHybrid):
+            generic = dist.generic_distribution
+            parameters['real_fraction'][i] = min(dist.sample_threshold, 1)
+            parameters['generic_first_quartile'][i] = generic.first_quartile
+            parameters['generic_third_quartile'][i] = generic.third_quartile
+        else:
+            parameters['real_fraction'][i] = 1
+            parameters['generic_first_quartile'][i] = dist.first_quartile
+            parameters['generic_third_quartile'][i] = dist.third_quartile
+    for array in parameters.values():
+        array.flags.writeable = False
+    return parameters
+
+
+def _time_bounds(parameters):
+    """
+    Range of the times _sample_times can draw, with or without uncertainty:
+        both the real and the generic quartiles, and the median
+    """
+    names = ('first_quartile', 'median', 'third_quartile',
+             'generic_first_quartile', 'generic_third_quartile')
+    values = np.stack([parameters[name] for name in names], axis=1)
+    return np.stack([values.min(axis=1), values.max(axis=1)], axis=1)
+
+
+def _sample_times(parameters, shape, with_uncertainty=True, perf_level=None,
+                  rng=None):
+    """
+    Sample times for every hospital at once, following
+        HospitalTimeDistribution.sample. With uncertainty times are uniform
+        between the quartiles, or at perf_level (uniform [0,1] draws shaped
+        like shape, shared by every hospital) of the way between them.
+        Hybrid distributions take exactly the same share of draws from the
+        real distribution as HospitalTimeDistributionHybrid. Without
+        uncertainty every draw is the median, shaped to broadcast.
+        rng -- numpy Generator or seed, see streams.generator
+    """
+    shape = tuple(np.atleast_1d(shape))
+    n_hospitals = len(parameters['median'])
+    if not with_uncertainty:
+        if perf_level is not None:
+            raise ValueError('preset level specified but with_uncertainty '
+                             'is turned off')
+        return parameters['median'].reshape((n_hospitals,) +
+                                            (1,) * len(shape))
+
+    n_draws = int(np.prod(shape))
+    rng = streams.generator(rng)
+    if perf_level is None:
+        level = rng.random((n_hospitals, n_draws))
+    else:
+        level = np.broadcast_to(np.reshape(perf_level, -1),
+                                (n_hospitals, n_draws))
+
+    real = np.ones((n_hospitals, n_draws), dtype=bool)
+    fraction = parameters['real_fraction']
+    hybrid = np.flatnonzero(fraction < 1)
+    if hybrid.size:
+        n_real = (n_draws * fraction[hybrid]).astype(int)
+        # a random position of each draw, shuffled independently by hospital
+        order = rng.permuted(
+            np.broadcast_to(np.arange(n_draws), (hybrid.size, n_draws)),
+            axis=1)
+        real[hybrid] = order < n_real[:, None]
+
+    low = np.where(real, parameters['first_quartile'][:, np.newaxis],
+                   parameters['generic_first_quartile'][:, np.newaxis])
+    high = np.where(real, parameters['third_quartile'][:, np.newaxis],
+                    parameters['generic_third_quartile'][:, np.newaxis])
+    return (low + level * (high - low)).reshape((n_hospitals,) + shape)
@@ -1,8 +1,8 @@
 """
 Patient information for a stroke triage decision
 """
-from . import severity as sev, constants
-import numpy.random as rng
+from . import severity as sev, constants, streams
+import numpy as np
 
 
 class Patient:
@@ -28,15 +28,17 @@ class Patient:
 
     @classmethod
     def random(cls, sex=None, age=None, race=None, nihss=None,
-               time_since_symptoms=None, pid=-1):
+               time_since_symptoms=None, pid=-1, rng=None):
         """
         Generate a random patient. Fix any input by passing it as an argument.
+            rng -- numpy Generator or seed, see streams.generator
         """
+        rng = streams.generator(rng)
         if sex is None:
-            sex = rng.choice(list(constants.Sex))
+            sex = list(constants.Sex)[rng.integers(len(constants.Sex))]
 
         if age is None:
-            age = rng.randint(30, 85)
+            age = rng.integers(30, 85)
 
         if race is not None:
             severity = sev.RACE(race)
@@ -44,9 +46,39 @@ class Patient:
             if race is None and nihss is not None:
                 severity = sev.NIHSS(nihss)
             else:
-                severity = sev.RACE(rng.randint(0, 9))
+                severity = sev.RACE(rng.integers(0, 9))
 
         if time_since_symptoms is None:
             time_since_symptoms = rng.uniform(10, 100)
 
         return cls(sex, age, time_since_symptoms, severity, pid)
+
+
+class PatientBatch:
+    """
+    A table of patients evaluated together at one location. Per-patient
+        inputs used by the vectorized model are arrays with a leading patient
+        axis that broadcast against (model runs, strategies) arrays.
+    """
+
+    def __init__(self, patients, rngs=None):
+        """
+        Initialize from a list of Patients
+            rngs -- optional seed or SeedSequence for each patient's own
+                    draws, see SeverityBatch
+        """
+        self.patients = list(patients)
+        self.pid = [patient.pid for patient in self.patients]
+        self.sex = [patient.sex for patient in self.patients]
+        self.age = [patient.age for patient in self.patients]
+        self.symptom_time = np.array([
+            patient.symptom_time for patient in self.patients
+        ]).reshape(-1, 1, 1)
+        self.severity = sev.SeverityBatch(
+            [patient.severity for patient in self.patients], rngs)
+
+    def __len__(self):
+        return len(self.patients)
+
+    def __getitem__(self, index):
+        return self.patients[index]
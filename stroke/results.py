@@ -2,10 +2,14 @@
 Aggregate model runs and determine optimal strategies
 """
 import functools
+import statistics
 import warnings
 from collections import Counter
 import numpy as np
 
+# Default willingness to pay per QALY
+THRESHOLD_ICER = 100000
+
 @functools.total_ordering
 class FormattedResult:
     """
@@ -53,9 +57,15 @@ class Results:
     def threshold(self):
         return self._threshold
 
-    def __init__(self, cohort, threshold_ICER=100000):
+    def __init__(self, cohort, threshold_ICER=THRESHOLD_ICER, ranks=None,
+                 pruned=()):
         """
         Generate results from analyzed markov cohort for all strategies
+            ranks -- optional preference order of the strategies for
+                     breaking ties, as from strategy_ranks. Defaults to the
+                     order defined on Strategy.
+            pruned -- strategies left out of the simulation because they
+                      can never be optimal, listed with zero counts
         """
         # Record counts of maximum QALY strategies
         max_qalys = Counter()
@@ -64,24 +74,77 @@ class Results:
         self._max_qaly_counts = max_qalys
 
         # Record counts of optimal strategies considering cost
+        if ranks is None:
+            ranks = strategy_ranks(cohort.strategies)
+        optimal = optimal_strategy_indices(cohort.qalys, cohort.costs, ranks,
+                                           threshold_ICER)
+        counts = np.bincount(optimal[optimal >= 0],
+                             minlength=len(cohort.strategies))
         optimal_counts = Counter()
-        for j, strategy in enumerate(cohort.strategies):
+        for strategy, count in zip(cohort.strategies, counts):
             # listed in all possible strategies as 0 first
             # to help differentiate from centers that are not
             # a feasible option (too far away to even consider) in final results
+            optimal_counts[strategy] = int(count)
+        for strategy in pruned:
             optimal_counts[strategy] = 0
-        for i in range(cohort.qalys.shape[0]):
-            data = []
-            for j, strategy in enumerate(cohort.strategies):
-                qaly = cohort.qalys[i, j]
-                cost = cohort.costs[i, j]
-                if np.isnan(qaly) or np.isnan(cost):
-                    continue
-                data.append(FormattedResult(strategy, qaly, cost, None))
-            optimal = get_optimal(data, threshold_ICER)
-            if optimal: optimal_counts[optimal] += 1
         self._optimal_counts = optimal_counts
         self._threshold = threshold_ICER
+        # set by StrokeModel.run_sequential
+        self.convergence = None
+
+    @classmethod
+    def certain(cls, strategy, n, strategies, threshold_ICER=THRESHOLD_ICER):
+        """
+        Results where the given strategy is optimal in all n model runs,
+            without a simulation, as when every other strategy is dominated
+            by it or never viable. It's also counted as the maximum QALY
+            strategy. The other strategies are listed with zero counts.
+        """
+        these_results = cls.__new__(cls)
+        optimal_counts = Counter({other: 0 for other in strategies})
+        optimal_counts[strategy] = n
+        these_results._max_qaly_counts = Counter({strategy: n})
+        these_results._optimal_counts = optimal_counts
+        these_results._threshold = threshold_ICER
+        these_results.convergence = None
+        return these_results
+
+    @classmethod
+    def combine(cls, results_list):
+        """
+        Add up the counts of results for the same scenario from several
+            sets of model runs
+        """
+        combined = cls.__new__(cls)
+        combined._max_qaly_counts = Counter()
+        combined._optimal_counts = Counter()
+        for these_results in results_list:
+            # update adds counts, keeping strategies listed with zero counts
+            combined._max_qaly_counts.update(these_results.max_qaly_counts)
+            combined._optimal_counts.update(these_results.optimal_counts)
+        combined._threshold = results_list[0].threshold
+        combined.convergence = None
+        return combined
+
+    def leading_share(self, confidence=0.95):
+        """
+        Get the share of model runs where the most often optimal destination
+            is optimal, with a Wilson score confidence interval. Returns a
+            Convergence.
+        """
+        cbc = self.counts_by_center
+        n = sum(cbc.values())
+        if n == 0:
+            return Convergence(None, 0, np.NaN, 0, 1, confidence)
+        center = max(cbc, key=lambda center: cbc[center])
+        share = cbc[center] / n
+        z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        middle = (share + z**2 / (2 * n)) / (1 + z**2 / n)
+        spread = (z / (1 + z**2 / n) *
+                  np.sqrt(share * (1 - share) / n + z**2 / (4 * n**2)))
+        return Convergence(center, n, share, middle - spread, middle + spread,
+                           confidence)
 
     @property
     def counts_by_center(self):
@@ -116,6 +179,80 @@ class Results:
             return max(cbs, key=lambda center: cbs[center])
 
 
+class Convergence:
+    """
+    Share of model runs where a destination is optimal, with a confidence
+        interval, as found by Results.leading_share
+    """
+
+    @property
+    def half_width(self):
+        return (self.high - self.low) / 2
+
+    def __init__(self, center, n, share, low, high, confidence):
+        self.center = center
+        self.n = n
+        self.share = share
+        self.low = low
+        self.high = high
+        self.confidence = confidence
+
+
+def strategy_ranks(strategies, mean_times=None):
+    """
+    Get the position of each strategy in the preference order defined on
+        Strategy (travel time, then strategy kind, then center name), as an
+        integer array aligned with the given list.
+        mean_times -- optional mean travel time for each strategy, used in
+                      place of the travel times set on the centers
+    """
+    if mean_times is None:
+        key = lambda j: strategies[j]
+    else:
+        key = lambda j: (mean_times[j], strategies[j].kind,
+                         strategies[j].center.full_name)
+    order = sorted(range(len(strategies)), key=key)
+    ranks = np.empty(len(strategies), dtype=int)
+    ranks[order] = np.arange(len(strategies))
+    return ranks
+
+
+def optimal_strategy_indices(qalys, costs, ranks, threshold):
+    """
+    Select the optimal strategy for every model run at once. Equivalent to
+        calling get_optimal on each row, without building FormattedResults.
+        qalys, costs -- arrays with strategies along the last axis. Entries
+                        where either value is NaN are not considered.
+        ranks -- preference order of strategies for breaking ties, as from
+                 strategy_ranks, broadcastable against qalys
+        threshold -- willingness to pay per QALY
+    Returns an integer array of strategy indices with the last axis removed,
+        -1 where no strategy is available.
+    """
+    qalys = np.asarray(qalys)
+    costs = np.asarray(costs)
+    valid = ~(np.isnan(qalys) | np.isnan(costs))
+
+    # The strategies left after the dominance and extended dominance passes
+    #   of get_optimal are the lower convex hull of the (qaly, cost) points,
+    #   and the one selected from them is the strategy with the greatest net
+    #   monetary benefit at the threshold. Equal benefit only happens along
+    #   a hull edge with ICER exactly at the threshold, where get_optimal
+    #   keeps the lower QALY end, or for duplicates, where it keeps the
+    #   first strategy in sort order.
+    with np.errstate(invalid='ignore'):
+        benefit = np.where(valid, threshold * qalys - costs, -np.inf)
+    best = benefit.max(axis=-1, keepdims=True)
+    candidates = valid & (benefit == best)
+    for values in (qalys, costs):
+        masked = np.where(candidates, values, np.inf)
+        candidates &= masked == masked.min(axis=-1, keepdims=True)
+    ranks = np.broadcast_to(ranks, candidates.shape)
+    masked_ranks = np.where(candidates, ranks, np.iinfo(int).max)
+    optimal = masked_ranks.argmin(axis=-1)
+    return np.where(valid.any(axis=-1), optimal, -1)
+
+
 def get_optimal(data, threshold):
     """
     Given a list of FormattedResults representing strategies for a single
@@ -1,7 +1,7 @@
 """Flexible characterization of stroke severity."""
 import abc
 import numpy as np
-from . import constants
+from . import constants, streams
 
 
 class Severity(abc.ABC):
@@ -11,10 +11,12 @@ class Severity(abc.ABC):
     """
 
     @abc.abstractmethod
-    def prob_LVO_given_AIS(self, n=1, add_uncertainty=False):
+    def prob_LVO_given_AIS(self, n=1, add_uncertainty=False, rng=None):
         """
         Get the probability of an LVO under the assumption that the severity
             describes an acute ischemic stroke.
+            rng -- numpy Generator or seed for the uncertainty draws, see
+                   streams.generator
         Returns a numpy array with shape (n,1)
         """
         pass
@@ -33,7 +35,7 @@ class Severity(abc.ABC):
         Note: had to redo the regression
         '''
         beta = (-0.00879544 - 9.01419716e-05 * time_onset_reperfusion)
-        return np.exp(beta * self.NIHSS)
+        return np.exp(beta * _as_type_of(self.NIHSS, beta))
 
     def p_good_outcome_no_reperfusion(self):
         '''
@@ -57,7 +59,8 @@ class Severity(abc.ABC):
         but there is no consistent evidence that it differs for patients
         with and without LVO
         '''
-        baseline_prob = 0.001 * self.NIHSS**2 - 0.0615 * self.NIHSS + 1
+        nihss = _as_type_of(self.NIHSS, time_onset_tpa)
+        baseline_prob = 0.001 * nihss**2 - 0.0615 * nihss + 1
 
         odds_ratio = -0.0031 * time_onset_tpa + 2.068
         # if baseline_prob == 1.0:
@@ -91,28 +94,31 @@ class Severity(abc.ABC):
         Probabilities of mRS 0 - 2: 0.205627706, 0.341991342, 0.452380952
         Probabilities of mRS 3 - 5: 0.35678392, 0.432160804, 0.211055276
         """
-        (n_samples, n_hospitals) = p_good_outcome.shape
         n_states = constants.States.NUMBER_OF_STATES
-        states = np.zeros((n_samples, n_hospitals, n_states))
+        # Shape: p_good_outcome.shape x number of states, so any leading
+        #   (e.g. patient) axes carry through
+        dtype = p_good_outcome.dtype if p_good_outcome.dtype.kind == 'f' \
+            else np.float64
+        states = np.zeros(p_good_outcome.shape + (n_states,), dtype=dtype)
 
         # Assume that probability of death is always constant
         # Stratified by NIHSS, ask Dr. Schwamm to get raw data for a continuous
         # approach
-        states[:, :, constants.States.MRS_6] = np.where(
+        states[..., constants.States.MRS_6] = np.where(
             self.NIHSS < 7, 0.042,
             np.where(self.NIHSS < 13, 0.139,
                      np.where(self.NIHSS < 21, 0.316, 0.535)))
 
         # Good outcomes
-        states[:, :, constants.States.MRS_0] = 0.205627706 * p_good_outcome
-        states[:, :, constants.States.MRS_1] = 0.341991342 * p_good_outcome
-        states[:, :, constants.States.MRS_2] = 0.452380952 * p_good_outcome
+        states[..., constants.States.MRS_0] = 0.205627706 * p_good_outcome
+        states[..., constants.States.MRS_1] = 0.341991342 * p_good_outcome
+        states[..., constants.States.MRS_2] = 0.452380952 * p_good_outcome
 
         # Bad outcomes
-        p_bad = 1 - p_good_outcome - states[:, :, constants.States.MRS_6]
-        states[:, :, constants.States.MRS_3] = 0.35678392 * p_bad
-        states[:, :, constants.States.MRS_4] = 0.432160804 * p_bad
-        states[:, :, constants.States.MRS_5] = 0.211055276 * p_bad
+        p_bad = 1 - p_good_outcome - states[..., constants.States.MRS_6]
+        states[..., constants.States.MRS_3] = 0.35678392 * p_bad
+        states[..., constants.States.MRS_4] = 0.432160804 * p_bad
+        states[..., constants.States.MRS_5] = 0.211055276 * p_bad
 
         return states
 
@@ -138,7 +144,7 @@ class RACE(Severity):
     def __init__(self, score):
         self.score = score
 
-    def prob_LVO_given_AIS(self, n=1, add_uncertainty=False):
+    def prob_LVO_given_AIS(self, n=1, add_uncertainty=False, rng=None):
         """
         Get the probability of an LVO under the assumption that the severity
             describes an acute ischemic stroke.
@@ -153,7 +159,7 @@ class RACE(Severity):
         else:
             lower = p_lvo_logistic_helper(-3.6526, 0.4141)
             upper = p_lvo_logistic_helper(-2.2067, 0.6925)
-            p_lvo = np.random.uniform(lower, upper, n)
+            p_lvo = streams.generator(rng).uniform(lower, upper, n)
 
         return p_lvo.reshape(-1, 1)
 
@@ -182,3 +188,53 @@ class NIHSS(RACE):
             race = (score + 0.39) / 2.39
         if race > 9: race = 9
         return race
+
+
+class SeverityBatch(Severity):
+    """
+    Severities for a table of patients evaluated together. NIHSS is an array
+        of shape (number of patients, 1, 1) so that it broadcasts against
+        arrays of model runs by strategies.
+    """
+
+    @property
+    def NIHSS(self):
+        return self._NIHSS
+
+    def __init__(self, severities, rngs=None):
+        """
+        rngs -- optional seed or SeedSequence for each patient's uncertainty
+                draws, so a patient's draws don't depend on the others in
+                the batch
+        """
+        self.severities = list(severities)
+        self.rngs = rngs
+        self._NIHSS = np.array([severity.NIHSS for severity in
+                                self.severities]).reshape(-1, 1, 1)
+
+    def prob_LVO_given_AIS(self, n=1, add_uncertainty=False, rng=None):
+        """
+        Get the probability of an LVO for each patient, drawn from each
+            patient's own stream if the batch has them, otherwise in turn
+            from one Generator.
+        Returns a numpy array with shape (number of patients, n, 1)
+        """
+        if self.rngs is not None:
+            rngs = self.rngs
+        else:
+            rngs = [streams.generator(rng) if add_uncertainty else None] * \
+                len(self.severities)
+        return np.stack([severity.prob_LVO_given_AIS(n, add_uncertainty,
+                                                     this_rng)
+                         for severity, this_rng in zip(self.severities, rngs)])
+
+
+def _as_type_of(values, times):
+    """
+    Patient values as the floating point type of an array of times, so the
+        float64 arrays of a SeverityBatch don't promote float32 times.
+        Scalars are left as they are, since they never promote arrays.
+    """
+    if isinstance(values, np.ndarray) and isinstance(times, np.ndarray):
+        return values.astype(times.dtype, copy=False)
+    return values
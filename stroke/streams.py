@@ -0,0 +1,50 @@
+"""
+Random number streams for model runs, so a run can be repeated exactly
+    whatever the number of processes or the way work is split among them
+"""
+import hashlib
+import numpy as np
+
+
+def generator(rng=None):
+    """
+    Get a numpy Generator to sample from.
+        rng -- a Generator, returned as is, or a seed or SeedSequence to
+               start a new one. By default the new Generator is seeded from
+               the global numpy random state, so np.random.seed still makes
+               a run repeatable.
+    """
+    if isinstance(rng, np.random.Generator):
+        return rng
+    if rng is None:
+        rng = np.random.randint(2**32, size=4, dtype=np.uint64)
+    return np.random.default_rng(rng)
+
+
+def seed_sequence(seed=None, *keys):
+    """
+    Get the SeedSequence of the stream named by keys, such as a patient
+        number, location ID and chunk number, derived from a run seed. A
+        stream only depends on the seed and its keys, so a scenario gets the
+        same draws wherever and in whatever order it's run.
+        seed -- an int, or a SeedSequence to derive a child stream of. None
+                starts from fresh entropy.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    if not keys:
+        return seed
+    return np.random.SeedSequence(
+        seed.entropy, spawn_key=seed.spawn_key + tuple(map(_key, keys)),
+        pool_size=seed.pool_size)
+
+
+def _key(key):
+    """
+    Integer for a stream key. Strings are hashed with SHA-1, since the
+        built in hash differs between processes.
+    """
+    if isinstance(key, (int, np.integer)) and key >= 0:
+        return int(key)
+    digest = hashlib.sha1(str(key).encode()).digest()
+    return int.from_bytes(digest[:8], 'little')
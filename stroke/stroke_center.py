@@ -4,6 +4,7 @@ Defines distributions for each stroke center type
 """
 import enum
 import numpy as np
+from . import streams
 
 
 class CenterType(enum.IntEnum):
@@ -18,11 +19,12 @@ class HospitalTimeDistribution:
         self.median = median
         self.third_quartile = third_quartile
 
-    def sample(self, n=1, with_uncertainty=True, perf_level=None):
+    def sample(self, n=1, with_uncertainty=True, perf_level=None, rng=None):
         """ Sample time from a uniform distribution with quartile times saved
          If with_uncertainty, then will sample completely randomly
             If given perf_level, will be calculated based on uniform distribution
-         else return median time """
+         else return median time
+         rng: numpy Generator or seed, see streams.generator """
         if not with_uncertainty and (perf_level is not None):
             raise ValueError('preset level specified but with_uncertainty is turned off')
         if with_uncertainty:
@@ -31,30 +33,33 @@ class HospitalTimeDistribution:
             if perf_level:
                 val = low + perf_level * (high - low)
             else:
-                val = np.random.uniform(low, high, n)
+                val = streams.generator(rng).uniform(low, high, n)
         else:
             val = self.median
         return val
 
     @classmethod
-    def random_primary(cls):
-        med = np.random.uniform(47, 83)
-        first = np.random.uniform(37, med)
-        third = np.random.uniform(med, 93)
+    def random_primary(cls, rng=None):
+        rng = streams.generator(rng)
+        med = rng.uniform(47, 83)
+        first = rng.uniform(37, med)
+        third = rng.uniform(med, 93)
         return cls(first, med, third)
 
     @classmethod
-    def random_comprehensive(cls):
-        med = np.random.uniform(39, 70)
-        first = np.random.uniform(29, med)
-        third = np.random.uniform(med, 80)
+    def random_comprehensive(cls, rng=None):
+        rng = streams.generator(rng)
+        med = rng.uniform(39, 70)
+        first = rng.uniform(29, med)
+        third = rng.uniform(med, 80)
         return cls(first, med, third)
 
     @classmethod
-    def random_door_to_puncture(cls):
-        med = np.random.uniform(83, 192)
-        first = np.random.uniform(63, med)
-        third = np.random.uniform(med, 212)
+    def random_door_to_puncture(cls, rng=None):
+        rng = streams.generator(rng)
+        med = rng.uniform(83, 192)
+        first = rng.uniform(63, med)
+        third = rng.uniform(med, 212)
         return cls(first, med, third)
 
 PURELY_REAL_THRESH = 100
@@ -70,18 +75,19 @@ class HospitalTimeDistributionHybrid(HospitalTimeDistribution):
         self.sample_threshold = self.sample_size/PURELY_REAL_THRESH
         self.generic_distribution = generic_distribution
 
-    def sample(self, n=1, with_uncertainty=True, perf_level=None):
+    def sample(self, n=1, with_uncertainty=True, perf_level=None, rng=None):
+        rng = streams.generator(rng)
         if self.sample_size >= PURELY_REAL_THRESH:
             # sample solely from real distribution
-            val = super().sample(n,with_uncertainty,perf_level)
+            val = super().sample(n,with_uncertainty,perf_level,rng)
         else:
             n_real = int(n*self.sample_threshold)
             n_generic = n-n_real
-            val_real = super().sample(n_real,with_uncertainty,perf_level)
+            val_real = super().sample(n_real,with_uncertainty,perf_level,rng)
             val_generic = self.generic_distribution.sample(
-                        n_generic,with_uncertainty,perf_level)
+                        n_generic,with_uncertainty,perf_level,rng)
             val = np.concatenate((val_real,val_generic))
-            np.random.shuffle(val)# shuffle elements inside
+            rng.shuffle(val)# shuffle elements inside
         return val
 
 class TravelTimeDistribution:
@@ -89,9 +95,9 @@ class TravelTimeDistribution:
         self.no_traffic = no_traffic
         self.traffic = traffic
 
-    def sample(self, n=1):
+    def sample(self, n=1, rng=None):
         if self.no_traffic != self.traffic:
-            val = np.random.uniform(self.no_traffic,self.traffic,n)
+            val = streams.generator(rng).uniform(self.no_traffic,self.traffic,n)
         else:
             val = np.ones((n,))*self.no_traffic
         return val
@@ -148,6 +154,14 @@ class StrokeCenter:
     def transfer_time(self):
         return self._transfer_time
 
+    @property
+    def dtn_dist(self):
+        return self._dtn_dist
+
+    @property
+    def dtp_dist(self):
+        return self._dtp_dist
+
     @property
     def door_to_needle(self):
         return self._door_to_needle
@@ -232,22 +246,23 @@ class StrokeCenter:
         self._transfer_destination = comprehensive
         self._transfer_time = transfer_time
 
-    def set_door_to_needle(self, n=1, with_uncertainty=True, perf_level=None):
+    def set_door_to_needle(self, n=1, with_uncertainty=True, perf_level=None,
+                           rng=None):
         '''Set the door to needle time for this stroke center by sampling from
             the stored distribution or selecting the median. If perf_level is
             not None, it will be treated as the n draws from a uniform [0,1] RV
             to set the door to needle time without a new draw.
         '''
         self._door_to_needle = self._dtn_dist.sample(n, with_uncertainty,
-                                                     perf_level)
+                                                     perf_level, rng)
 
-    def set_travel_time(self, n=1):
+    def set_travel_time(self, n=1, rng=None):
         '''Set the travel time for this stroke center by sampling from
             the stored distribution.'''
-        self._time = self.time_dist.sample(n)
+        self._time = self.time_dist.sample(n, rng)
 
     def set_door_to_puncture(self, n=1, with_uncertainty=True,
-                             perf_level=None):
+                             perf_level=None, rng=None):
         '''Set the door to puncture time for this stroke center by sampling
             from the stored distribution or selecting the median. If perf_level
             is not None, it will be treated as the n draws from a uniform [0,1]
@@ -256,4 +271,4 @@ class StrokeCenter:
         if self.center_type is CenterType.PRIMARY:
             raise ValueError("Can't set door to puncture on primary center.")
         self._door_to_puncture = self._dtp_dist.sample(n, with_uncertainty,
-                                                       perf_level)
+                                                       perf_level, rng)
@@ -1,10 +1,18 @@
 """
 Umbrella class to hold and run stroke triage problems
 """
+import copy
 import numpy as np
-from . import costs, times, ais_outcomes, cohort, results, stroke_center as sc
-import pandas as pd
-import os
+from . import (costs, times, ais_outcomes, cohort, results, constants,
+               dominance, network, streams, timing, stroke_center as sc)
+from .patient import PatientBatch
+
+# Default memory budget in bytes for a chunked run, see run_chunked
+MEMORY_BUDGET = 2**28
+# Peak values held per model run and strategy while a run is simulated,
+#   measured in the model's floating point type and rounded up
+RUN_FOOTPRINT = 16
+
 
 class StrokeModel:
     """Store patient and hospital information and run the model"""
@@ -12,7 +20,8 @@ class StrokeModel:
     @property
     def hospitals(self):
         """A list of all hospitals with valid associated travel times."""
-        return [x for x in self._hospitals if not x.time_dist.isnan()]
+        centers = self._network.centers
+        return [centers[row] for row in self._rows]
 
     @property
     def primaries(self):
@@ -26,91 +35,478 @@ class StrokeModel:
         return [x for x in self.hospitals if
                 x.center_type is sc.CenterType.COMPREHENSIVE]
 
-    def __init__(self, patient, hospitals, threshold_ICER=1000000):
+    def __init__(self, patient, hospitals, threshold_ICER=1000000,
+                 dtype=np.float64):
         """
-        Generate model for given patient and hospitals. Hospitals may not
-            have correct travel times set yet.
+        Generate model for given patient and hospitals, as a list of
+            StrokeCenters or a HospitalNetwork. Hospitals may not have
+            correct travel times set yet. The hospitals are never modified,
+            so one network can be shared by many models.
+            dtype -- floating point type of the simulated times, outcomes
+                     and costs. np.float32 halves their memory; see
+                     compare_precision for how far its counts can differ.
         """
         self._patient = patient
-        self._hospitals = hospitals
+        self._network = network.as_network(hospitals)
+        self.set_travel_bounds(self._network.travel_bounds())
         self._threshold_ICER = threshold_ICER
+        self._dtype = np.dtype(dtype)
 
     def set_times(self, times):
         '''
         Given a series with center_id indices and travel time values, update
             primaries and comprehensives to use these times.
         Each time value must be a list of [no_traffic_time,traffic_time]
+        Hospitals without a time can't be reached, so times only need to
+            list the hospitals that can be.
+        '''
+        self.set_reachable_times(*self._network.reachable_bounds(times))
+
+    def set_travel_bounds(self, bounds):
+        '''
+        Set travel times from an array of (no traffic, traffic) bounds shaped
+            (hospitals, 2) in network order, as from
+            HospitalNetwork.travel_bounds. NaN marks hospitals that can't be
+            reached.
+        '''
+        bounds = np.asarray(bounds, dtype=float)
+        rows = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+        self.set_reachable_times(rows, bounds[rows])
+
+    def set_reachable_times(self, rows, bounds):
         '''
-        for center in self._hospitals: # iterate through each hospital class instance
-            center_id = str(center.center_id)
-            if center_id in times:
-                center.time_dist = sc.TravelTimeDistribution(*times[center_id]) # input: [min_time, max_time]
-            else:
-                center.time_dist = None
+        Set travel times for only the hospitals that can be reached.
+            rows -- network rows of the reachable hospitals, in row order
+            bounds -- (no traffic, traffic) bounds shaped (rows, 2)
+        Models only include these hospitals and their transfer
+            destinations, so the cost of a run scales with the number of
+            reachable hospitals rather than the size of the network.
+        '''
+        self._rows = np.asarray(rows, dtype=np.intp)
+        self._bounds = np.asarray(bounds, dtype=float)
 
     def run(self, n=1000, add_time_uncertainty=True, add_lvo_uncertainty=True,
-            fix_performance=False):
-        """Run the model"""
+            fix_performance=False, hospital_draws=None, prune=False,
+            rng=None):
+        """
+        Run the model
+            hospital_draws -- optional times.HospitalDraws shared with other
+                              runs, in place of new intra-hospital draws
+            prune -- leave out strategies that can never be optimal, see
+                     dominance.prune. They are listed in the results with
+                     zero counts but have no outcomes. If only one strategy
+                     can be optimal nothing is simulated, and the Population
+                     and IschemicTimes returned are None.
+            rng -- numpy Generator, seed or SeedSequence for every draw, see
+                   streams.generator. Runs with the same seed and inputs
+                   give identical results.
+        """
         costs.Costs.inflate(2016) # what year to inflate costs
+        pruning = self._prune(self._patient) if prune else None
+        if pruning is not None and pruning.certain is not None:
+            timing.count('certain scenarios')
+            return results.Results.certain(pruning.certain, n,
+                                           pruning.strategies), None, None
 
         # Acute ischemic stroke, model times
         # Give patient profile and list of potential hospital destinations
         # n = number of randomized simulations
         # Generates intra-hospital times, onset to treatment times, probability of LVO
-        ais_times = times.IschemicTimes(self._patient, self.hospitals, n,
-                                        add_time_uncertainty,
-                                        add_lvo_uncertainty,
-                                        fix_performance)
+        with timing.stage('sample times'):
+            ais_times = self._sample_times(self._patient,
+                                           self._reachable(pruning), n,
+                                           add_time_uncertainty,
+                                           add_lvo_uncertainty,
+                                           fix_performance, hospital_draws,
+                                           rng)
         
         # Stores times to generate outcome distributions
         ais_model = ais_outcomes.IschemicModel(ais_times)
         
         # Get all possible strategies and their outcomes: primary, drip and ship, comprehensive
         # Runs functions from IschemicModel class
-        outcomes = ais_model.run_all_strategies() # output Outcome object of all strategies
+        with timing.stage('run all strategies'):
+            outcomes = ais_model.run_all_strategies() # output Outcome object of all strategies
         
         # Stores patient information, can be run as markov to get LY, QALYs, costs, etc.
         markov = cohort.Population(self._patient, outcomes)
         # Analyze runs markov on patient, generating costs and qalys for each run/hospital
-        markov.analyze()
+        with timing.stage('analyze'):
+            markov.analyze()
 
         # results.Results tabulates output of markov.analyze()
-        return results.Results(markov),markov,ais_times
-
-    def _check_convergence(self,markov_results,n_sim,old_df_cbc=None):
-        CONVERGENCE_THRESH = .01 # out of 1 (1%)
-        cbc = {str(center): count for center, count in markov_results.counts_by_center.items()}
-        df_cbc = pd.DataFrame.from_dict(cbc,orient='index',columns=['count'])/n_sim
-        if old_df_cbc is None:
-            convergence = False # first iteration, convergence is False to repeat
-        else:
-            convergence = ((df_cbc-old_df_cbc).abs().max() <= CONVERGENCE_THRESH).any()
-        return convergence,df_cbc
+        pruned = pruning.pruned if pruning is not None else ()
+        return self._results(markov, ais_times, pruned),markov,ais_times
+
+    def run_patients(self, patients, n=1000, add_time_uncertainty=True,
+                     add_lvo_uncertainty=True, fix_performance=False,
+                     hospital_draws=None, prune=False, rng=None,
+                     patient_rngs=None):
+        """
+        Run the model for a table of patients at once. Travel and
+            intra-hospital times are drawn once and shared by all patients,
+            with each patient's symptom time and severity applied by
+            broadcasting along a leading patient axis.
+            prune -- leave out hospitals where every strategy can never be
+                     optimal for any of the patients, as in run. Nothing is
+                     simulated if only one strategy can be optimal for each
+                     patient.
+            rng -- numpy Generator, seed or SeedSequence for every draw, as
+                   in run. Patients take their probabilities of an LVO from
+                   it in turn, unless given patient_rngs.
+            patient_rngs -- optional seed or SeedSequence for each patient,
+                            for its probability of an LVO. A patient's
+                            results then don't depend on the other patients
+                            in the table.
+        Returns lists of Results, Population and IschemicTimes, one entry
+            per patient in the order given.
+        """
+        costs.Costs.inflate(2016)
+        batch = PatientBatch(patients, patient_rngs)
+        pruning = None
+        pruned = [()] * len(batch)
+        if prune:
+            prunings = [self._prune(this_patient)
+                        for this_patient in batch.patients]
+            if all(p.certain is not None for p in prunings):
+                timing.count('certain scenarios', len(prunings))
+                return ([results.Results.certain(p.certain, n, p.strategies)
+                         for p in prunings],
+                        [None] * len(batch), [None] * len(batch))
+            pruning = _combine(prunings, self._bounds, self._rows)
+            pruned = [_unsimulated(p.pruned, pruning.rows, self._network)
+                      for p in prunings]
+        with timing.stage('sample times'):
+            ais_times = self._sample_times(batch, self._reachable(pruning), n,
+                                           add_time_uncertainty,
+                                           add_lvo_uncertainty,
+                                           fix_performance, hospital_draws,
+                                           rng)
+        with timing.stage('run all strategies'):
+            outcomes = ais_outcomes.IschemicModel(
+                ais_times).run_all_strategies()
+        markov = cohort.Population(batch, outcomes)
+        with timing.stage('analyze'):
+            markov.analyze()
+
+        patient_markov = [markov.select(i) for i in range(len(batch))]
+        patient_times = [ais_times.select(i) for i in range(len(batch))]
+        patient_results = [self._results(m, t, p) for m, t, p in
+                           zip(patient_markov, patient_times, pruned)]
+        return patient_results, patient_markov, patient_times
 
-    def run_new(self, n=1000, add_time_uncertainty=True, add_lvo_uncertainty=True,
-            fix_performance=False):
-        """Run the model, determine num of simulation by convergence"""
+    def run_locations(self, times_list, n=1000, add_time_uncertainty=True,
+                      add_lvo_uncertainty=True, fix_performance=False,
+                      hospital_draws=None, prune=False, rngs=None):
+        """
+        Run the model for a block of map points at once. Every location
+            gets independent draws, sampled just as run would sample them,
+            but outcomes and the Markov model are evaluated as single arrays
+            shaped (locations, n, strategies) with hospitals that can't be
+            reached from a location masked out by NaN travel times.
+            times_list -- list of travel times by center id, one per location,
+                          in the format given to set_times
+            hospital_draws -- optional times.HospitalDraws, so every location
+                              shares intra-hospital times instead of having
+                              independent draws
+            prune -- leave out strategies that can never be optimal at each
+                     location, as in run. Locations where only one strategy
+                     can be optimal are left out of the block, with None in
+                     place of their Population and IschemicTimes.
+            rngs -- numpy Generator, seed or SeedSequence for each location,
+                    in order. A location run with the same seed as a single
+                    run gets identical results.
+        Returns lists of Results, Population and IschemicTimes, one entry
+            per location in the order given, each restricted to the
+            hospitals that can be reached from that location.
+        """
         costs.Costs.inflate(2016)
-        convergence = False
-
-        n_sim = 5000
-        NRUN_MAX=20
-        old_df_cbc = None
-        for c in range(NRUN_MAX):
-            ais_times = times.IschemicTimes(self._patient, self.hospitals, n_sim,
-                                            add_time_uncertainty,
-                                            add_lvo_uncertainty,
-                                            fix_performance)
-            ais_model = ais_outcomes.IschemicModel(ais_times)
-            outcomes = ais_model.run_all_strategies()
-            markov = cohort.Population(self._patient, outcomes)
+        reachable = [self._network.reachable_bounds(these_times)
+                     for these_times in times_list]
+        location_results = [None] * len(times_list)
+        location_markov = [None] * len(times_list)
+        location_times = [None] * len(times_list)
+        block = list(range(len(times_list)))
+        pruned = [()] * len(times_list)
+        if rngs is None:
+            rngs = [None] * len(times_list)
+        transfers = None
+        if prune:
+            prunings = [dominance.prune(self._patient, self._network, *these)
+                        for these in reachable]
+            for i, pruning in enumerate(prunings):
+                if pruning.certain is not None:
+                    location_results[i] = results.Results.certain(
+                        pruning.certain, n, pruning.strategies)
+            block = [i for i in block if location_results[i] is None]
+            timing.count('certain scenarios', len(times_list) - len(block))
+            if not block:
+                return location_results, location_markov, location_times
+            reachable = [(prunings[i].rows, prunings[i].bounds,
+                          prunings[i].transfers) for i in block]
+            pruned = [prunings[i].pruned for i in block]
+            transfers = _combine([prunings[i] for i in block]).transfers
+        else:
+            reachable = [these + (None,) for these in reachable]
+
+        # The block uses a network of hospitals reachable from any location
+        rows = np.unique(np.concatenate(
+            [these_rows for these_rows, _, _ in reachable]))
+        local_network = self._network.subnetwork(rows, transfers)
+        with timing.stage('sample times'):
+            ais_times = times.IschemicTimes.stack([
+                self._sample_times(self._patient, these, n,
+                                   add_time_uncertainty, add_lvo_uncertainty,
+                                   fix_performance, hospital_draws, rngs[i])
+                for i, these in zip(block, reachable)
+            ], local_network)
+        with timing.stage('run all strategies'):
+            outcomes = ais_outcomes.IschemicModel(
+                ais_times).run_all_strategies()
+        markov = cohort.Population(self._patient, outcomes)
+        with timing.stage('analyze'):
             markov.analyze()
-            markov_results = results.Results(markov)
-            convergence,df_cbc = self._check_convergence(markov_results,n_sim,old_df_cbc)
-            n_sim += 1000*(c+1)
-            old_df_cbc = df_cbc
-            if convergence:
+
+        for i, location in enumerate(block):
+            these_times = ais_times.select(i)
+            reachable = {strategy for kind in constants.StrategyKind
+                         for strategy in these_times.get_strategies(kind)}
+            mask = np.array([strategy in reachable
+                             for strategy in markov.strategies], dtype=bool)
+            this_markov = markov.select(i, mask)
+            location_results[location] = self._results(this_markov,
+                                                        these_times,
+                                                        pruned[i])
+            location_markov[location] = this_markov
+            location_times[location] = these_times
+        return location_results, location_markov, location_times
+
+    def run_sequential(self, batch_size=1000, max_n=100000, tolerance=0.01,
+                       confidence=0.95, add_time_uncertainty=True,
+                       add_lvo_uncertainty=True, fix_performance=False,
+                       prune=False, pilot=None, rng=None):
+        """
+        Run the model in batches of batch_size model runs until the share of
+            runs where the leading destination is optimal is known to within
+            tolerance, or max_n runs are done. Every batch is kept: counts
+            are added up and the Population and IschemicTimes returned cover
+            all of the model runs (None if nothing was simulated, see run).
+            tolerance -- half width of the confidence interval for the
+                         leading destination's share to stop at
+            confidence -- confidence level of the interval
+            pilot -- size of the first batch, if different from batch_size
+            rng -- seed or SeedSequence, each batch drawing from the child
+                   stream numbered by its position (see
+                   streams.seed_sequence), or a numpy Generator shared by
+                   every batch
+        The final number of model runs and interval are in the convergence
+            attribute of the Results returned, a results.Convergence.
+        """
+        batch_results = []
+        batch_markov = []
+        batch_times = []
+        n = 0
+        while True:
+            this_batch = min(pilot if pilot and n == 0 else batch_size,
+                             max_n - n)
+            batch_rng = rng
+            if rng is not None and not isinstance(rng, np.random.Generator):
+                batch_rng = streams.seed_sequence(rng, len(batch_results))
+            these_results, markov, ais_times = self.run(
+                this_batch, add_time_uncertainty, add_lvo_uncertainty,
+                fix_performance, prune=prune, rng=batch_rng)
+            n += this_batch
+            batch_results.append(these_results)
+            batch_markov.append(markov)
+            batch_times.append(ais_times)
+            combined = results.Results.combine(batch_results)
+            convergence = combined.leading_share(confidence)
+            if convergence.half_width <= tolerance or n >= max_n:
                 break
-            else:
-                print(f'repeating for nsim of {n_sim}')
-        return markov_results,markov,ais_times
+
+        combined.convergence = convergence
+        if markov is None:
+            return combined, None, None
+        return (combined, cohort.Population.concatenate(batch_markov),
+                times.IschemicTimes.concatenate(batch_times))
+
+    def run_chunked(self, n=1000, memory_budget=MEMORY_BUDGET,
+                    add_time_uncertainty=True, add_lvo_uncertainty=True,
+                    fix_performance=False, hospital_draws=None, prune=False,
+                    rng=None, accumulate=None):
+        """
+        Run the model in chunks of model runs sized so a chunk fits in
+            memory_budget bytes, adding up counts as each chunk finishes.
+            Nothing is kept from a chunk but its counts, so peak memory
+            doesn't grow with n.
+            accumulate -- optional function called with the Population and
+                          IschemicTimes of each chunk in turn, such as
+                          data_io.OutcomeSummary.add
+            hospital_draws -- optional times.HospitalDraws for all n runs,
+                              each chunk using its share of them
+            rng -- seed or SeedSequence, each chunk drawing from the child
+                   stream numbered by its position as in run_sequential,
+                   or a numpy Generator shared by every chunk. A run that
+                   fits in one chunk gets the draws of run with this rng.
+        Returns the Results of all n model runs.
+        """
+        costs.Costs.inflate(2016)
+        pruning = self._prune(self._patient) if prune else None
+        if pruning is not None and pruning.certain is not None:
+            timing.count('certain scenarios')
+            return results.Results.certain(pruning.certain, n,
+                                           pruning.strategies)
+        size = chunk_size(self._strategy_count(pruning), memory_budget,
+                          self._dtype)
+        starts = range(0, n, size)
+        chunk_results = []
+        for i, start in enumerate(starts):
+            stop = min(start + size, n)
+            chunk_rng = rng
+            if (len(starts) > 1 and rng is not None and
+                    not isinstance(rng, np.random.Generator)):
+                chunk_rng = streams.seed_sequence(rng, i)
+            chunk_draws = hospital_draws
+            if hospital_draws is not None:
+                chunk_draws = hospital_draws.select(slice(start, stop))
+            these_results, markov, ais_times = self.run(
+                stop - start, add_time_uncertainty, add_lvo_uncertainty,
+                fix_performance, chunk_draws, prune, chunk_rng)
+            chunk_results.append(these_results)
+            if accumulate is not None and markov is not None:
+                accumulate(markov, ais_times)
+            del markov, ais_times
+        return results.Results.combine(chunk_results)
+
+    def _strategy_count(self, pruning=None):
+        """
+        Most strategies that can be simulated at the current location, as
+            the primary centers count twice
+        """
+        rows, _, transfers = self._reachable(pruning)
+        is_primary = (self._network.center_types[rows] ==
+                      sc.CenterType.PRIMARY)
+        local_network = self._network.subnetwork(rows, transfers)
+        return len(local_network) + int(is_primary.sum())
+
+    def _prune(self, patient):
+        """Find the strategies that can never be optimal for a patient"""
+        return dominance.prune(patient, self._network, self._rows,
+                               self._bounds)
+
+    def _reachable(self, pruning=None):
+        """
+        Rows, travel time bounds and transfer mask of the hospitals to
+            simulate, only those left by a dominance.Pruning if given
+        """
+        if pruning is None:
+            return self._rows, self._bounds, None
+        return pruning.rows, pruning.bounds, pruning.transfers
+
+    def _sample_times(self, patient, reachable, n, add_time_uncertainty,
+                      add_lvo_uncertainty, fix_performance, hospital_draws,
+                      rng=None):
+        """
+        Sample times on a network of the reachable hospitals and their
+            transfer destinations, travel times first and then the rest of
+            the times.IschemicTimes draws from the same Generator.
+            reachable -- network rows, travel time bounds and transfer mask
+                         (or None) of the hospitals to include
+        """
+        rows, bounds, transfers = reachable
+        local_network = self._network.subnetwork(rows, transfers)
+        travel = np.full((len(local_network), 2), np.NaN)
+        travel[:len(rows)] = bounds
+        rng = streams.generator(rng)
+        travel_times = local_network.sample_travel_times(travel, n, rng)
+        return times.IschemicTimes(patient, local_network, n,
+                                   add_time_uncertainty, add_lvo_uncertainty,
+                                   fix_performance, travel_times,
+                                   hospital_draws, rng, self._dtype)
+
+    def _results(self, markov, ais_times, pruned=()):
+        """
+        Tabulate results, breaking ties by the mean travel times sampled for
+            this run rather than times stored on the centers
+        """
+        if timing.enabled():
+            _count_simulated(markov)
+        with timing.stage('results'):
+            mean_times = [np.mean(ais_times.travel_time(strategy.center))
+                          for strategy in markov.strategies]
+            ranks = results.strategy_ranks(markov.strategies, mean_times)
+            return results.Results(markov, ranks=ranks, pruned=pruned)
+
+
+def compare_precision(model, n=1000, dtype=np.float32, seed=0, **kwargs):
+    """
+    Check the counts of a model run at a lower precision against float64.
+        Both runs use the same draws, from the given seed, so counts only
+        differ where rounding changes the optimal strategy, as when two
+        strategies are within rounding of the same net benefit.
+        kwargs -- passed to StrokeModel.run
+    Returns the optimal counts at dtype, the float64 counts, and the share of
+        model runs that would have to move between strategies to turn one
+        set of counts into the other.
+    """
+    compared = []
+    for this_dtype in [dtype, np.float64]:
+        this_model = copy.copy(model)
+        this_model._dtype = np.dtype(this_dtype)
+        these_results, _, _ = this_model.run(n, rng=seed, **kwargs)
+        compared.append(these_results.optimal_counts)
+    low, high = compared
+    moved = sum(abs(low[s] - high[s]) for s in set(low) | set(high)) / 2
+    return low, high, moved / n
+
+
+def chunk_size(strategy_count, memory_budget=MEMORY_BUDGET,
+               dtype=np.float64):
+    """
+    Number of model runs of a location with strategy_count strategies that
+        can be simulated at once within memory_budget bytes, at least one
+    """
+    run_bytes = RUN_FOOTPRINT * max(strategy_count, 1) * np.dtype(
+        dtype).itemsize
+    return max(int(memory_budget // run_bytes), 1)
+
+
+def _count_simulated(markov):
+    """
+    Count a model call, its model runs and strategies, and the drip and
+        ship strategies with no run where a transfer is in time for EVT,
+        which are simulated for nothing. A scenario run in chunks or
+        batches makes a call for each.
+    """
+    p_good = markov.ais_outcomes.p_good
+    kind = constants.StrategyKind.DRIP_AND_SHIP
+    drip_and_ship = np.array([strategy.kind is kind
+                              for strategy in markov.strategies], dtype=bool)
+    timing.count('model calls')
+    timing.count('simulations', p_good.shape[-2])
+    timing.count('strategies', len(markov.strategies))
+    timing.count('NaN drip and ship columns',
+                 int(np.isnan(p_good[..., drip_and_ship]).all(axis=-2).sum()))
+
+
+def _combine(prunings, bounds=None, rows=None):
+    """
+    Combine prunings into one keeping every hospital kept by any of them,
+        with drip and ship wherever any of them allows it. Travel time
+        bounds are taken from the reachable rows and bounds given.
+    """
+    kept = np.unique(np.concatenate([p.rows for p in prunings]))
+    transfers = np.zeros(len(kept), dtype=bool)
+    for pruning in prunings:
+        transfers[np.searchsorted(kept, pruning.rows)] |= pruning.transfers
+    kept_bounds = None
+    if bounds is not None:
+        kept_bounds = bounds[np.searchsorted(rows, kept)]
+    return dominance.Pruning(kept, kept_bounds, transfers, [], [])
+
+
+def _unsimulated(strategies, rows, hospital_network):
+    """Strategies of hospitals not in the given simulated rows"""
+    simulated = set(rows.tolist())
+    return [strategy for strategy in strategies
+            if hospital_network.row(strategy.center) not in simulated]
@@ -2,8 +2,10 @@
 Model relevant hospital times for an AIS patient under all available
     strategies
 """
+import copy
 import numpy as np
-from . import stroke_center as sc, constants, strategy
+from . import stroke_center as sc, constants, network, streams, strategy
+from .patient import PatientBatch
 
 
 class IschemicTimes:
@@ -48,39 +50,213 @@ class IschemicTimes:
         """
         return self._onset_evt_ship
 
+    @property
+    def primaries(self):
+        """Primary centers, in the order of the primary strategy columns"""
+        return self._primaries
+
+    @property
+    def comprehensives(self):
+        """
+        Comprehensive centers, in the order of the comprehensive strategy
+            columns
+        """
+        return self._comprehensives
+
     def __init__(self, patient, hospitals, n, add_time_uncertainty,
-                 add_lvo_uncertainty, fix_performance=False):
+                 add_lvo_uncertainty, fix_performance=False,
+                 travel_times=None, hospital_draws=None, rng=None,
+                 dtype=np.float64):
         """
         Initialize with patient information and all potential destination
-            hospitals. Hospitals should have travel time information, and
-            primary centers treated as drip and ship candidates should have
-            transfer destination and times.
+            hospitals, as a HospitalNetwork or a list of StrokeCenters.
+            Primary centers treated as drip and ship candidates should have
+            transfer destination and times. Hospitals are never modified;
+            all sampled times are kept here. The patient may be a
+            PatientBatch, in which case the hospital draws are shared by
+            every patient and all arrays gain a leading patient axis.
             n -- number of randomized simulations to include
             add_time_uncertainty -- randomize intra-hospital times
             add_lvo_uncertainty -- randomize probability of an LVO
             fix_performance -- if True all hospitals have intrahospital times
                                 at the same percentile of their distribution,
                                 otherwise all draws are independent
+            travel_times -- optional array of travel times shaped
+                            (n, hospitals) with hospitals in network order,
+                            or (locations, n, hospitals) for a block of map
+                            points. With a location axis all arrays gain a
+                            leading location axis with independent draws at
+                            each location. NaN travel times mark hospitals
+                            that can't be reached. Defaults to sampling from
+                            the travel time distributions set on the centers.
+            hospital_draws -- optional HospitalDraws to use for door to
+                              needle and door to puncture times instead of
+                              sampling new ones, so the same draws are
+                              shared across locations and patients. The
+                              draws determine time uncertainty and
+                              performance, overriding those arguments.
+            rng -- numpy Generator or seed for every draw made here, see
+                   streams.generator
+            dtype -- floating point type of the times and everything
+                     computed from them. Draws are made in float64 either
+                     way, so float32 runs see the same random numbers.
         """
         self.patient = patient
+        self.network = network.as_network(hospitals)
+        rng = streams.generator(rng)
+        if travel_times is None:
+            travel_times = self.network.sample_travel_times(
+                self.network.travel_bounds(), n, rng)
+        travel_times = np.asarray(travel_times, dtype=dtype)
+        self._travel = travel_times
+        draw_shape = travel_times.shape[:-1]
 
-        # Generate intra-hospital times
-        self._process_hospitals(hospitals, n, add_time_uncertainty,
-                                fix_performance)
+        # Candidate destinations are the hospitals reachable in any run
+        reachable = ~np.isnan(travel_times).reshape(
+            -1, len(self.network)).all(axis=0)
+        center_types = self.network.center_types
+        self._primary_rows = np.flatnonzero(
+            reachable & (center_types == sc.CenterType.PRIMARY))
+        self._comp_rows = np.flatnonzero(
+            reachable & (center_types == sc.CenterType.COMPREHENSIVE))
+        self._set_centers()
+
+        # Generate intra-hospital times, with hospitals along the last axis
+        if hospital_draws is None:
+            door_to_needle, door_to_puncture = self._sample_hospital_times(
+                draw_shape, add_time_uncertainty, fix_performance, rng)
+        else:
+            door_to_needle, door_to_puncture = hospital_draws.for_network(
+                self.network, n)
+        door_to_needle = np.moveaxis(door_to_needle, 0, -1).astype(
+            dtype, copy=False)
+        door_to_puncture = np.moveaxis(door_to_puncture, 0, -1).astype(
+            dtype, copy=False)
 
         # Compute onset to treatment times
-        self._compute_onset_needle_primary()
-        self._compute_onset_needle_comprehensive()
-        self._compute_onset_evt_noship()
-        self._compute_onset_evt_ship()
+        self._compute_onset_times(door_to_needle, door_to_puncture)
 
         # Generate probability of LVO
-        self.p_lvo = patient.severity.prob_LVO_given_AIS(n,
-                                                         add_lvo_uncertainty)
+        if len(draw_shape) == 1:
+            self.p_lvo = patient.severity.prob_LVO_given_AIS(
+                n, add_lvo_uncertainty, rng)
+        else:
+            self.p_lvo = patient.severity.prob_LVO_given_AIS(
+                int(np.prod(draw_shape)), add_lvo_uncertainty, rng
+            ).reshape(draw_shape + (1,))
+        self.p_lvo = self.p_lvo.astype(dtype, copy=False)
 
         # Initialize empty cache dictionary for Strategy lists
         self._strategies = {}
 
+    def select(self, index):
+        """
+        Select a single patient from times for a PatientBatch, or a single
+            location from times for a block of map points. Only hospitals
+            that can be reached at the selected location are kept.
+        """
+        selected = copy.copy(self)
+        if isinstance(self.patient, PatientBatch):
+            selected.patient = self.patient[index]
+        else:
+            selected._travel = self._travel[index]
+        # travel times are the same for every model run, so the first tells
+        #   which hospitals can be reached
+        reachable = ~np.isnan(selected._travel[0])
+        primaries = reachable[self._primary_rows]
+        comps = reachable[self._comp_rows]
+        selected._primary_rows = self._primary_rows[primaries]
+        selected._comp_rows = self._comp_rows[comps]
+        selected._set_centers()
+        selected._onset_needle_primary = (
+            self._onset_needle_primary[index][..., primaries])
+        selected._onset_needle_comprehensive = (
+            self._onset_needle_comprehensive[index][..., comps])
+        selected._onset_evt_noship = self._onset_evt_noship[index][..., comps]
+        selected._onset_evt_ship = self._onset_evt_ship[index][..., primaries]
+        selected.p_lvo = self.p_lvo[index]
+        selected._strategies = {}
+        return selected
+
+    @classmethod
+    def concatenate(cls, times_list):
+        """
+        Combine times for the same patient and hospitals from several sets
+            of model runs, in the order given
+        """
+        first = times_list[0]
+        for other in times_list[1:]:
+            if (not np.array_equal(other._primary_rows, first._primary_rows)
+                    or not np.array_equal(other._comp_rows,
+                                          first._comp_rows)):
+                raise ValueError('Times are for different hospitals')
+        combined = copy.copy(first)
+        for name in ['_travel', '_onset_needle_primary',
+                     '_onset_needle_comprehensive', '_onset_evt_noship',
+                     '_onset_evt_ship', 'p_lvo']:
+            setattr(combined, name,
+                    np.concatenate([getattr(these_times, name)
+                                    for these_times in times_list], axis=-2))
+        combined._strategies = {}
+        return combined
+
+    @classmethod
+    def stack(cls, times_list, hospital_network):
+        """
+        Combine times for the same patient at several locations into times
+            for a block of map points, with a leading location axis. Each
+            location's times may be on its own network, as long as every
+            hospital is in the given network. Hospitals a location's times
+            don't include get NaN times there.
+        """
+        first = times_list[0]
+        stacked = cls.__new__(cls)
+        stacked.patient = first.patient
+        stacked.network = hospital_network
+        n_runs = first._travel.shape[0]
+        dtype = first._travel.dtype
+        stacked._travel = np.full(
+            (len(times_list), n_runs, len(hospital_network)), np.NaN, dtype)
+        columns = []
+        for i, these_times in enumerate(times_list):
+            these_columns = np.array([hospital_network.row(center) for center
+                                      in these_times.network.centers],
+                                     dtype=np.intp)
+            stacked._travel[i][:, these_columns] = these_times._travel
+            columns.append(these_columns)
+
+        reachable = ~np.isnan(stacked._travel).reshape(
+            -1, len(hospital_network)).all(axis=0)
+        center_types = hospital_network.center_types
+        stacked._primary_rows = np.flatnonzero(
+            reachable & (center_types == sc.CenterType.PRIMARY))
+        stacked._comp_rows = np.flatnonzero(
+            reachable & (center_types == sc.CenterType.COMPREHENSIVE))
+        stacked._set_centers()
+
+        for name, kind_rows, rows_name in [
+                ('_onset_needle_primary', stacked._primary_rows,
+                 '_primary_rows'),
+                ('_onset_evt_ship', stacked._primary_rows, '_primary_rows'),
+                ('_onset_needle_comprehensive', stacked._comp_rows,
+                 '_comp_rows'),
+                ('_onset_evt_noship', stacked._comp_rows, '_comp_rows')]:
+            values = np.full((len(times_list), n_runs, len(kind_rows)),
+                             np.NaN, dtype)
+            for i, these_times in enumerate(times_list):
+                rows = columns[i][getattr(these_times, rows_name)]
+                values[i][:, np.searchsorted(kind_rows, rows)] = getattr(
+                    these_times, name)
+            setattr(stacked, name, values)
+        stacked.p_lvo = np.stack([these_times.p_lvo
+                                  for these_times in times_list])
+        stacked._strategies = {}
+        return stacked
+
+    def travel_time(self, hospital):
+        """Travel times to the given hospital for each model run"""
+        return self._travel[..., self.network.row(hospital)]
+
     def get_strategies(self, strategy_kind):
         """
         Get a list of strategies of the appropriate kind, in the same
@@ -112,96 +288,138 @@ class IschemicTimes:
         self._strategies[strategy_kind] = strategies
         return strategies
 
-    def _process_hospitals(self, hospitals, n, add_time_uncertainty,
-                           fix_performance):
+    def _set_centers(self):
+        centers = self.network.centers
+        self._primaries = [centers[row] for row in self._primary_rows]
+        self._comprehensives = [centers[row] for row in self._comp_rows]
+
+    def _sample_hospital_times(self, draw_shape, add_time_uncertainty,
+                               fix_performance, rng):
+        """
+        Sample door to needle and door to puncture times for every hospital
+            in the network, shaped (hospitals,) + draw_shape
+        """
         if fix_performance:
-            dtn_perf = np.random.uniform(0, 1, n)
-            dtp_perf = np.random.uniform(0, 1, n)
+            dtn_perf = rng.random(draw_shape)
+            dtp_perf = rng.random(draw_shape)
         else:
             dtn_perf = None
             dtp_perf = None
-        primaries = []
-        comprehensives = []
-        for hospital in hospitals:
-            hospital.set_door_to_needle(n, add_time_uncertainty, dtn_perf)
-            hospital.set_travel_time(n)
-            if hospital.center_type is sc.CenterType.PRIMARY:
-                # also initialize transfer destination times since they may not
-                #   be in self.comprehensives
-                td = hospital.transfer_destination
-                if td is not None:
-                    td.set_door_to_needle(n, add_time_uncertainty, dtn_perf)
-                    td.set_door_to_puncture(n, add_time_uncertainty, dtp_perf)
-                primaries.append(hospital)
-            elif hospital.center_type is sc.CenterType.COMPREHENSIVE:
-                hospital.set_door_to_puncture(n, add_time_uncertainty,
-                                              dtp_perf)
-                comprehensives.append(hospital)
-        self._primaries = primaries
-        self._comprehensives = comprehensives
-
-    def _compute_onset_needle_primary(self):
-        self._onset_needle_primary = self._onset_needle(self._primaries)
-
-    def _compute_onset_needle_comprehensive(self):
-        self._onset_needle_comprehensive = self._onset_needle(
-            self._comprehensives
-        )
+        door_to_needle = self.network.sample_door_to_needle(
+            draw_shape, add_time_uncertainty, dtn_perf, rng)
+        door_to_puncture = self.network.sample_door_to_puncture(
+            draw_shape, add_time_uncertainty, dtp_perf, rng)
+        return door_to_needle, door_to_puncture
+
+    def _compute_onset_times(self, door_to_needle, door_to_puncture):
+        primaries = self._primary_rows
+        comps = self._comp_rows
+        # in the type of the travel times, so they don't promote float32
+        dtype = self._travel.dtype
+        symptom_time = np.asarray(self.patient.symptom_time, dtype=dtype)
 
-    def _onset_needle(self, hospitals):
-        travel = []
-        dtn = []
-        for hospital in hospitals:
-            travel.append(hospital.time)
-            dtn.append(hospital.door_to_needle)
-        # time_to_hospital = np.hstack(travel)
-        time_to_hospital = np.dstack(travel)[0]
-        dtn = np.dstack(dtn)[0]
-        # print("Travel time: {}".format(time_to_hospital.shape))
-        # print("DTN time: {}".format(dtn.shape))
-
-        return self.patient.symptom_time + time_to_hospital + dtn
-
-    def _compute_onset_evt_noship(self):
-        travel = []
-        dtp = []
-        for comp in self._comprehensives:
-            travel.append(comp.time)
-            dtp.append(comp.door_to_puncture)
-        # time_to_hospital = np.hstack(travel)
-        time_to_hospital = np.dstack(travel)[0]
-        dtp = np.dstack(dtp)[0]
-
-        time = self.patient.symptom_time + time_to_hospital + dtp
-        self._onset_evt_noship = time
-
-    def _compute_onset_evt_ship(self):
-        to_primary = []
-        door_to_needle = []
-        transfer_time = []
-        transfer_to_puncture = []
-        for primary in self._primaries:
-            to_primary.append(primary.time)
-            door_to_needle.append(primary.door_to_needle)
-            if primary.transfer_destination is None:
-                transfer_time.append(np.NaN)
-                null_ttp = np.broadcast_arrays(np.NaN,
-                                               primary.door_to_needle)[0]
-                transfer_to_puncture.append(null_ttp)
-            else:
-                comp = primary.transfer_destination
-                transfer_time.append(primary.transfer_time)
-                transfer_to_puncture.append(comp.door_to_puncture -
-                                            primary.door_to_needle)
-        # to_primary = np.hstack(to_primary)
-        to_primary = np.dstack(to_primary)[0]
-        door_to_needle = np.dstack(door_to_needle)[0]
-        transfer_time = np.hstack(transfer_time)
-        transfer_to_puncture = np.dstack(transfer_to_puncture)[0]
+        self._onset_needle_primary = (symptom_time +
+                                      self._travel[..., primaries] +
+                                      door_to_needle[..., primaries])
+        self._onset_needle_comprehensive = (symptom_time +
+                                            self._travel[..., comps] +
+                                            door_to_needle[..., comps])
+        self._onset_evt_noship = (symptom_time + self._travel[..., comps] +
+                                  door_to_puncture[..., comps])
+
+        destinations = self.network.transfer_index[primaries]
+        transfer_time = self.network.transfer_time[primaries].astype(dtype)
+        # NaN if no transfer destination exists
+        transfer_to_puncture = np.where(
+            destinations >= 0,
+            door_to_puncture[..., destinations] -
+            door_to_needle[..., primaries],
+            np.NaN)
         # approximation of intrahospital time for transfer, which seems to
         #   cancel out here, so primary DTN doesn't impact drip and ship time
         #   to EVT. (Maybe this should use comp.door_to_needle instead?)
         self._onset_evt_ship = (
-            self.patient.symptom_time + to_primary +
-            door_to_needle + transfer_time + transfer_to_puncture
+            symptom_time + self._travel[..., primaries] +
+            door_to_needle[..., primaries] + transfer_time +
+            transfer_to_puncture
         )
+
+
+class HospitalDraws:
+    """
+    Door to needle and door to puncture times for a set of hospitals, drawn
+        once and shared by every location and patient in a run (common
+        random numbers). Draws are stored as hospital by model run arrays.
+    """
+
+    def __init__(self, hospitals, n, add_time_uncertainty=True,
+                 fix_performance=False, seed=None):
+        """
+        Draw n times for every hospital in a HospitalNetwork or list of
+            StrokeCenters, including transfer destinations of primary
+            centers.
+            add_time_uncertainty -- randomize intra-hospital times, otherwise
+                                    every draw is the median
+            fix_performance -- if True all hospitals have intrahospital times
+                                at the same percentile of their distribution
+                                in each model run
+            seed -- optional seed, SeedSequence or numpy Generator for the
+                    draws, see streams.generator
+        """
+        hospital_network = network.as_network(hospitals)
+        self.n = n
+        self._rows = {center_id: i for i, center_id in
+                      enumerate(hospital_network.center_ids)}
+
+        rng = streams.generator(seed)
+        if fix_performance:
+            dtn_perf = rng.random(n)
+            dtp_perf = rng.random(n)
+        else:
+            dtn_perf = None
+            dtp_perf = None
+        shape = (len(hospital_network), n)
+        self.door_to_needle_draws = np.broadcast_to(
+            hospital_network.sample_door_to_needle(
+                n, add_time_uncertainty, dtn_perf, rng), shape).copy()
+        self.door_to_puncture_draws = np.broadcast_to(
+            hospital_network.sample_door_to_puncture(
+                n, add_time_uncertainty, dtp_perf, rng), shape).copy()
+
+    def select(self, index):
+        """
+        Get the draws of only some of the model runs, e.g. a slice for a
+            chunk of a run
+        """
+        selected = HospitalDraws.__new__(HospitalDraws)
+        selected._rows = self._rows
+        selected.door_to_needle_draws = self.door_to_needle_draws[:, index]
+        selected.door_to_puncture_draws = self.door_to_puncture_draws[:,
+                                                                      index]
+        selected.n = selected.door_to_needle_draws.shape[1]
+        return selected
+
+    def door_to_needle(self, hospital):
+        """Door to needle draws for the given hospital"""
+        return self.door_to_needle_draws[self._rows[hospital.center_id]]
+
+    def door_to_puncture(self, hospital):
+        """Door to puncture draws for the given comprehensive center"""
+        return self.door_to_puncture_draws[self._rows[hospital.center_id]]
+
+    def for_network(self, hospital_network, n):
+        """
+        Get door to needle and door to puncture draws in the row order of
+            the given HospitalNetwork, matching hospitals by center id
+        """
+        if self.n != n:
+            raise ValueError(f'Hospital draws have {self.n} model runs, '
+                             f'expected {n}')
+        try:
+            rows = [self._rows[center_id]
+                    for center_id in hospital_network.center_ids]
+        except KeyError as err:
+            raise ValueError(f'No hospital draws for center {err}')
+        return (self.door_to_needle_draws[rows],
+                self.door_to_puncture_draws[rows])
+
@@ -0,0 +1,128 @@
+"""
+Optional timers and counters for the stages of a model run, to find where
+    the time of a slow run goes. Nothing is recorded until enable is called,
+    and stages then cost a clock read on entry and exit.
+"""
+import contextlib
+import json
+import os
+import time
+
+# Timings being recorded in this process, None when disabled
+_ACTIVE = None
+
+
+class Timings:
+    """Seconds and calls by stage, and totals of named counters"""
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.counts = {}
+        self.processes = {os.getpid()}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the body of a with block as a call of the named stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds[name] = self.seconds.get(name, 0) + elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, value=1):
+        """Add value to the named counter"""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def merge(self, other):
+        """Add the stages and counters of other Timings to these"""
+        for name, seconds in other.seconds.items():
+            self.seconds[name] = self.seconds.get(name, 0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+        for name, value in other.counts.items():
+            self.count(name, value)
+        self.processes |= other.processes
+
+    def summary(self):
+        """
+        Stages and counters as a dictionary that can be written as JSON.
+            Stage seconds are added up over every process, so with a pool
+            of workers they can exceed the wall time of the run.
+        """
+        return {
+            'stages': {
+                name: {'seconds': self.seconds[name],
+                       'calls': self.calls[name]}
+                for name in sorted(self.seconds, key=self.seconds.get,
+                                   reverse=True)
+            },
+            'counts': {name: int(value) for name, value
+                       in sorted(self.counts.items())},
+            'processes': len(self.processes),
+        }
+
+
+def enable():
+    """Start recording in this process, returning the new Timings"""
+    global _ACTIVE
+    _ACTIVE = Timings()
+    return _ACTIVE
+
+
+def disable():
+    """Stop recording, returning the Timings recorded or None"""
+    global _ACTIVE
+    timings, _ACTIVE = _ACTIVE, None
+    return timings
+
+
+def enabled():
+    """Whether this process is recording"""
+    return _ACTIVE is not None
+
+
+def stage(name):
+    """
+    Context manager timing its body as a call of the named stage, which
+        does nothing while recording is disabled
+    """
+    if _ACTIVE is None:
+        return contextlib.nullcontext()
+    return _ACTIVE.stage(name)
+
+
+def count(name, value=1):
+    """Add value to the named counter, if recording"""
+    if _ACTIVE is not None:
+        _ACTIVE.count(name, value)
+
+
+def merge(timings):
+    """Add Timings from another process to those being recorded"""
+    if _ACTIVE is not None and timings is not None:
+        _ACTIVE.merge(timings)
+
+
+def timed(function, *args):
+    """
+    Call function with args while recording into fresh Timings, as a pool
+        task. Returns the result and the Timings, for the parent to merge.
+    """
+    global _ACTIVE
+    previous, _ACTIVE = _ACTIVE, Timings()
+    try:
+        return function(*args), _ACTIVE
+    finally:
+        _ACTIVE = previous
+
+
+def write_summary(timings, outfile='-'):
+    """Write the summary of timings as JSON to outfile, '-' for stdout"""
+    text = json.dumps(timings.summary(), indent=2)
+    if outfile == '-':
+        print(text)
+    else:
+        with open(outfile, 'w') as f:
+            f.write(text + '\n')
@@ -0,0 +1,254 @@
+'''
+Generate synthetic hospital, hospital performance and travel time files at
+    any scale, in the formats data_io.get_hospitals and get_times read, for
+    benchmarks and stress tests. Nothing in them describes real hospitals.
+'''
+import argparse
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import paths
+from stroke import stroke_center as sc
+
+# Area of the region per hospital in square km, about that of the states
+#   covered by the production inputs
+KM2_PER_HOSPITAL = 1500
+# Road distance relative to straight line distance
+ROAD_FACTOR = 1.3
+# Average driving speed in km per minute without traffic
+SPEED = 1.0
+# Locations are written this many rows at a time, bounding memory use
+CHUNK_ROWS = 2000
+
+
+class SyntheticRegion:
+    '''
+    Hospitals and locations placed in a square region, clustered around
+        cities with some spread evenly across it. Travel times grow with
+        road distance, so the hospitals a location can reach thin out with
+        distance like they do in the real inputs.
+    '''
+
+    def __init__(self, hospitals=200, comprehensive_share=0.25, cities=None,
+                 seed=0):
+        '''
+        hospitals -- number of hospitals, at least one comprehensive
+        comprehensive_share -- share of hospitals that are comprehensive
+        cities -- number of cities, default one per 10 hospitals
+        seed -- seed for placing cities and hospitals
+        '''
+        self.seed = seed
+        rng = np.random.default_rng([seed, 0])
+        self.size = np.sqrt(hospitals * KM2_PER_HOSPITAL)
+        if cities is None:
+            cities = max(hospitals // 10, 1)
+        self.cities = rng.uniform(0, self.size, (cities, 2))
+        self.hospital_positions = self._scatter(rng, hospitals, 15, 0.7)
+
+        n_comp = min(max(int(round(hospitals * comprehensive_share)), 1),
+                     hospitals)
+        is_comp = np.zeros(hospitals, dtype=bool)
+        # comprehensive centers are the ones closest to a city center
+        is_comp[np.argsort(self._city_distance(
+            self.hospital_positions))[:n_comp]] = True
+        self.is_comprehensive = is_comp
+        self.hospital_ids = np.arange(hospitals) + 100
+
+    def hospital_table(self):
+        '''
+        Hospitals as a DataFrame in the format of paths.load_hospital, each
+            primary center transferring to its nearest comprehensive center
+        '''
+        comps = np.flatnonzero(self.is_comprehensive)
+        times = self.drive_times(self.hospital_positions,
+                                 self.hospital_positions[comps])
+        nearest = comps[np.argmin(times, axis=1)]
+        transfer_time = np.round(times.min(axis=1), 2)
+        primary = ~self.is_comprehensive
+        return pd.DataFrame({
+            'HOSP_KEY': self.hospital_ids,
+            'CenterType': np.where(primary, 'Primary', 'Comprehensive'),
+            'destination_KEY': pd.Series(self.hospital_ids[nearest],
+                                         dtype='Int64').where(primary),
+            'transfer_time': np.where(primary, transfer_time, np.NaN),
+        })
+
+    def performance_table(self, missing_share=0.2):
+        '''
+        Door to needle and door to puncture quartiles and sample sizes in
+            the format of paths.load_dtn, around the generic distributions
+            in stroke_center. Door to puncture times are only given for
+            comprehensive centers.
+            missing_share -- share of hospitals without any data, which
+                             then use the generic distributions
+        '''
+        rng = np.random.default_rng([self.seed, 1])
+        count = len(self.hospital_ids)
+        df = pd.DataFrame({'HOSP_KEY': self.hospital_ids})
+        dtn_dists = [sc.COMP_DIST if comp else sc.PRIMARY_DIST
+                     for comp in self.is_comprehensive]
+        missing = rng.random(count) < missing_share
+        for columns, dists, has_data in [
+                (paths.DTN_COLS, dtn_dists, ~missing),
+                (paths.DTP_COLS, [sc.DTP_DIST] * count,
+                 ~missing & self.is_comprehensive)]:
+            quartiles = _quartiles(dists, rng)
+            sample_size = rng.poisson(40, count) + 5
+            for column, values in zip(columns, list(quartiles) +
+                                      [sample_size]):
+                df[column] = np.where(has_data, values, np.NaN)
+        return df
+
+    def locations(self, count, rng):
+        '''Positions of count random locations, shaped (count, 2)'''
+        return self._scatter(rng, count, 30, 0.8)
+
+    def drive_times(self, origins, destinations):
+        '''Travel times in minutes without traffic, shaped (origins,
+            destinations)'''
+        distance = np.sqrt(((origins[:, np.newaxis, :] -
+                             destinations[np.newaxis, :, :])**2).sum(axis=2))
+        return 3 + ROAD_FACTOR * distance / SPEED
+
+    def travel_times(self, positions, rng, max_time=180):
+        '''
+        (no traffic, traffic) travel times from positions to every
+            hospital, shaped (positions, hospitals, 2) with NaN past
+            max_time minutes. The nearest hospital can always be reached.
+        '''
+        no_traffic = self.drive_times(positions, self.hospital_positions)
+        reachable = no_traffic <= max_time
+        reachable[np.arange(len(positions)), no_traffic.argmin(axis=1)] = True
+        traffic = no_traffic * rng.uniform(1.05, 1.5, no_traffic.shape)
+        times = np.stack([no_traffic, traffic], axis=-1)
+        times[~reachable] = np.NaN
+        return times
+
+    def _scatter(self, rng, count, spread, clustered_share):
+        '''Points around random cities, or anywhere in the region'''
+        city = self.cities[rng.integers(len(self.cities), size=count)]
+        points = city + rng.normal(0, spread, (count, 2))
+        anywhere = rng.random(count) >= clustered_share
+        points[anywhere] = rng.uniform(0, self.size, (anywhere.sum(), 2))
+        return np.clip(points, 0, self.size)
+
+    def _city_distance(self, positions):
+        return np.sqrt(((positions[:, np.newaxis, :] -
+                         self.cities[np.newaxis, :, :])**2).sum(axis=2)
+                       ).min(axis=1)
+
+
+def write_inputs(out_dir, locations=10000, hospitals=200,
+                 comprehensive_share=0.25, pair_share=1.0, max_time=180,
+                 missing_share=0.2, seed=0):
+    '''
+    Write hospitals.csv, dtn.csv and times.csv for a synthetic region to
+        out_dir. Pass the first two to data_io.get_hospitals and the last
+        to get_times or main.py.
+        pair_share -- share of travel times written as a "no_traffic,
+                      traffic" pair rather than a single value
+        max_time -- longest travel time in minutes listed in the times
+                    file, beyond which hospitals can't be reached
+    Returns the paths of the hospital, performance and times files.
+    '''
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    region = SyntheticRegion(hospitals, comprehensive_share, seed=seed)
+    hospital_file = out_dir / 'hospitals.csv'
+    dtn_file = out_dir / 'dtn.csv'
+    times_file = out_dir / 'times.csv'
+    region.hospital_table().to_csv(hospital_file, index=False)
+    region.performance_table(missing_share).to_csv(dtn_file, index=False)
+    write_times(times_file, region, locations, pair_share, max_time, seed)
+    return hospital_file, dtn_file, times_file
+
+
+def write_times(times_file, region, locations, pair_share=1.0, max_time=180,
+                seed=0):
+    '''
+    Write travel times from locations in a SyntheticRegion to its
+        hospitals, CHUNK_ROWS locations at a time so memory use doesn't
+        grow with locations. Locations are labelled L0, L1, ... in a LOC_ID
+        column.
+    '''
+    tmp_file = Path(str(times_file) + f'.{os.getpid()}.tmp')
+    with open(tmp_file, 'w', newline='') as f:
+        f.write(','.join(['LOC_ID'] + [str(hospital) for hospital
+                                       in region.hospital_ids]) + '\n')
+        for start in range(0, locations, CHUNK_ROWS):
+            count = min(CHUNK_ROWS, locations - start)
+            # each chunk has its own stream, so can be regenerated alone
+            rng = np.random.default_rng([seed, 2, start])
+            times = region.travel_times(region.locations(count, rng), rng,
+                                        max_time)
+            is_pair = rng.random(times.shape[:2]) < pair_share
+            f.writelines(_times_lines(
+                [f'L{i}' for i in range(start, start + count)], times,
+                is_pair))
+    os.replace(tmp_file, times_file)
+
+
+def _times_lines(locations, times, is_pair):
+    '''
+    Lines of a times file for the given location IDs. Only reachable cells
+        are formatted, as most are empty in a large region, and pairs are
+        quoted since they hold a comma.
+    '''
+    cells = [[''] * times.shape[1] for _ in locations]
+    rows, columns = np.nonzero(~np.isnan(times[..., 0]))
+    for row, column, (no_traffic, traffic), pair in zip(
+            rows.tolist(), columns.tolist(), times[rows, columns].tolist(),
+            is_pair[rows, columns].tolist()):
+        if pair:
+            cells[row][column] = f'"{no_traffic:.2f}, {traffic:.2f}"'
+        else:
+            cells[row][column] = f'{no_traffic:.2f}'
+    return [','.join([location] + row) + '\n'
+            for location, row in zip(locations, cells)]
+
+
+def _quartiles(dists, rng):
+    '''
+    First quartiles, medians and third quartiles of hospitals scattered
+        around the given generic HospitalTimeDistributions
+    '''
+    medians = np.array([dist.median for dist in dists])
+    lower = medians - np.array([dist.first_quartile for dist in dists])
+    upper = np.array([dist.third_quartile for dist in dists]) - medians
+    scale = rng.lognormal(0, 0.2, len(dists))
+    median = medians * scale
+    first = median - lower * rng.uniform(0.5, 1.5, len(dists)) * scale
+    third = median + upper * rng.uniform(0.5, 1.5, len(dists)) * scale
+    return (np.round(np.maximum(first, 5), 2), np.round(median, 2),
+            np.round(third, 2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('out_dir', help='directory to write the files to')
+    parser.add_argument(
+        '-l', '--locations', type=int, default=10000,
+        help='number of locations (default 10000)')
+    parser.add_argument(
+        '-n', '--hospitals', type=int, default=200,
+        help='number of hospitals (default 200)')
+    parser.add_argument(
+        '--comprehensive-share', type=float, default=0.25,
+        help='share of hospitals that are comprehensive (default 0.25)')
+    parser.add_argument(
+        '--pair-share', type=float, default=1.0,
+        help='share of times written as "no_traffic, traffic" pairs '
+        '(default 1)')
+    parser.add_argument(
+        '--max-time', type=float, default=180,
+        help='longest travel time listed, in minutes (default 180)')
+    parser.add_argument(
+        '--missing-share', type=float, default=0.2,
+        help='share of hospitals without performance data (default 0.2)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for path in write_inputs(args.out_dir, args.locations, args.hospitals,
+                             args.comprehensive_share, args.pair_share,
+                             args.max_time, args.missing_share, args.seed):
+        print(path)
@@ -0,0 +1,42 @@
+import json
+import unittest
+import benchmark
+
+SWEEP = {
+    'simulations': [20],
+    'hospitals': [(2, 1)],
+    'locations': [2],
+    'ages': [65],
+    'times_locations': [10],
+    'hospital_counts': [8],
+    'result_locations': [5],
+}
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    '''Tests for the benchmark suite.'''
+
+    def test_records(self):
+        """Test that every benchmark reports JSON records of each case"""
+        report = benchmark.run_benchmarks(sweep=SWEEP, repeat=1)
+        report = json.loads(json.dumps(report))
+        names = [record['benchmark'] for record in report['results']]
+        self.assertEqual(set(names), set(benchmark.BENCHMARKS))
+        for record in report['results']:
+            self.assertGreater(record['seconds'], 0)
+            self.assertGreater(record['peak_memory_bytes'], 0)
+            self.assertAlmostEqual(record['scenarios_per_second'],
+                                   record['scenarios'] / record['seconds'])
+        self.assertEqual(names.count('save_patient'), 2)
+
+    def test_compare(self):
+        """Test that slower cases are reported as regressions"""
+        record = {'benchmark': 'run', 'params': {'simulations': 10},
+                  'seconds': 1.0, 'peak_memory_bytes': 100}
+        baseline = {'results': [record]}
+        current = {'results': [dict(record, seconds=2.0),
+                               dict(record, params={'simulations': 20})]}
+        ratios, regressions = benchmark.compare(baseline, current)
+        self.assertEqual(len(ratios), 1)
+        self.assertEqual(regressions, [('run', {'simulations': 10}, 2.0,
+                                        1.0)])
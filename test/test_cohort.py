@@ -0,0 +1,72 @@
+import unittest
+import numpy as np
+from stroke import ais_outcomes, cohort, constants, patient
+
+
+class PopulationTestCase(unittest.TestCase):
+    '''Tests for running the Markov model on a cohort.'''
+
+    def setUp(self):
+        """Generate a patient and random outcomes for a few strategies"""
+        self.patient = patient.Patient.with_RACE(constants.Sex.FEMALE, 62,
+                                                 40, 5)
+        rng = np.random.RandomState(2)
+        n, n_strategies = 50, 4
+        p_good = rng.uniform(0.2, 0.6, (n, n_strategies))
+        p_good[:, -1] = np.nan
+        p_tpa = rng.randint(0, 2, (n, n_strategies))
+        p_evt = rng.uniform(0, 0.3, (n, n_strategies))
+        self.outcomes = ais_outcomes.Outcome(p_good, p_tpa, p_evt, 1,
+                                             list(range(n_strategies)))
+
+    def test_streaming_matches_trace(self):
+        """Test that the streaming Markov sums match the yearly trace"""
+        for horizon in [None, 10, 11]:
+            trace = cohort.Population(self.patient, self.outcomes, horizon)
+            trace.analyze(method='trace')
+            streaming = cohort.Population(self.patient, self.outcomes,
+                                          horizon)
+            streaming.analyze(method='streaming')
+            for metric in cohort.METRICS:
+                np.testing.assert_array_equal(getattr(streaming, metric),
+                                              getattr(trace, metric))
+
+    def test_requested_metrics(self):
+        """Test that only the requested metrics are computed"""
+        population = cohort.Population(self.patient, self.outcomes)
+        population.analyze(metrics=('qalys',))
+        self.assertEqual(population.qalys.shape, self.outcomes.shape)
+        self.assertIsNone(population.costs)
+        self.assertIsNone(population.lys)
+
+    def test_affine_matches_streaming(self):
+        """Test that cached affine coefficients reproduce the Markov model"""
+        for horizon in [None, 10]:
+            streaming = cohort.Population(self.patient, self.outcomes,
+                                          horizon)
+            streaming.analyze(method='streaming')
+            affine = cohort.Population(self.patient, self.outcomes, horizon)
+            affine.analyze(method='affine')
+            for metric in cohort.METRICS:
+                np.testing.assert_allclose(getattr(affine, metric),
+                                           getattr(streaming, metric),
+                                           rtol=1e-12)
+
+    def test_patient_batch(self):
+        """Test that a batched cohort matches each patient run alone"""
+        patients = [self.patient,
+                    patient.Patient.with_NIHSS(constants.Sex.MALE, 80, 90,
+                                               14)]
+        batch = patient.PatientBatch(patients)
+        outcomes = ais_outcomes.Outcome(
+            np.stack([self.outcomes.p_good, self.outcomes.p_good * 0.5]),
+            self.outcomes.p_tpa, self.outcomes.p_evt, 1,
+            self.outcomes.strategies)
+        batched = cohort.Population(batch, outcomes)
+        batched.analyze()
+        for i, this_patient in enumerate(patients):
+            alone = cohort.Population(this_patient, outcomes.select(i))
+            alone.analyze()
+            for metric in cohort.METRICS:
+                np.testing.assert_allclose(getattr(batched.select(i), metric),
+                                           getattr(alone, metric))
@@ -0,0 +1,155 @@
+import os
+import tempfile
+import types
+import unittest
+import numpy as np
+import pandas as pd
+import data_io
+
+
+def _row(location, patient, count):
+    return {'Location': location, 'Patient': patient, 'Use Real DTN': True,
+            'Varying Hospitals': True, 'PSC Count': 1, 'CSC Count': 1,
+            'Sex': 'male', 'Age': 70, 'Symptoms': 60, 'RACE': 5,
+            'P (PSC)': count, 'C (CSC)': 10 - count, 'X (PSC)': np.nan}
+
+
+class SavePatientTestCase(unittest.TestCase):
+    '''Tests for appending and compacting result files.'''
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.hospitals = ['P (PSC)', 'C (CSC)', 'X (PSC)']
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_compact_keeps_latest(self):
+        """Test that compaction keeps the last saved row of each scenario"""
+        for layout in ['wide', 'long']:
+            outfile = os.path.join(self.dir.name, f'{layout}.csv')
+            data_io.save_patient(outfile, [_row('L1', 0, 3), _row('L2', 0, 4)],
+                                 self.hospitals, layout)
+            data_io.save_patient(outfile, [_row('L1', 0, 7)], self.hospitals,
+                                 layout)
+            with open(outfile) as f:
+                self.assertNotIn('nan', f.read())
+            df = data_io.compact_results(outfile)
+            self.assertEqual(len(df), 2)
+            df = data_io.read_results(outfile, self.hospitals).set_index(
+                'Location')
+            self.assertEqual(df.loc['L1', 'P (PSC)'], 7)
+            self.assertEqual(df.loc['L2', 'C (CSC)'], 6)
+            self.assertTrue(np.isnan(df.loc['L2', 'X (PSC)']))
+
+    def test_simulations_column(self):
+        """Test that simulation counts are kept, and left out of files
+            written before they were recorded"""
+        for layout in ['wide', 'long']:
+            outfile = os.path.join(self.dir.name, f'{layout}.csv')
+            row = dict(_row('L1', 0, 3), Simulations=1200)
+            data_io.save_patient(outfile, [row], self.hospitals, layout)
+            df = data_io.read_results(outfile, self.hospitals)
+            self.assertEqual(df.loc[0, 'Simulations'], 1200)
+
+            old_file = os.path.join(self.dir.name, f'old_{layout}.csv')
+            data_io.save_patient(old_file, [_row('L1', 0, 3)], self.hospitals,
+                                 layout)
+            header = pd.read_csv(old_file, nrows=0).columns
+            pd.read_csv(old_file).drop(columns='Simulations').to_csv(
+                old_file, index=False)
+            data_io.save_patient(old_file, [row], self.hospitals, layout)
+            df = data_io.compact_results(old_file)
+            self.assertNotIn('Simulations', df.columns)
+            self.assertEqual(len(df), 1)
+            self.assertIn('Simulations', header)
+
+
+class SummaryStatisticsTestCase(unittest.TestCase):
+    '''Tests for summarizing simulation arrays without DataFrames.'''
+
+    def test_matches_describe(self):
+        """Test that summaries match DataFrame.describe, NaN included"""
+        values = np.random.RandomState(0).uniform(size=(50, 4))
+        values[::3, 1] = np.nan
+        values[:, 2] = np.nan
+        values[1:, 3] = np.nan
+        expected = pd.DataFrame(values).describe().T
+        stats = data_io.summary_statistics(values)
+        np.testing.assert_allclose(stats, expected.values)
+        self.assertEqual(list(expected.columns), data_io.SUMMARY_STATISTICS)
+
+
+class OutcomeSummaryTestCase(unittest.TestCase):
+    '''Tests for summarizing outcomes chunk by chunk.'''
+
+    def test_matches_aggregate(self):
+        """Test that chunked summaries match summaries of every run"""
+        values = np.random.RandomState(0).uniform(size=(4, 90, 3))
+        values[:, ::4, 1] = np.nan
+        values[:, :, 2] = np.nan
+        markov = types.SimpleNamespace(
+            strategies=['A', 'B', 'C'], costs=values[0], lys=values[1],
+            qalys=values[2],
+            ais_outcomes=types.SimpleNamespace(p_good=values[3]))
+        expected = data_io.aggregate_outcomes(markov)
+        for sample_size, quartiles in [(90, True), (30, False)]:
+            summary = data_io.OutcomeSummary(90, sample_size)
+            for start in range(0, 90, 40):
+                chunk = values[:, start:start + 40]
+                summary.add(types.SimpleNamespace(
+                    strategies=markov.strategies, costs=chunk[0],
+                    lys=chunk[1], qalys=chunk[2],
+                    ais_outcomes=types.SimpleNamespace(p_good=chunk[3])))
+            names, strategies, stats = summary.aggregate()
+            self.assertEqual(names, expected[0])
+            self.assertEqual(strategies, expected[1])
+            exact = [0, 1, 2, 3, 7] + ([4, 5, 6] if quartiles else [])
+            np.testing.assert_allclose(stats[..., exact],
+                                       expected[2][..., exact])
+
+
+class OutcomeStoreTestCase(unittest.TestCase):
+    '''Tests for the partitioned outcome summary store.'''
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = os.path.join(self.dir.name, data_io.OUTCOME_STORE)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_write_and_read(self):
+        """Test that summaries are partitioned and read back selectively"""
+        names, strategies = ['Cost', 'QALY'], ['A', 'B']
+        for variant in ['beAHA', 'afAHA']:
+            rows = [
+                data_io.outcome_rows(point, names, strategies,
+                                     np.full((2, 2, 8), i), 'B')
+                for i, point in enumerate(['L1', 'L2', 'L3'])
+            ]
+            data_io.write_outcomes(self.store, 'age=70', variant, rows)
+        # a later summary of a location replaces the earlier one
+        data_io.write_outcomes(
+            self.store, 'age=70', 'afAHA',
+            data_io.outcome_rows('L1', names, strategies,
+                                 np.full((2, 2, 8), 9), 'A'))
+        self.assertEqual(
+            data_io.outcome_partition('/out/times=x_age=70_afAHA.csv'),
+            ('times=x_age=70', 'afAHA'))
+
+        df = data_io.read_outcomes(self.store, variant='afAHA',
+                                   locations=['L1', 'L3'])
+        self.assertEqual(len(df), 8)
+        self.assertEqual(df.loc[('age=70', 'afAHA', 'L1', 'Cost', 'A'),
+                                'mean'], 9)
+        self.assertTrue(df.loc[('age=70', 'afAHA', 'L1', 'QALY', 'A'),
+                               'Most C/E'])
+        self.assertEqual(df.loc[('age=70', 'afAHA', 'L3', 'QALY', 'B'),
+                                'max'], 2)
+        data_io.compact_outcomes(self.store)
+        pd.testing.assert_frame_equal(
+            data_io.read_outcomes(self.store, variant='afAHA',
+                                  locations=['L1', 'L3']).sort_index(),
+            df.sort_index())
+        self.assertEqual(len(data_io.read_outcomes(self.store)), 24)
@@ -0,0 +1,29 @@
+import unittest
+import numpy as np
+from stroke import constants
+from stroke.life_tables import LifeTables
+
+
+class SurvivalTableTestCase(unittest.TestCase):
+    '''Tests for precomputed survival and discount tables.'''
+
+    def test_cached(self):
+        """Test that a table is only built once per key"""
+        table = LifeTables.survival_table(constants.Sex.MALE, 70)
+        again = LifeTables.survival_table(constants.Sex.MALE, 70)
+        self.assertIs(table, again)
+        self.assertEqual(table.survival.shape, (31, constants.States.DEATH))
+
+    def test_survival_matches_mortality(self):
+        """Test survival against repeated adjusted mortality"""
+        sex, age, hazard = constants.Sex.FEMALE, 80, 3.18
+        table = LifeTables.survival_table(sex, age, hazards=[hazard],
+                                          horizon=5)
+        alive = 1
+        for year in range(5):
+            alive *= 1 - LifeTables.adjusted_mortality(sex, age + year,
+                                                       hazard)
+        self.assertEqual(table.end_index, 5)
+        self.assertAlmostEqual(table.survival[-1, 0], alive)
+        expected = np.sum(table.simpson * table.survival[:, 0])
+        self.assertAlmostEqual(table.life_years[0], expected)
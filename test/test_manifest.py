@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from manifest import RunManifest
+from stroke import constants, patient
+
+
+class RunManifestTestCase(unittest.TestCase):
+    '''Tests for recording and reloading completed scenarios.'''
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.manifest_file = os.path.join(self.dir.name, 'manifest.jsonl')
+        self.patient = patient.Patient.with_RACE(constants.Sex.FEMALE,
+                                                 np.int64(70), 30.0, 7)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_reload(self):
+        """Test that recorded scenarios are complete after reopening"""
+        manifest = RunManifest(self.manifest_file)
+        done = manifest.scenario(self.patient, 'L1', 'Demo.csv_realDTN', 100)
+        manifest.record([done])
+        self.assertTrue(manifest.is_complete(done))
+
+        manifest = RunManifest(self.manifest_file)
+        self.assertEqual(len(manifest), 1)
+        self.assertTrue(manifest.is_complete(
+            manifest.scenario(self.patient, 'L1', 'Demo.csv_realDTN', 100)))
+        for other in [
+                manifest.scenario(self.patient, 'L2', 'Demo.csv_realDTN', 100),
+                manifest.scenario(self.patient, 'L1', 'Demo.csv_realDTN', 200),
+                manifest.scenario(self.patient, 'L1', 'Demo.csv_realDTN', 100,
+                                  seed=1),
+                manifest.scenario(
+                    patient.Patient.with_RACE(constants.Sex.FEMALE, 70, 30.0,
+                                              7, pid=1),
+                    'L1', 'Demo.csv_realDTN', 100)
+        ]:
+            self.assertFalse(manifest.is_complete(other))
+
+    def test_ignores_partial_line(self):
+        """Test that a line cut off by a crash is ignored"""
+        manifest = RunManifest(self.manifest_file)
+        manifest.record(
+            [manifest.scenario(self.patient, 'L1', 'Demo.csv', 100)])
+        with open(self.manifest_file, 'a') as f:
+            f.write('{"age": 70, "loc')
+        self.assertEqual(len(RunManifest(self.manifest_file)), 1)
+
+    def test_record_after_partial_line(self):
+        """Test that a record after a line cut off mid-write is kept"""
+        manifest = RunManifest(self.manifest_file)
+        first, second, third = [
+            manifest.scenario(self.patient, location, 'Demo.csv', 100)
+            for location in ['L1', 'L2', 'L3']]
+        manifest.record([first, second])
+        with open(self.manifest_file, 'rb+') as f:
+            f.truncate(os.path.getsize(self.manifest_file) - 10)
+        manifest = RunManifest(self.manifest_file)
+        manifest.record([third])
+        manifest = RunManifest(self.manifest_file)
+        self.assertEqual(len(manifest), 2)
+        self.assertTrue(manifest.is_complete(first))
+        self.assertFalse(manifest.is_complete(second))
+        self.assertTrue(manifest.is_complete(third))
@@ -0,0 +1,78 @@
+import unittest
+import numpy as np
+from stroke import (constants, network, patient, stroke_model,
+                    stroke_center as sc)
+
+
+class HospitalNetworkTestCase(unittest.TestCase):
+    '''Tests for the array-backed hospital network.'''
+
+    def setUp(self):
+        """Generate a primary with a transfer destination not in the list"""
+        self.comp = sc.StrokeCenter(
+            'Comp', 'C', sc.CenterType.COMPREHENSIVE, 'C',
+            dtp_dist=sc.HospitalTimeDistributionHybrid(80, 100, 120, 40,
+                                                       sc.DTP_DIST))
+        self.prim = sc.StrokeCenter('Prim', 'P', sc.CenterType.PRIMARY, 'P')
+        self.prim.add_transfer_destination(self.comp, 25)
+        self.lone = sc.StrokeCenter('Lone', 'L', sc.CenterType.PRIMARY, 'L')
+        self.network = network.HospitalNetwork([self.prim, self.lone])
+
+    def test_transfer_destinations(self):
+        """Test that transfer destinations are added and indexed"""
+        self.assertEqual(self.network.center_ids, ('P', 'L', 'C'))
+        np.testing.assert_array_equal(self.network.transfer_index,
+                                      [2, -1, -1])
+        np.testing.assert_array_equal(self.network.transfer_time,
+                                      [25, np.nan, np.nan])
+        with self.assertRaises(ValueError):
+            self.network.transfer_index[0] = 1
+
+    def test_sample_times(self):
+        """Test sampled shapes, medians and hybrid draw shares"""
+        dtp = self.network.sample_door_to_puncture((4, 50))
+        self.assertEqual(dtp.shape, (3, 4, 50))
+        self.assertTrue(np.isnan(dtp[:2]).all())
+        # 40% of draws come from the real distribution, within its quartiles
+        real = (dtp[2] >= 80) & (dtp[2] <= 120)
+        self.assertGreaterEqual(real.sum(), 80)
+        medians = self.network.sample_door_to_needle(10, False)
+        self.assertEqual(medians.shape, (3, 1))
+        self.assertEqual(medians[2, 0], sc.COMP_DIST.median)
+        perf = np.linspace(0, 1, 10)
+        dtn = self.network.sample_door_to_needle(10, perf_level=perf)
+        np.testing.assert_allclose(dtn[0], sc.PRIMARY_DIST.first_quartile +
+                                   perf * (sc.PRIMARY_DIST.third_quartile -
+                                           sc.PRIMARY_DIST.first_quartile))
+
+    def test_model_leaves_hospitals_unchanged(self):
+        """Test that running a model doesn't store state on the centers"""
+        this_patient = patient.Patient.with_RACE(constants.Sex.FEMALE, 70,
+                                                 30, 7)
+        model = stroke_model.StrokeModel(this_patient, self.network)
+        model.set_times({'P': [20, 30], 'C': [50, 50], 'L': [np.nan] * 2})
+        self.assertEqual(model.hospitals, [self.prim, self.comp])
+        these_results, _, ais_times = model.run(n=30)
+        self.assertEqual(ais_times.primaries, [self.prim])
+        self.assertEqual(sum(these_results.optimal_counts.values()), 30)
+        for center in [self.prim, self.lone, self.comp]:
+            self.assertIsNone(center.time_dist)
+            self.assertIsNone(center.time)
+            self.assertIsNone(center.door_to_needle)
+
+    def test_subnetwork(self):
+        """Test that a subnetwork keeps transfer destinations and indices"""
+        sub = self.network.subnetwork([0])
+        self.assertEqual(sub.center_ids, ('P', 'C'))
+        np.testing.assert_array_equal(sub.transfer_index, [1, -1])
+        self.assertEqual(sub.transfer_time[0], 25)
+        self.assertEqual(sub.dtp_parameters['median'][1], 100)
+        self.assertEqual(sub.row(self.comp), 1)
+        no_transfer = self.network.subnetwork([0], transfers=[False])
+        self.assertEqual(no_transfer.center_ids, ('P',))
+        np.testing.assert_array_equal(no_transfer.transfer_index, [-1])
+        self.assertTrue(np.isnan(no_transfer.transfer_time[0]))
+        rows, bounds = self.network.reachable_bounds(
+            {'C': [50, 60], 'L': [np.nan] * 2, 'X': [1, 1], 'P': [20, 30]})
+        np.testing.assert_array_equal(rows, [0, 2])
+        np.testing.assert_array_equal(bounds, [[20, 30], [50, 60]])
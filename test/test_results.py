@@ -1,5 +1,6 @@
 import unittest
-from stroke import results, strategy
+import numpy as np
+from stroke import results, strategy, stroke_center as sc
 from . import helper
 
 
@@ -78,3 +79,63 @@ class ResultTestCase(unittest.TestCase):
         res2 = results.FormattedResult(strat2, qaly, cost, None)
 
         self.assertLess(res2, res1)
+
+
+class OptimalIndicesTestCase(unittest.TestCase):
+    '''Tests for the vectorized optimal strategy selection.'''
+
+    def setUp(self):
+        primaries, comprehensives = helper.get_centers()
+        for center in primaries + comprehensives:
+            center.time_dist = sc.TravelTimeDistribution(20, 20)
+            center.set_travel_time(1)
+        self.strategies = (
+            [strategy.Strategy.primary(x) for x in primaries] +
+            [strategy.Strategy.drip_and_ship(x) for x in primaries] +
+            [strategy.Strategy.comprehensive(x) for x in comprehensives]
+        )
+
+    def test_matches_get_optimal(self):
+        """Test that every row agrees with get_optimal, including ties"""
+        rng = np.random.RandomState(1)
+        n, n_strategies = 200, len(self.strategies)
+        qalys = rng.normal(10, 0.05, (n, n_strategies))
+        costs = rng.normal(60000, 3000, (n, n_strategies))
+        # identical strategies and strategies with equal benefit
+        qalys[:, 1] = qalys[:, 0]
+        costs[:n // 2, 1] = costs[:n // 2, 0]
+        qalys[rng.uniform(size=qalys.shape) < 0.2] = np.nan
+        qalys[-1] = np.nan
+
+        ranks = results.strategy_ranks(self.strategies)
+        fast = results.optimal_strategy_indices(qalys, costs, ranks, 100000)
+        for i in range(n):
+            data = [results.FormattedResult(s, qalys[i, j], costs[i, j], None)
+                    for j, s in enumerate(self.strategies)
+                    if not np.isnan(qalys[i, j])]
+            optimal = results.get_optimal(data, 100000)
+            if optimal is None:
+                expected = -1
+            else:
+                expected = self.strategies.index(optimal)
+            self.assertEqual(fast[i], expected)
+
+
+class LeadingShareTestCase(unittest.TestCase):
+    '''Tests for combining results and the leading destination's share.'''
+
+    def test_combine_and_interval(self):
+        """Test that combined counts give a Wilson interval"""
+        primaries, comprehensives = helper.get_centers()
+        prim = strategy.Strategy.primary(primaries[0])
+        comp = strategy.Strategy.comprehensive(comprehensives[0])
+        batches = [results.Results.certain(prim, 30, [prim, comp]),
+                   results.Results.certain(comp, 10, [prim, comp])]
+        combined = results.Results.combine(batches)
+        self.assertEqual(dict(combined.optimal_counts), {prim: 30, comp: 10})
+        convergence = combined.leading_share(0.95)
+        self.assertEqual(convergence.center, primaries[0])
+        self.assertEqual(convergence.n, 40)
+        self.assertEqual(convergence.share, 0.75)
+        self.assertAlmostEqual(convergence.low, 0.5981, places=4)
+        self.assertAlmostEqual(convergence.high, 0.8581, places=4)
@@ -0,0 +1,243 @@
+import unittest
+import numpy as np
+from stroke import (constants, patient, strategy, streams, stroke_model,
+                    times, stroke_center as sc)
+
+
+class RunLocationsTestCase(unittest.TestCase):
+    '''Tests for evaluating a block of map points in one model call.'''
+
+    def setUp(self):
+        """Generate hospitals and fixed travel times at a few locations"""
+        comps = [
+            sc.StrokeCenter(f'Comp {i}', f'C{i}',
+                            sc.CenterType.COMPREHENSIVE, f'C{i}')
+            for i in range(2)
+        ]
+        prims = []
+        for i in range(4):
+            prim = sc.StrokeCenter(f'Prim {i}', f'P{i}', sc.CenterType.PRIMARY,
+                                   f'P{i}')
+            if i < 3:
+                prim.add_transfer_destination(comps[i % 2], 30 + 10 * i)
+            prims.append(prim)
+        self.hospitals = prims + comps
+        self.patient = patient.Patient.with_RACE(constants.Sex.MALE, 70,
+                                                 60, 6)
+        rng = np.random.RandomState(4)
+        self.times_list = []
+        for _ in range(6):
+            these_times = {}
+            for hospital in self.hospitals:
+                if rng.uniform() < 0.7:
+                    time = rng.uniform(10, 90)
+                    these_times[hospital.center_id] = [time, time]
+                else:
+                    these_times[hospital.center_id] = [np.nan, np.nan]
+            self.times_list.append(these_times)
+
+    def test_matches_single_locations(self):
+        """Test that each location in a block matches running it alone"""
+        model = stroke_model.StrokeModel(self.patient, self.hospitals)
+        kwargs = {'n': 20, 'add_time_uncertainty': False,
+                  'add_lvo_uncertainty': False}
+        block_results, block_markov, block_times = model.run_locations(
+            self.times_list, **kwargs)
+        self.assertEqual(len(block_results), len(self.times_list))
+        for i, these_times in enumerate(self.times_list):
+            model.set_times(these_times)
+            results, markov, ais_times = model.run(**kwargs)
+            self.assertEqual(block_markov[i].strategies, markov.strategies)
+            self.assertEqual(block_times[i].primaries, ais_times.primaries)
+            np.testing.assert_allclose(block_markov[i].qalys, markov.qalys)
+            np.testing.assert_allclose(block_markov[i].costs, markov.costs)
+            self.assertEqual(dict(block_results[i].optimal_counts),
+                             dict(results.optimal_counts))
+
+    def test_matches_single_patients(self):
+        """Test that each patient in a batch matches running it alone"""
+        patients = [
+            patient.Patient.with_RACE(constants.Sex.MALE, 70, 60, 6),
+            patient.Patient.with_RACE(constants.Sex.FEMALE, 55, 30, 2),
+            patient.Patient.with_NIHSS(constants.Sex.FEMALE, 82, 150, 18),
+        ]
+        kwargs = {'n': 20, 'add_time_uncertainty': False,
+                  'add_lvo_uncertainty': False}
+        model = stroke_model.StrokeModel(patients[0], self.hospitals)
+        model.set_times(self.times_list[0])
+        batch_results, batch_markov, batch_times = model.run_patients(
+            patients, **kwargs)
+        self.assertEqual(len(batch_results), len(patients))
+        for i, this_patient in enumerate(patients):
+            single = stroke_model.StrokeModel(this_patient, self.hospitals)
+            single.set_times(self.times_list[0])
+            results, markov, ais_times = single.run(**kwargs)
+            self.assertEqual(batch_markov[i].strategies, markov.strategies)
+            np.testing.assert_allclose(batch_times[i].onset_needle_primary,
+                                       ais_times.onset_needle_primary)
+            np.testing.assert_allclose(batch_markov[i].qalys, markov.qalys)
+            np.testing.assert_allclose(batch_markov[i].costs, markov.costs)
+            self.assertEqual(dict(batch_results[i].optimal_counts),
+                             dict(results.optimal_counts))
+
+    def test_patient_streams(self):
+        """Test that patients with their own streams get the same draws
+            whichever other patients are in the batch"""
+        patients = [
+            patient.Patient.with_RACE(constants.Sex.MALE, 70, 60, 6, pid=0),
+            patient.Patient.with_RACE(constants.Sex.FEMALE, 55, 30, 2, pid=1),
+            patient.Patient.with_RACE(constants.Sex.MALE, 80, 90, 8, pid=2),
+        ]
+        model = stroke_model.StrokeModel(patients[0], self.hospitals)
+        model.set_times(self.times_list[0])
+        runs = []
+        for batch in [patients, patients[1:]]:
+            runs.append(model.run_patients(
+                batch, n=30, rng=streams.seed_sequence(7),
+                patient_rngs=[streams.seed_sequence(7, p.pid)
+                              for p in batch]))
+        (full_results, full_markov, full_times), \
+            (part_results, part_markov, part_times) = runs
+        for i in range(2):
+            np.testing.assert_array_equal(part_times[i].p_lvo,
+                                          full_times[i + 1].p_lvo)
+            np.testing.assert_array_equal(part_markov[i].qalys,
+                                          full_markov[i + 1].qalys)
+            self.assertEqual(dict(part_results[i].optimal_counts),
+                             dict(full_results[i + 1].optimal_counts))
+
+    def test_common_hospital_draws(self):
+        """Test that shared hospital draws are reused at every location"""
+        model = stroke_model.StrokeModel(self.patient, self.hospitals)
+        draws = times.HospitalDraws(self.hospitals, 20, seed=3)
+        same_draws = times.HospitalDraws(self.hospitals, 20, seed=3)
+        np.testing.assert_array_equal(draws.door_to_needle_draws,
+                                      same_draws.door_to_needle_draws)
+        kwargs = {'n': 20, 'add_lvo_uncertainty': False,
+                  'hospital_draws': draws}
+        block_results, block_markov, _ = model.run_locations(
+            self.times_list, **kwargs)
+        for i, these_times in enumerate(self.times_list):
+            model.set_times(these_times)
+            results, markov, _ = model.run(**kwargs)
+            np.testing.assert_allclose(block_markov[i].qalys, markov.qalys)
+            self.assertEqual(dict(block_results[i].optimal_counts),
+                             dict(results.optimal_counts))
+
+    def test_seeded_streams(self):
+        """Test that a location seeded in a block gets exactly the draws of
+            a single run with the same seed"""
+        model = stroke_model.StrokeModel(self.patient, self.hospitals)
+        seeds = [streams.seed_sequence(5, 0, i)
+                 for i in range(len(self.times_list))]
+        block_results, block_markov, block_times = model.run_locations(
+            self.times_list, n=30, fix_performance=True, rngs=seeds)
+        for i, these_times in enumerate(self.times_list):
+            model.set_times(these_times)
+            results, markov, ais_times = model.run(
+                n=30, fix_performance=True,
+                rng=streams.seed_sequence(5, 0, i))
+            np.testing.assert_array_equal(block_markov[i].qalys, markov.qalys)
+            np.testing.assert_array_equal(block_times[i].p_lvo,
+                                          ais_times.p_lvo)
+            self.assertEqual(dict(block_results[i].optimal_counts),
+                             dict(results.optimal_counts))
+        _, other, _ = model.run(n=30, rng=streams.seed_sequence(5, 1, 0))
+        self.assertFalse(np.array_equal(other.qalys, markov.qalys))
+
+    def test_run_sequential(self):
+        """Test that batches are kept until the leading share converges"""
+        model = stroke_model.StrokeModel(self.patient, self.hospitals)
+        model.set_times(self.times_list[0])
+        these_results, markov, ais_times = model.run_sequential(
+            batch_size=50, max_n=400, tolerance=0.05)
+        convergence = these_results.convergence
+        self.assertEqual(sum(these_results.optimal_counts.values()),
+                         convergence.n)
+        self.assertEqual(convergence.n % 50, 0)
+        self.assertTrue(convergence.half_width <= 0.05 or
+                        convergence.n == 400)
+        self.assertEqual(markov.qalys.shape[0], convergence.n)
+        self.assertEqual(ais_times.onset_needle_primary.shape[0],
+                         convergence.n)
+
+    def test_single_precision(self):
+        """Test that float32 runs stay float32 and match float64 counts"""
+        model = stroke_model.StrokeModel(self.patient, self.hospitals,
+                                         dtype=np.float32)
+        model.set_times(self.times_list[0])
+        _, markov, ais_times = model.run(n=30, rng=3)
+        for values in [ais_times.onset_evt_ship, ais_times.p_lvo,
+                       markov.ais_outcomes.p_good, markov.qalys,
+                       markov.costs]:
+            self.assertEqual(values.dtype, np.float32)
+        low, high, moved = stroke_model.compare_precision(model, n=200)
+        self.assertEqual(sum(low.values()), 200)
+        self.assertEqual(sum(high.values()), 200)
+        self.assertLessEqual(moved, 0.01)
+
+    def test_run_chunked(self):
+        """Test that chunks add up to every model run, and that a run that
+            fits in one chunk matches run"""
+        model = stroke_model.StrokeModel(self.patient, self.hospitals)
+        model.set_times(self.times_list[0])
+        results, _, _ = model.run(n=40, rng=2)
+        chunked = model.run_chunked(n=40, rng=2)
+        self.assertEqual(dict(chunked.optimal_counts),
+                         dict(results.optimal_counts))
+        chunks = []
+        draws = times.HospitalDraws(self.hospitals, 40)
+        chunked = model.run_chunked(
+            n=40, memory_budget=2**10, hospital_draws=draws, rng=2,
+            accumulate=lambda markov, _: chunks.append(len(markov.qalys)))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(len(set(chunks[:-1])), 1)
+        self.assertEqual(sum(chunks), 40)
+        self.assertEqual(sum(chunked.optimal_counts.values()), 40)
+
+
+class PruningTestCase(unittest.TestCase):
+    '''Tests for leaving out strategies that can never be optimal.'''
+
+    def setUp(self):
+        """
+        Generate a near and a far comprehensive center, with times always
+            within the tPA and EVT limits, and a primary center too far
+            from its transfer destination for drip and ship
+        """
+        self.near = sc.StrokeCenter('Near', 'N', sc.CenterType.COMPREHENSIVE,
+                                    'N')
+        self.far = sc.StrokeCenter('Far', 'F', sc.CenterType.COMPREHENSIVE,
+                                   'F')
+        self.prim = sc.StrokeCenter('Prim', 'P', sc.CenterType.PRIMARY, 'P')
+        self.prim.add_transfer_destination(self.far, 300)
+        self.patient = patient.Patient.with_RACE(constants.Sex.FEMALE, 70,
+                                                 30, 7)
+        self.model = stroke_model.StrokeModel(
+            self.patient, [self.prim, self.near, self.far])
+
+    def test_dominated_strategies(self):
+        """Test that pruned strategies get zero counts and change nothing"""
+        self.model.set_times({'P': [20, 20], 'N': [5, 5], 'F': [120, 120]})
+        kwargs = {'n': 50, 'add_time_uncertainty': False,
+                  'add_lvo_uncertainty': False}
+        full, _, _ = self.model.run(**kwargs)
+        pruned, markov, ais_times = self.model.run(prune=True, **kwargs)
+        self.assertEqual(dict(pruned.optimal_counts),
+                         dict(full.optimal_counts))
+        # the far center is dominated and drip and ship can't reach EVT
+        self.assertEqual(ais_times.comprehensives, [self.near])
+        self.assertTrue(np.isnan(ais_times.onset_evt_ship).all())
+        self.assertEqual(len(markov.strategies), 3)
+
+    def test_single_candidate(self):
+        """Test that a location with one candidate isn't simulated"""
+        self.model.set_times({'N': [5, 8], 'F': [120, 125]})
+        full, _, _ = self.model.run(n=50)
+        results, markov, ais_times = self.model.run(n=50, prune=True)
+        self.assertIsNone(markov)
+        self.assertIsNone(ais_times)
+        self.assertEqual(dict(results.optimal_counts),
+                         dict(full.optimal_counts))
+        self.assertEqual(results.optimal_counts[
+            strategy.Strategy.comprehensive(self.near)], 50)
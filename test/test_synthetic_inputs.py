@@ -0,0 +1,49 @@
+import tempfile
+import unittest
+import numpy as np
+import data_io
+import synthetic_inputs
+import travel_times
+from stroke import stroke_center as sc
+
+
+class SyntheticInputsTestCase(unittest.TestCase):
+    '''Tests for generating synthetic input files.'''
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_readable_inputs(self):
+        """Test that generated files load like the real inputs"""
+        hospital_file, dtn_file, times_file = synthetic_inputs.write_inputs(
+            self.dir.name, locations=50, hospitals=30, pair_share=0.5,
+            seed=3)
+        hospitals = data_io.get_hospitals(hospital_file, dtn_file)
+        self.assertEqual(len(hospitals), 30)
+        comps = [h for h in hospitals
+                 if h.center_type is sc.CenterType.COMPREHENSIVE]
+        self.assertEqual(len(comps), 8)
+        for hospital in hospitals:
+            if hospital.center_type is sc.CenterType.PRIMARY:
+                self.assertIn(hospital.transfer_destination, comps)
+
+        times = travel_times.load_travel_times(times_file, cache=False)
+        self.assertEqual(times.times.shape, (50, 30, 2))
+        self.assertEqual(set(times.hospitals),
+                         {str(h.center_id) for h in hospitals})
+        reachable = ~np.isnan(times.times[..., 0])
+        self.assertTrue(reachable.any(axis=1).all())
+        self.assertTrue((times.times[..., 1][reachable] >=
+                         times.times[..., 0][reachable]).all())
+        # about half of the reachable times are pairs
+        is_pair = times.times[..., 1] > times.times[..., 0]
+        self.assertLess(abs(is_pair.sum() / reachable.sum() - 0.5), 0.15)
+
+        again = synthetic_inputs.write_inputs(
+            self.dir.name + '/again', locations=50, hospitals=30,
+            pair_share=0.5, seed=3)
+        with open(times_file) as f, open(again[2]) as g:
+            self.assertEqual(f.read(), g.read())
@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import unittest
+import main
+import synthetic_inputs
+from stroke import timing
+
+
+class TimingTestCase(unittest.TestCase):
+    '''Tests for stage timers and counters.'''
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.files = synthetic_inputs.write_inputs(self.dir.name, locations=4,
+                                                   hospitals=6, seed=1)
+
+    def tearDown(self):
+        timing.disable()
+        self.dir.cleanup()
+
+    def _run(self, cores, name):
+        hospital_file, dtn_file, times_file = self.files
+        timing.enable()
+        main.run_model_real_data(
+            times_file, hospital_file, dtn_file, patient_count=2,
+            simulation_count=50, cores=cores, seed=3,
+            res_name=os.path.join(self.dir.name, f'{name}_afAHA.csv'))
+        return timing.disable().summary()
+
+    def test_workers_merged(self):
+        """Test that counters recorded in pool workers match a run in one
+            process, and that the summary is JSON"""
+        single = self._run(False, 'single')
+        pooled = json.loads(json.dumps(self._run(None, 'pooled')))
+        # each worker writes its own outcome part file, with a header
+        bytes_written = pooled['counts'].pop('bytes written')
+        self.assertGreaterEqual(bytes_written,
+                                single['counts'].pop('bytes written'))
+        self.assertEqual(pooled['counts'], single['counts'])
+        self.assertEqual(single['counts']['model calls'], 8)
+        self.assertEqual(single['counts']['simulations'], 400)
+        self.assertEqual(set(pooled['stages']), set(single['stages']))
+        for stage in ['sample times', 'run all strategies', 'analyze',
+                      'results', 'write outcomes', 'save patient']:
+            self.assertEqual(pooled['stages'][stage]['calls'],
+                             single['stages'][stage]['calls'])
+        self.assertEqual(single['processes'], 1)
+        self.assertGreater(pooled['processes'], 1)
+
+    def test_disabled(self):
+        """Test that nothing is recorded unless enabled"""
+        with timing.stage('run'):
+            timing.count('scenarios')
+        self.assertFalse(timing.enabled())
+        result, timings = timing.timed(sum, [1, 2])
+        self.assertEqual(result, 3)
+        self.assertEqual(timings.summary()['stages'], {})
@@ -0,0 +1,96 @@
+import os
+import pickle
+import tempfile
+import unittest
+import numpy as np
+import travel_times
+
+
+class TravelTimesTestCase(unittest.TestCase):
+    '''Tests for parsing and caching travel time files.'''
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.times_file = os.path.join(self.dir.name, 'times.csv')
+        with open(self.times_file, 'w') as f:
+            f.write('LOC_ID,330,126,125\n')
+            f.write('L0,12.5,"40, 30",\n')
+            f.write('L1,,7,"3,4"\n')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_parse(self):
+        """Test that single times and pairs are parsed into arrays"""
+        times = travel_times.parse_travel_times(self.times_file)
+        self.assertEqual(times.locations, ('L0', 'L1'))
+        self.assertEqual(times.hospitals, ('330', '126', '125'))
+        self.assertEqual(times.times.dtype, np.float32)
+        np.testing.assert_array_equal(
+            times.times,
+            [[[12.5, 12.5], [30, 40], [np.nan, np.nan]],
+             [[np.nan, np.nan], [7, 7], [3, 4]]])
+        self.assertEqual(times.to_dict()['L1']['125'], [3, 4])
+        np.testing.assert_array_equal(times.subset(['L1']).bounds('L1'),
+                                      times.times[1])
+
+    def test_cache(self):
+        """Test that the cache is reused until the file changes"""
+        times = travel_times.load_travel_times(self.times_file)
+        cached = [f for f in os.listdir(self.dir.name) if f != 'times.csv']
+        self.assertEqual(len(cached), 5)
+        np.testing.assert_array_equal(
+            travel_times.load_travel_times(self.times_file).times, times.times)
+
+        with open(self.times_file, 'a') as f:
+            f.write('L2,1,2,3\n')
+        times = travel_times.load_travel_times(self.times_file)
+        self.assertEqual(len(times), 3)
+        cached_again = [f for f in os.listdir(self.dir.name)
+                        if f != 'times.csv']
+        self.assertEqual(len(cached_again), 5)
+        self.assertNotEqual(set(cached), set(cached_again))
+
+    def test_memory_map(self):
+        """Test random access to memory-mapped times, shared by path"""
+        times = travel_times.open_travel_times(self.times_file)
+        self.assertIsInstance(times.times, np.memmap)
+        self.assertEqual(list(times), ['L0', 'L1'])
+        self.assertEqual(times['L0']['126'], [30, 40])
+        self.assertNotIn('125', times['L0'])
+        np.testing.assert_array_equal(times.bounds('L1', ['125', 'X', '330']),
+                                      [[3, 4], [np.nan] * 2, [np.nan] * 2])
+
+        copied = pickle.loads(pickle.dumps(times))
+        self.assertIsInstance(copied.times, np.memmap)
+        self.assertEqual(copied.source, times.source)
+        subset = times.subset(['L1'])
+        self.assertEqual(list(subset), ['L1'])
+        self.assertIsNone(subset.source)
+        np.testing.assert_array_equal(subset.bounds('L1'), times.times[1])
+
+    def test_sparse(self):
+        """Test that only reachable hospitals are kept for each location"""
+        times = travel_times.parse_travel_times(self.times_file)
+        np.testing.assert_array_equal(times.sparse.indptr, [0, 2, 4])
+        columns, bounds = times.reachable('L1')
+        np.testing.assert_array_equal(columns, [1, 2])
+        np.testing.assert_array_equal(bounds, [[7, 7], [3, 4]])
+        self.assertEqual(times['L0'], {'330': [12.5, 12.5], '126': [30, 40]})
+
+    def test_mapped_reachable(self):
+        """Test that mapped times find reachable hospitals in the sparse
+            form mapped from the cache"""
+        times = travel_times.open_travel_times(self.times_file)
+        dense = travel_times.parse_travel_times(self.times_file)
+        for location in times:
+            columns, bounds = times.reachable(location)
+            expected = dense.sparse.row(dense.location_index[location])
+            np.testing.assert_array_equal(columns, expected[0])
+            np.testing.assert_array_equal(bounds, expected[1])
+            self.assertEqual(columns.dtype, expected[0].dtype)
+        self.assertIsInstance(times._sparse.indices, np.memmap)
+        self.assertIsInstance(times._sparse.bounds, np.memmap)
+        copied = pickle.loads(pickle.dumps(times))
+        self.assertEqual(copied['L1'], {'126': [7, 7], '125': [3, 4]})
+        self.assertIsInstance(copied._sparse.indptr, np.memmap)
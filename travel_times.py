@@ -0,0 +1,320 @@
+"""
+Load travel time files into dense arrays, cached next to the source file
+"""
+import collections.abc
+import hashlib
+import json
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+NO_TRAFFIC = 0
+TRAFFIC = 1
+CACHE_VERSION = 2
+
+
+class TravelTimes(collections.abc.Mapping):
+    '''
+    Travel times from every location to every hospital in a times file, as
+        an array shaped (locations, hospitals, 2) holding (no traffic,
+        traffic) times, NaN where a hospital can't be reached.
+    Also a read-only mapping like the get_times dictionary, so
+        travel_times[location] is a dictionary of [no_traffic_time,
+        traffic_time] by hospital ID, built when it's accessed. Unlike
+        get_times, it only lists the hospitals that can be reached.
+    If the array is memory-mapped from a cache, pickling only sends the
+        cache path, and each process maps the file itself. Processes then
+        share one copy of the times in the page cache and only read the
+        rows they use. The cache also holds the sparse form, mapped the same
+        way, so finding the reachable hospitals of a location only reads
+        those hospitals.
+    '''
+
+    def __init__(self, times, locations, hospitals, source=None, sparse=None):
+        self.times = times
+        self.locations = tuple(locations)
+        self.hospitals = tuple(hospitals)
+        self.source = source
+        self.location_index = {loc: i for i, loc in enumerate(self.locations)}
+        self.hospital_index = {
+            hosp: i for i, hosp in enumerate(self.hospitals)
+        }
+        self._sparse = sparse
+
+    @property
+    def sparse(self):
+        '''
+        SparseTravelTimes of the reachable hospitals, from the cache or
+            built from every row on first use
+        '''
+        if self._sparse is None:
+            self._sparse = SparseTravelTimes.from_dense(self.times)
+        return self._sparse
+
+    def __getstate__(self):
+        state = {'locations': self.locations, 'hospitals': self.hospitals,
+                 'source': self.source}
+        if self.source is None:
+            state['times'] = self.times
+        return state
+
+    def __setstate__(self, state):
+        times = state.get('times')
+        sparse = None
+        if times is None:
+            times = np.load(state['source'], mmap_mode='r')
+            sparse = SparseTravelTimes.load(state['source'], mmap_mode='r')
+        self.__init__(times, state['locations'], state['hospitals'],
+                      state['source'], sparse)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def __contains__(self, location):
+        return location in self.location_index
+
+    def __getitem__(self, location):
+        columns, bounds = self.reachable(location)
+        return dict(zip([self.hospitals[col] for col in columns],
+                        bounds.tolist()))
+
+    def reachable(self, location):
+        '''
+        Columns of the hospitals that can be reached from a location, and
+            their (no traffic, traffic) times shaped (hospitals, 2). Read
+            from the sparse form if it's loaded, otherwise from the
+            location's row.
+        '''
+        i = self.location_index[location]
+        if self._sparse is not None:
+            columns, bounds = self._sparse.row(i)
+            return np.asarray(columns), np.asarray(bounds)
+        row = np.asarray(self.times[i])
+        columns = np.flatnonzero(~np.isnan(row).any(axis=1))
+        return columns.astype(np.int32), row[columns]
+
+    def columns(self, hospitals):
+        '''Columns of the given hospital IDs, -1 for hospitals not in the file'''
+        return np.array([self.hospital_index.get(str(hospital), -1)
+                         for hospital in hospitals], dtype=np.intp)
+
+    def bounds(self, location, hospitals=None):
+        '''
+        (no traffic, traffic) times from a location, shaped (hospitals, 2)
+            hospitals -- hospital IDs to get times for, in order, or their
+                         columns from columns(). Hospitals not in the file
+                         get NaN. Defaults to every hospital in file order.
+        '''
+        row = self.times[self.location_index[location]]
+        if hospitals is None:
+            return row
+        columns = np.asarray(hospitals)
+        if columns.dtype.kind not in 'iu':
+            columns = self.columns(hospitals)
+        bounds = np.asarray(row[np.maximum(columns, 0)], dtype=float)
+        bounds[columns < 0] = np.NaN
+        return bounds
+
+    def subset(self, locations):
+        '''
+        Travel times for only the given locations, in the given order. Only
+            those rows are read from a memory-mapped file.
+        '''
+        rows = [self.location_index[location] for location in locations]
+        return TravelTimes(np.asarray(self.times[rows]), locations,
+                           self.hospitals)
+
+    def to_dict(self):
+        '''
+        Travel times as a dictionary of dictionaries like get_times: outer
+            keys are location IDs, inner keys are hospital IDs and values
+            are [no_traffic_time, traffic_time]
+        '''
+        values = self.times.tolist()
+        return {
+            location: dict(zip(self.hospitals, row))
+            for location, row in zip(self.locations, values)
+        }
+
+
+class SparseTravelTimes:
+    '''
+    Compressed sparse row (CSR) form of travel times, keeping only the
+        hospitals that can be reached from each location. The reachable
+        hospital columns of location i are indices[indptr[i]:indptr[i + 1]]
+        and their times are the same rows of bounds.
+    '''
+
+    def __init__(self, indptr, indices, bounds):
+        self.indptr = indptr
+        self.indices = indices
+        self.bounds = bounds
+
+    @classmethod
+    def from_dense(cls, times):
+        '''Build from an array shaped (locations, hospitals, 2)'''
+        times = np.asarray(times)
+        reachable = ~np.isnan(times).any(axis=2)
+        locations, columns = np.nonzero(reachable)
+        indptr = np.zeros(len(times) + 1, dtype=np.int64)
+        np.cumsum(reachable.sum(axis=1), out=indptr[1:])
+        return cls(indptr, columns.astype(np.int32),
+                   times[locations, columns])
+
+    @classmethod
+    def load(cls, times_path, mmap_mode=None):
+        '''
+        Load the arrays saved next to a cached times array by save
+            mmap_mode -- passed to np.load to memory-map the arrays
+        '''
+        return cls(*[np.load(path, mmap_mode=mmap_mode)
+                     for path in _sparse_paths(times_path)])
+
+    def save(self, times_path):
+        '''Save the arrays next to a cached times array'''
+        for path, values in zip(_sparse_paths(times_path),
+                                [self.indptr, self.indices, self.bounds]):
+            _save_atomic(path, lambda f: np.save(f, values))
+
+    def row(self, i):
+        '''Reachable hospital columns and times of the location in row i'''
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:stop], self.bounds[start:stop]
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+
+def open_travel_times(times_file):
+    '''
+    Memory-map the cached travel times of a file read-only, parsing and
+        caching it first if needed. See load_travel_times.
+    '''
+    return load_travel_times(times_file, mmap_mode='r')
+
+
+def load_travel_times(times_file, cache=True, mmap_mode=None):
+    '''
+    Read a travel times file formatted like `data/travel_times/Demo.csv`
+        into TravelTimes. The parsed arrays are saved next to the file,
+        keyed by a hash of its contents, and reloaded from there while the
+        file is unchanged.
+        mmap_mode -- passed to np.load to memory-map the cached array
+    '''
+    if not cache:
+        return parse_travel_times(times_file)
+    key = file_hash(times_file)
+    times_path, index_path = _cache_paths(times_file, key)
+    cached = [times_path, index_path] + _sparse_paths(times_path)
+    if all(path.is_file() for path in cached):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index.get('version') == CACHE_VERSION:
+            return _load_cache(times_path, index, mmap_mode)
+
+    travel_times = parse_travel_times(times_file)
+    index = {
+        'version': CACHE_VERSION,
+        'source': os.path.basename(str(times_file)),
+        'locations': list(travel_times.locations),
+        'hospitals': list(travel_times.hospitals),
+    }
+    try:
+        _remove_stale_caches(times_file)
+        _save_atomic(times_path, lambda f: np.save(f, travel_times.times))
+        travel_times.sparse.save(times_path)
+        _save_atomic(index_path,
+                     lambda f: f.write(json.dumps(index).encode()))
+    except OSError:
+        return travel_times # e.g. a read-only data directory, don't cache
+    if mmap_mode is not None:
+        return _load_cache(times_path, index, mmap_mode)
+    return travel_times
+
+
+def _load_cache(times_path, index, mmap_mode=None):
+    times = np.load(times_path, mmap_mode=mmap_mode)
+    sparse = SparseTravelTimes.load(times_path, mmap_mode=mmap_mode)
+    source = str(times_path) if mmap_mode is not None else None
+    return TravelTimes(times, index['locations'], index['hospitals'], source,
+                       sparse)
+
+
+def parse_travel_times(times_file, dtype=np.float32):
+    '''
+    Parse a travel times file without caching. Locations are rows keyed by
+        the LOC_ID column (or the first column if there isn't one) and
+        hospitals are the remaining columns. Each cell is a single travel
+        time or a "no_traffic_time, traffic_time" pair, in either order.
+    '''
+    df = pd.read_csv(times_file, dtype=str, low_memory=False)
+    index_col = 'LOC_ID' if 'LOC_ID' in df.columns else df.columns[0]
+    locations = df[index_col].tolist()
+    hospitals = [col for col in df.columns if col != index_col]
+
+    cells = pd.Series(df[hospitals].to_numpy().ravel()).dropna()
+    first = np.full(len(df) * len(hospitals), np.NaN)
+    second = np.full(len(df) * len(hospitals), np.NaN)
+    is_pair = cells.str.contains(',', regex=False).to_numpy()
+    single = pd.to_numeric(cells[~is_pair]).to_numpy()
+    first[cells.index[~is_pair]] = single
+    second[cells.index[~is_pair]] = single
+    if is_pair.any():
+        pairs = cells[is_pair].str.split(',', expand=True)
+        if pairs.shape[1] != 2:
+            err_msg = 'Time value needs to be in format of'
+            err_msg += 'no_traffic_time, traffic_time or just one number'
+            raise ValueError(err_msg)
+        first[pairs.index] = pd.to_numeric(pairs[0]).to_numpy()
+        second[pairs.index] = pd.to_numeric(pairs[1]).to_numpy()
+
+    shape = (len(df), len(hospitals))
+    times = np.empty(shape + (2,), dtype=dtype)
+    times[..., NO_TRAFFIC] = np.minimum(first, second).reshape(shape)
+    times[..., TRAFFIC] = np.maximum(first, second).reshape(shape)
+    return TravelTimes(times, locations, hospitals)
+
+
+def file_hash(path):
+    '''SHA-1 hex digest of a file's contents'''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_paths(times_file, key):
+    prefix = str(times_file) + f'.{key[:16]}'
+    return Path(prefix + '.times.npy'), Path(prefix + '.index.json')
+
+
+def _sparse_paths(times_path):
+    '''Paths of the indptr, indices and bounds saved next to a times cache'''
+    prefix = str(times_path)[:-len('.times.npy')]
+    return [Path(prefix + f'.{name}.npy')
+            for name in ['indptr', 'indices', 'bounds']]
+
+
+def _remove_stale_caches(times_file):
+    '''Remove caches of earlier versions of the times file'''
+    times_file = Path(times_file)
+    for suffix in ['.times.npy', '.indptr.npy', '.indices.npy',
+                   '.bounds.npy', '.index.json']:
+        for stale in times_file.parent.glob(times_file.name + '.*' + suffix):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def _save_atomic(path, write):
+    '''Write a file through a temporary file so readers never see part of it'''
+    tmp_path = Path(str(path) + f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)